@@ -0,0 +1,292 @@
+"""ai.py - Built-in computer opponent for single player games.
+Positions are folded under the 8 symmetries of the square board so that
+equivalent positions share one transposition table entry. The 3 x 3 game is
+solved completely the first time it is needed (a few hundred canonical
+positions), after which every reply is a table lookup. Bigger boards use a
+depth-limited alpha-beta search with a bounded LRU transposition table. Like
+engine.py this module has no App Engine dependencies."""
+
+import random
+from collections import OrderedDict
+
+import engine
+
+EASY = 'easy'
+MEDIUM = 'medium'
+HARD = 'hard'
+DIFFICULTIES = (EASY, MEDIUM, HARD)
+# chance that the bot plays a random move instead of the best one
+MISTAKE_RATE = {EASY: 1.0, MEDIUM: 0.3, HARD: 0.0}
+
+# boards up to this many cells are solved completely
+MAX_SOLVED_CELLS = 9
+# search depth (plies) for boards that are not solved completely
+SEARCH_DEPTH = {4: 4, 5: 3}
+DEFAULT_SEARCH_DEPTH = 3
+# transposition table entries kept per board variant for the search
+MAX_CACHE_ENTRIES = 100000
+
+WIN_SCORE = 1000
+
+_SYMMETRIES = {}
+_SOLVED = {}
+_CACHES = {}
+
+
+def _permutations(size):
+    """Returns the 8 symmetries of a size x size board as cell maps"""
+    perms = []
+    for flip in (False, True):
+        for turns in range(4):
+            perm = []
+            for cell in range(size * size):
+                row, col = divmod(cell, size)
+                if flip:
+                    col = size - 1 - col
+                for _ in range(turns):
+                    row, col = col, size - 1 - row
+                perm.append(row * size + col)
+            perms.append(perm)
+    return perms
+
+
+def _byte_tables(perm):
+    """Returns per-byte lookup tables that apply perm to a bit mask"""
+    tables = []
+    for start in range(0, len(perm), 8):
+        table = []
+        for byte in range(256):
+            mapped = 0
+            for bit in range(8):
+                if byte >> bit & 1 and start + bit < len(perm):
+                    mapped |= 1 << perm[start + bit]
+            table.append(mapped)
+        tables.append(table)
+    return tables
+
+
+def symmetries(size):
+    """Returns [(byte tables, inverse cell map)] for the 8 symmetries.
+    Built once per board size and cached for the process."""
+    if size not in _SYMMETRIES:
+        symmetry = []
+        for perm in _permutations(size):
+            inverse = [0] * len(perm)
+            for cell, target in enumerate(perm):
+                inverse[target] = cell
+            symmetry.append((_byte_tables(perm), inverse))
+        _SYMMETRIES[size] = symmetry
+    return _SYMMETRIES[size]
+
+
+def _transform(bits, tables):
+    mapped = 0
+    for table in tables:
+        mapped |= table[bits & 255]
+        bits >>= 8
+    return mapped
+
+
+def canonical(mine, theirs, size):
+    """Returns (key, inverse) for a position given as the bit masks of the
+    player to move and the opponent. key identifies the position up to
+    symmetry and inverse maps cells of the canonical position back onto
+    the given one"""
+    cells = size * size
+    best = None
+    for tables, inverse in symmetries(size):
+        key = _transform(mine, tables) | (_transform(theirs, tables) << cells)
+        if best is None or key < best[0]:
+            best = (key, inverse)
+    return best
+
+
+class _Context(object):
+
+    """Per board variant tables shared by the solver and the search"""
+
+    def __init__(self, size, win_length):
+        self.size = size
+        self.cells = size * size
+        self.full = (1 << self.cells) - 1
+        self.lines, self.by_cell, self.wins = engine.tables(size, win_length)
+        center = (size - 1) / 2.0
+        self.order = sorted(range(self.cells), key=lambda cell: (
+            abs(cell // size - center) + abs(cell % size - center)))
+
+    def is_win(self, bits, cell):
+        if self.wins is not None:
+            return self.wins[bits]
+        for mask in self.by_cell[cell]:
+            if bits & mask == mask:
+                return True
+        return False
+
+    def free(self, mine, theirs):
+        taken = mine | theirs
+        return [cell for cell in self.order if not taken & (1 << cell)]
+
+
+def _solve(ctx, mine, theirs, table):
+    """Solves a position exactly. Fills table with canonical key ->
+    (score, best canonical moves) and returns the score for the player to
+    move: 1 + empty cells for a win (faster wins score higher), 0 for a
+    draw"""
+    key, _ = canonical(mine, theirs, ctx.size)
+    if key in table:
+        return table[key][0]
+    mine = key & ctx.full
+    theirs = key >> ctx.cells
+    best, moves = None, []
+    free = ctx.free(mine, theirs)
+    for cell in free:
+        after = mine | (1 << cell)
+        if ctx.is_win(after, cell):
+            score = len(free)
+        elif len(free) == 1:
+            score = 0
+        else:
+            score = -_solve(ctx, theirs, after, table)
+        if best is None or score > best:
+            best, moves = score, [cell]
+        elif score == best:
+            moves.append(cell)
+    table[key] = (best, moves)
+    return best
+
+
+def solved_table(size=engine.DEFAULT_SIZE, win_length=engine.DEFAULT_SIZE):
+    """Returns the complete canonical position table of a small board,
+    solving it the first time it is asked for"""
+    variant = (size, win_length)
+    if variant not in _SOLVED:
+        table = {}
+        _solve(_Context(size, win_length), 0, 0, table)
+        _SOLVED[variant] = table
+    return _SOLVED[variant]
+
+
+class LRUCache(object):
+
+    """Bounded mapping that evicts the least recently used entry"""
+
+    def __init__(self, max_entries=MAX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._entries[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_EXACT, _LOWER, _UPPER = 0, 1, 2
+
+
+def _evaluate(ctx, mine, theirs):
+    """Heuristic score of a quiet position for the player to move: lines
+    still open to one player, weighted by how many marks they hold"""
+    score = 0
+    for mask in ctx.lines:
+        if not theirs & mask:
+            score += _popcount(mine & mask) ** 2
+        if not mine & mask:
+            score -= _popcount(theirs & mask) ** 2
+    return max(-WIN_SCORE + 1, min(WIN_SCORE - 1, score))
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+def _search(ctx, mine, theirs, depth, alpha, beta, cache):
+    """Depth-limited negamax with alpha-beta pruning. Returns (score,
+    best canonical move) for the player to move"""
+    key, _ = canonical(mine, theirs, ctx.size)
+    mine = key & ctx.full
+    theirs = key >> ctx.cells
+    entry = cache.get(key)
+    if entry and entry[0] >= depth:
+        _, flag, score, move = entry
+        if (flag == _EXACT or (flag == _LOWER and score >= beta) or
+                (flag == _UPPER and score <= alpha)):
+            return score, move
+
+    free = ctx.free(mine, theirs)
+    if entry and entry[3] in free:
+        free.remove(entry[3])
+        free.insert(0, entry[3])
+    original_alpha = alpha
+    best, best_move = None, None
+    for cell in free:
+        after = mine | (1 << cell)
+        if ctx.is_win(after, cell):
+            score = WIN_SCORE + len(free)
+        elif len(free) == 1:
+            score = 0
+        elif depth <= 1:
+            score = -_evaluate(ctx, theirs, after)
+        else:
+            score = -_search(ctx, theirs, after, depth - 1, -beta, -alpha,
+                             cache)[0]
+        if best is None or score > best:
+            best, best_move = score, cell
+        alpha = max(alpha, score)
+        if alpha >= beta:
+            break
+
+    if best <= original_alpha:
+        flag = _UPPER
+    elif best >= beta:
+        flag = _LOWER
+    else:
+        flag = _EXACT
+    cache.put(key, (depth, flag, best, best_move))
+    return best, best_move
+
+
+def _cache_for(size, win_length):
+    variant = (size, win_length)
+    if variant not in _CACHES:
+        _CACHES[variant] = LRUCache()
+    return _CACHES[variant]
+
+
+def best_moves(board, player):
+    """Returns the best moves for player on an engine.Board"""
+    mine = board.player_bits(player)
+    theirs = board.player_bits(engine.PLAYER2 if player == engine.PLAYER1
+                               else engine.PLAYER1)
+    key, inverse = canonical(mine, theirs, board.size)
+    if board.cells <= MAX_SOLVED_CELLS:
+        moves = solved_table(board.size, board.win_length)[key][1]
+    else:
+        ctx = _Context(board.size, board.win_length)
+        depth = SEARCH_DEPTH.get(board.size, DEFAULT_SEARCH_DEPTH)
+        moves = [_search(ctx, key & ctx.full, key >> ctx.cells, depth,
+                         -2 * WIN_SCORE, 2 * WIN_SCORE,
+                         _cache_for(board.size, board.win_length))[1]]
+    return [inverse[move] for move in moves]
+
+
+def choose_move(board, player, difficulty=HARD, rand=random):
+    """Returns the cell the bot plays for player on an engine.Board.
+    The board must have at least one free cell"""
+    if rand.random() < MISTAKE_RATE[difficulty]:
+        return rand.choice(board.free_cells())
+    return rand.choice(best_moves(board, player))
+
+
+def warm_up():
+    """Solves the standard board ahead of the first game"""
+    solved_table()
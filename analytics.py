@@ -0,0 +1,386 @@
+"""analytics.py - Offline statistics over exported game histories.
+Reads the newline-delimited JSON records of an export (see transfer.py), or
+the Game, GameArchive and Score entities of a datastore such as the testbed,
+in chunks of CHUNK_SIZE records. Each chunk of games becomes columnar NumPy
+arrays (the moves as a games x cells uint8 matrix padded with NO_MOVE, the
+outcomes as codes) that are folded into running totals, so memory depends on
+the number of board variants and players rather than the number of games.
+The summary is JSON; posted to /admin/game_stats it becomes the GameStats
+entity served by get_game_stats.
+Needs NumPy, which the application itself never imports.
+Run from the project root with: python analytics.py --help"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+import engine
+
+# records of each kind turned into arrays at a time
+CHUNK_SIZE = 100000
+NO_MOVE = 255
+# outcome codes, a win is coded as the winning player
+UNFINISHED = 0
+TIE = 3
+OUTCOMES = {UNFINISHED: 'unfinished', engine.PLAYER1: 'player1',
+            engine.PLAYER2: 'player2', TIE: 'tie'}
+# score result codes
+RESULTS = ('win', 'lose', 'tie')
+# months since 1970 fit in this many values per player
+MONTH_SPAN = 1 << 12
+TOP_OPENINGS = 10
+TOP_PLAYERS = 100
+
+
+def _rate(part, whole):
+    return float(part) / whole if whole else None
+
+
+def _variant_name(size, win_length):
+    return '{0}x{0}/{1}'.format(size, win_length)
+
+
+def game_moves(record):
+    """Returns (moves, first player) of a game record. Records of games
+    saved before moves were packed carry a history list instead"""
+    if record.get('moves'):
+        return record['moves'], record['first_player']
+    history = sorted(record.get('history') or [],
+                     key=lambda entry: entry['seq'])
+    if not history:
+        return [], None
+    first = engine.PLAYER1 if history[0]['player'] == \
+        record['player1_name'] else engine.PLAYER2
+    return [entry['move'] for entry in history], first
+
+
+class VariantStats(object):
+
+    """Running totals for the games of one board variant"""
+
+    def __init__(self, size, win_length):
+        self.size = size
+        self.win_length = win_length
+        self.cells = cells = size * size
+        self.lines = np.array(engine.tables(size, win_length)[0], np.int64)
+        self.bits = np.left_shift(np.int64(1), np.arange(cells,
+                                                         dtype=np.int64))
+        self.games = 0
+        self.no_history = 0
+        self.outcomes = np.zeros(4, np.int64)
+        self.lengths = np.zeros(cells + 1, np.int64)
+        self.openings = np.zeros(cells, np.int64)
+        self.opening_finished = np.zeros(cells, np.int64)
+        self.opening_wins = np.zeros(cells, np.int64)
+        self.opening_ties = np.zeros(cells, np.int64)
+        self.pairs = np.zeros(cells * cells, np.int64)
+        self.pair_finished = np.zeros(cells * cells, np.int64)
+        self.pair_wins = np.zeros(cells * cells, np.int64)
+        self.cell_played = np.zeros(cells, np.int64)
+        self.cell_wins = np.zeros(cells, np.int64)
+
+    def arrays(self, records):
+        """Returns the (moves, first player, game over) arrays of a chunk of
+        game records. Games without moves are only counted"""
+        rows = []
+        for record in records:
+            moves, first = game_moves(record)
+            if moves:
+                rows.append((moves, first, record['game_over']))
+            else:
+                self.no_history += 1
+        self.games += len(records) - len(rows)
+        moves = np.full((len(rows), self.cells), NO_MOVE, np.uint8)
+        for row, (played, _, _) in enumerate(rows):
+            moves[row, :len(played)] = played
+        first = np.array([row[1] for row in rows], np.uint8)
+        game_over = np.array([row[2] for row in rows], np.bool_)
+        return moves, first, game_over
+
+    def add(self, moves, first, game_over):
+        """Folds a chunk of games with at least one move into the totals"""
+        count = len(moves)
+        if not count:
+            return
+        valid = moves != NO_MOVE
+        lengths = valid.sum(axis=1)
+        # owner of every cell, players alternate from the first player
+        rows, turns = np.nonzero(valid)
+        other = 3 - first
+        owner = np.zeros((count, self.cells), np.uint8)
+        owner[rows, moves[rows, turns]] = np.where(
+            turns % 2 == 0, first[rows], other[rows])
+
+        # a finished game was won by the last player to move if they hold
+        # a whole line, and is a tie otherwise
+        last = np.where((lengths - 1) % 2 == 0, first, other)
+        last_bits = ((owner == last[:, None]) * self.bits).sum(axis=1)
+        won = ((last_bits[:, None] & self.lines) == self.lines).any(axis=1)
+        outcome = np.where(game_over, np.where(won, last, TIE), UNFINISHED)
+        finished = outcome != UNFINISHED
+        first_won = outcome == first
+
+        self.games += count
+        self.outcomes += np.bincount(outcome, minlength=4)
+        self.lengths += np.bincount(lengths[finished],
+                                    minlength=self.cells + 1)
+
+        cells = self.cells
+        opening = moves[:, 0].astype(np.int64)
+        self.openings += np.bincount(opening, minlength=cells)
+        self.opening_finished += np.bincount(opening[finished],
+                                             minlength=cells)
+        self.opening_wins += np.bincount(
+            opening[finished & first_won], minlength=cells)
+        self.opening_ties += np.bincount(
+            opening[outcome == TIE], minlength=cells)
+
+        two = lengths >= 2
+        pair = opening * cells + moves[:, 1].astype(np.int64)
+        self.pairs += np.bincount(pair[two], minlength=cells * cells)
+        self.pair_finished += np.bincount(pair[two & finished],
+                                          minlength=cells * cells)
+        self.pair_wins += np.bincount(pair[two & finished & first_won],
+                                      minlength=cells * cells)
+
+        # how often the owner of each cell won the finished games
+        owners = owner[finished]
+        self.cell_played += (owners != 0).sum(axis=0)
+        self.cell_wins += (owners == outcome[finished][:, None]).sum(axis=0)
+
+    def summary(self):
+        finished = int(self.outcomes[engine.PLAYER1] +
+                       self.outcomes[engine.PLAYER2] + self.outcomes[TIE])
+        openings = [{'cell': int(cell), 'games': int(self.openings[cell]),
+                     'finished': int(self.opening_finished[cell]),
+                     'first_mover_wins': int(self.opening_wins[cell]),
+                     'ties': int(self.opening_ties[cell]),
+                     'first_mover_win_rate': _rate(
+                         self.opening_wins[cell],
+                         self.opening_finished[cell])}
+                    for cell in np.argsort(-self.openings, kind='mergesort')
+                    if self.openings[cell]]
+        pairs = [{'moves': [int(pair // self.cells), int(pair % self.cells)],
+                  'games': int(self.pairs[pair]),
+                  'first_mover_win_rate': _rate(self.pair_wins[pair],
+                                                self.pair_finished[pair])}
+                 for pair in np.argsort(-self.pairs,
+                                        kind='mergesort')[:TOP_OPENINGS]
+                 if self.pairs[pair]]
+        return {
+            'size': self.size,
+            'win_length': self.win_length,
+            'games': self.games,
+            'finished': finished,
+            'no_history': self.no_history,
+            'outcomes': dict((name, int(self.outcomes[code]))
+                             for code, name in OUTCOMES.items()),
+            'first_mover_win_rate': _rate(self.opening_wins.sum(), finished),
+            'average_length': _rate(
+                (self.lengths * np.arange(self.cells + 1)).sum(), finished),
+            'length_histogram': [int(count) for count in self.lengths],
+            'openings': openings,
+            'two_move_openings': pairs,
+            'cell_win_rates': [_rate(wins, played) for wins, played in
+                               zip(self.cell_wins, self.cell_played)],
+        }
+
+
+class PlayerStats(object):
+
+    """Running win, loss and tie totals per player and month, from the
+    Score records"""
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.totals = np.zeros((0, len(RESULTS)), np.int64)
+        # player row * MONTH_SPAN + month -> counts per result
+        self.months = {}
+
+    def add(self, records):
+        rows = np.array([self._row(record['user_name'])
+                         for record in records], np.int64)
+        months = np.array([record['date'] for record in records],
+                          'datetime64[D]').astype('datetime64[M]')\
+            .astype(np.int64)
+        results = np.array([record['result'] for record in records])
+        codes = np.zeros(len(records), np.int64)
+        for code, result in enumerate(RESULTS):
+            codes[results == result] = code
+
+        if len(self.names) > len(self.totals):
+            self.totals = np.vstack([self.totals, np.zeros(
+                (len(self.names) - len(self.totals), len(RESULTS)),
+                np.int64)])
+        np.add.at(self.totals, (rows, codes), 1)
+        keys, counts = np.unique(
+            (rows * MONTH_SPAN + months) * len(RESULTS) + codes,
+            return_counts=True)
+        for key, count in zip(keys, counts):
+            month_key, code = divmod(int(key), len(RESULTS))
+            self.months.setdefault(month_key, [0] * len(RESULTS))
+            self.months[month_key][code] += int(count)
+
+    def _row(self, name):
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+        return self.index[name]
+
+    def summary(self, top=TOP_PLAYERS):
+        """Returns the totals and monthly results of the top players by
+        games played"""
+        games = self.totals.sum(axis=1)
+        rows = [int(row) for row in np.argsort(-games, kind='mergesort')
+                [:top]]
+        months = {}
+        for month_key, counts in self.months.items():
+            row, month = divmod(month_key, MONTH_SPAN)
+            months.setdefault(row, []).append((month, counts))
+        players = []
+        for row in rows:
+            wins, losses, ties = [int(count) for count in self.totals[row]]
+            players.append({
+                'user_name': self.names[row],
+                'games': int(games[row]),
+                'wins': wins, 'losses': losses, 'ties': ties,
+                'win_rate': _rate(wins, games[row]),
+                'months': [{'month': '{:04d}-{:02d}'.format(
+                    1970 + number // 12, number % 12 + 1),
+                    'wins': results[0], 'losses': results[1],
+                    'ties': results[2]}
+                    for number, results in sorted(months.get(row, []))]})
+        return players
+
+
+class Analyzer(object):
+
+    """Collects records in chunks and folds each chunk into the totals"""
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.variants = {}
+        self.players = PlayerStats()
+        self.counts = {}
+        self._games = {}
+        self._scores = []
+
+    def add(self, record):
+        kind = record.get('kind')
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if kind in ('Game', 'GameArchive'):
+            variant = (record['size'], record['win_length'])
+            pending = self._games.setdefault(variant, [])
+            pending.append(record)
+            if len(pending) >= self.chunk_size:
+                self._flush_games(variant)
+        elif kind == 'Score':
+            self._scores.append(record)
+            if len(self._scores) >= self.chunk_size:
+                self._flush_scores()
+
+    def _flush_games(self, variant):
+        records = self._games.pop(variant, [])
+        if variant not in self.variants:
+            self.variants[variant] = VariantStats(*variant)
+        stats = self.variants[variant]
+        stats.add(*stats.arrays(records))
+
+    def _flush_scores(self):
+        if self._scores:
+            self.players.add(self._scores)
+        self._scores = []
+
+    def summary(self):
+        """Folds the partial chunks and returns the summary"""
+        for variant in list(self._games):
+            self._flush_games(variant)
+        self._flush_scores()
+        return {
+            'records': self.counts,
+            'games': sum(stats.games for stats in self.variants.values()),
+            'variants': dict((_variant_name(*variant), stats.summary())
+                             for variant, stats in self.variants.items()),
+            'players': self.players.summary(),
+        }
+
+
+def analyze(records, chunk_size=CHUNK_SIZE):
+    """Returns the summary of an iterable of export records"""
+    analyzer = Analyzer(chunk_size)
+    for record in records:
+        analyzer.add(record)
+    return analyzer.summary()
+
+
+def read_export(paths):
+    """Yields the records of export files, one JSON record per line. '-'
+    reads standard input"""
+    for path in paths:
+        export = sys.stdin if path == '-' else open(path)
+        try:
+            for line in export:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            if export is not sys.stdin:
+                export.close()
+
+
+def datastore_records(job_id=None):
+    """Yields export records read from the datastore of the running
+    environment, such as the testbed: the chunks of a finished export job,
+    or every Game, GameArchive and Score entity"""
+    from google.appengine.ext import ndb
+
+    import transfer
+    from models import TransferChunk, TransferJob, UserCache
+
+    if job_id:
+        parent = ndb.Key(TransferJob, job_id)
+        page = 1
+        chunk = TransferChunk.get_by_id(page, parent=parent)
+        while chunk:
+            for line in chunk.data.splitlines():
+                if line:
+                    yield json.loads(line)
+            page += 1
+            chunk = TransferChunk.get_by_id(page, parent=parent)
+        return
+
+    users = UserCache()
+    for kind in ('Game', 'GameArchive', 'Score'):
+        cursor, more = None, True
+        while more:
+            entities, cursor, more = transfer.MODELS[kind].query().fetch_page(
+                transfer.PAGE_SIZE, start_cursor=cursor)
+            for entity in entities:
+                yield transfer.export_record(entity, users)
+            more = more and cursor
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('exports', nargs='+',
+                        help="export files (the TransferChunks of an export "
+                        "job in order), '-' for standard input")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--output', help='write the JSON summary here '
+                        'instead of stdout')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    config = parse_args()
+    summary = json.dumps(analyze(read_export(config.exports),
+                                 config.chunk_size), indent=2, sort_keys=True)
+    if config.output:
+        with open(config.output, 'w') as output:
+            output.write(summary + '\n')
+    else:
+        print(summary)
@@ -4,25 +4,63 @@ This can also contain game logic. For more complex games it would be wise to
 move game logic to another file. Ideally the API will be simple, concerned
 primarily with communication to/from the API's users."""
 
+import datetime
 import random
+import time
 import endpoints
 from protorpc import remote, messages
-from google.appengine.api import taskqueue
+from google.appengine.api.datastore_errors import TransactionFailedError
 from google.appengine.ext import ndb
 
-from models import User, Game, Score, Ranking
+import ai
+import archive
+import engine
+import game_cache
+import instrumentation
+import leaderboard
+import matchmaking
+import notifications
+from models import User, UserName, ActiveGames, Game, GameArchive, Score,\
+    Ranking, ScoreRollup, MatchTicket, GameStats, UserCache, Backfill,\
+    LEADERBOARD_MIN_GAMES, BOT_NAME
 from models import StringMessage, NewGameForm, GameForm, MakeMoveForm,\
-    ScoreForms, GameForms, RankForms, HistoryForm, HistoryForms
-from utils import get_by_urlsafe
+    ScoreForms, GameForms, RankForm, RankForms, UserRankForm, HistoryForm,\
+    HistoryForms, MatchForm, GameStatsForm
+from utils import get_key_by_urlsafe, fetch_page, page_list
+
+# times a move is retried when another move on the same game commits first
+MOVE_RETRIES = 3
+# longest a wait_for_move request waits, and its default. A waiting request
+# holds a frontend instance thread, so clients re-poll rather than wait long
+MAX_WAIT_SECONDS = 5
+WAIT_SECONDS = 5
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1),)
+WAIT_REQUEST = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    known_moves=messages.IntegerField(2),
+    timeout=messages.IntegerField(3),)
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1),)
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                            email=messages.StringField(2))
+PAGE_REQUEST = endpoints.ResourceContainer(limit=messages.IntegerField(1),
+                                           cursor=messages.StringField(2))
+LIMIT_REQUEST = endpoints.ResourceContainer(limit=messages.IntegerField(1))
+USER_PAGE_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    cursor=messages.StringField(3),)
+USER_SCORES_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+    summary=messages.BooleanField(4),
+    start_date=messages.StringField(5),
+    end_date=messages.StringField(6),)
 
 
 @endpoints.api(name='tic_tac_toe', version='v1')
@@ -36,11 +74,14 @@ class TicTacToeApi(remote.Service):
                       http_method='POST')
     def create_user(self, request):
         """Create a User. Requires a unique username"""
-        if User.query(User.name == request.user_name).get():
+        if not request.user_name:
+            raise endpoints.BadRequestException('A user_name is required')
+        if request.user_name == BOT_NAME:
+            raise endpoints.ConflictException(
+                'That name is reserved for the computer player')
+        if not User.create(request.user_name, request.email):
             raise endpoints.ConflictException(
                 'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
         return StringMessage(message='User {} created!'.format(
             request.user_name))
 
@@ -50,16 +91,26 @@ class TicTacToeApi(remote.Service):
                       name='new_game',
                       http_method='POST')
     def new_game(self, request):
-        """Creates new game"""
-        player1 = User.query(User.name == request.player1).get()
+        """Creates new game. A difficulty starts a single player game
+        against the bot"""
+        difficulty = request.difficulty
+        if not difficulty and request.player2 == BOT_NAME:
+            difficulty = ai.HARD
+        if difficulty and difficulty not in ai.DIFFICULTIES:
+            raise endpoints.BadRequestException(
+                'difficulty must be one of {}'.format(
+                    ', '.join(ai.DIFFICULTIES)))
+        player1, player2 = UserName.get_by_names([
+            request.player1, BOT_NAME if difficulty else request.player2])
+        if difficulty and not player2:
+            player2 = UserName.get_bot()
         if not player1:
             raise endpoints.NotFoundException(
                 'Player1 does not exist!')
-        player2 = User.query(User.name == request.player2).get()
         if not player2:
             raise endpoints.NotFoundException(
                 'Player2 does not exist!')
-        if player1 == player2:
+        if player1.user == player2.user:
            raise endpoints.ConflictException('Cannot play against yourself')
 
         # randomize who gets the 1st turn
@@ -70,14 +121,79 @@ class TicTacToeApi(remote.Service):
             next_turn_name = player2.name
 
         # reset the tic tac toe board
-        board = [' '] * 9
+        win_length = request.win_length or request.size
+        try:
+            engine.validate(request.size, win_length)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        board = engine.Board(request.size, win_length)
 
         # create a new game record in datastore
-        game = Game.new_game(player1.key, player2.key,
-                             next_turn_name, board)
+        game = Game.new_game(player1, player2, next_turn_name, board,
+                             difficulty)
+
+        if game.moves:
+            # the bot had the first turn and has already moved
+            msg = '{} played {}. {} turn'.format(
+                game.player2_name, game.get_moves()[-1], game.next_turn)
+        else:
+            msg = '{} will have the first move'.format(next_turn_name)
+        form = game.to_form(msg)
+        rpcs = [game_cache.set_form(form), game_cache.set_version(form)]
+        for rpc in rpcs:
+            rpc.get_result()
+        return form
+
+    @endpoints.method(request_message=USER_REQUEST,
+                      response_message=MatchForm,
+                      path='queue',
+                      name='join_queue',
+                      http_method='POST')
+    def join_queue(self, request):
+        """Join the matchmaking queue. The user is paired with a player of
+        similar winning percentage and a game is created for them; use
+        poll_match to find it"""
+        user = self._get_player(request.user_name)
+        ticket = matchmaking.join(user)
+        return self._match_form(ticket)
+
+    @endpoints.method(request_message=USER_REQUEST,
+                      response_message=MatchForm,
+                      path='queue/{user_name}',
+                      name='poll_match',
+                      http_method='GET')
+    def poll_match(self, request):
+        """Return the user's matchmaking state and, once paired, the
+        game"""
+        user = self._get_player(request.user_name)
+        return self._match_form(MatchTicket.key_for(user.user).get())
+
+    @staticmethod
+    def _get_player(user_name):
+        user = UserName.get_by_name(user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                'A User with that name does not exist!')
+        if user.name == BOT_NAME:
+            raise endpoints.BadRequestException(
+                'The computer player cannot join the queue')
+        return user
 
-        return game.to_form('{} will have the first move'
-                            .format(next_turn_name))
+    @staticmethod
+    def _match_form(ticket):
+        status = matchmaking.status(ticket)
+        form = MatchForm(status=status)
+        if status == 'matched':
+            form.urlsafe_game_key = ticket.game.urlsafe()
+            form.opponent = ticket.opponent
+            form.message = 'Matched with {}'.format(ticket.opponent)
+        elif status == 'waiting':
+            form.message = 'Waiting for an opponent'
+        elif status == 'expired':
+            form.message = 'No opponent found, please join again'
+        else:
+            form.message = 'Not in the queue'
+        return form
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
@@ -86,13 +202,55 @@ class TicTacToeApi(remote.Service):
                       http_method='GET')
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        return self._game_form(request.urlsafe_game_key,
+                               'Time to make a move!')
+
+    @staticmethod
+    def _game_form(urlsafe_game_key, message):
+        """Returns the GameForm of a game from the cache, or from the
+        datastore on a miss"""
+        form = game_cache.get_form(urlsafe_game_key, message)
+        if form:
+            return form
+
+        game = GameArchive.get_game(get_key_by_urlsafe(urlsafe_game_key, Game))
 
         if game:
-            return game.to_form('Time to make a move!')
+            form = game.to_form(message)
+            game_cache.add_form(form)
+            return form
         else:
             raise endpoints.NotFoundException('Game not found!')
 
+    @endpoints.method(request_message=WAIT_REQUEST,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/wait',
+                      name='wait_for_move',
+                      http_method='GET')
+    def wait_for_move(self, request):
+        """Waits until the game has more than known_moves moves, or for
+        timeout seconds, and returns its state"""
+        urlsafe_game_key = request.urlsafe_game_key
+        known = request.known_moves or 0
+        timeout = WAIT_SECONDS if request.timeout is None else \
+            max(0, min(request.timeout, MAX_WAIT_SECONDS))
+        deadline = time.time() + timeout
+
+        form = self._game_form(urlsafe_game_key, 'Time to make a move!')
+        if game_cache.moves_played(form) > known or form.game_over:
+            return form
+        if game_cache.get_version(urlsafe_game_key) is None:
+            # evicted, or the game predates versions
+            game_cache.seed_version(form)
+
+        version = game_cache.wait_for_version(urlsafe_game_key, known,
+                                              deadline - time.time())
+        if version is not None and version <= known:
+            form.message = 'No new move yet'
+            return form
+        # a cancelled game has lost its version and is not found here
+        return self._game_form(urlsafe_game_key, 'Time to make a move!')
+
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}/cancel',
@@ -100,18 +258,31 @@ class TicTacToeApi(remote.Service):
                       http_method='DELETE')
     def cancel_game(self, request):
         """Cancel an active game."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = GameArchive.get_game(
+            get_key_by_urlsafe(request.urlsafe_game_key, Game))
 
         #check if game exist.
         if not game:
             raise endpoints.NotFoundException('Game not found! Already cancelled')
 
-        if game.game_over:
+        if game.game_over or not self._cancel_game(game.key):
             raise endpoints.NotFoundException('Cannot cancel completed game')
         else:
-            game.key.delete()
+            game_cache.invalidate(game.key.urlsafe())
             return StringMessage(message='Game cancelled!')
 
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _cancel_game(game_key):
+        """Deletes a game in progress and drops it from the players'
+        ActiveGames. Returns False if the game has ended or is gone"""
+        game = game_key.get()
+        if not game or game.game_over:
+            return False
+        game_key.delete()
+        ActiveGames.update(game.indexed_players(), remove=[game_key])
+        return True
+
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
@@ -119,112 +290,247 @@ class TicTacToeApi(remote.Service):
                       http_method='PUT')
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        try:
+            game, msg, moved = self._apply_move(game_key, request.player,
+                                                request.move)
+        except TransactionFailedError:
+            raise endpoints.ConflictException(
+                'The game was changed by another move, please retry.')
 
         #check if game exist.  if game does not exist prevent any move.
         if not game:
             raise endpoints.NotFoundException('Game does not exist.  Create a new game.')
 
+        form = game.to_form(msg)
+        if moved:
+            # write the new state through to the cache and wake the players
+            # waiting on the game once committed, this also covers the end
+            # of the game as end_game is only called from here
+            rpcs = [game_cache.set_form(form), game_cache.set_version(form)]
+            notified = updated = None
+            if game.game_over:
+                updated = leaderboard.queue_update()
+            elif not game.difficulty:
+                # Turn notification system.  Notify the User's opponent
+                # turn; the enqueue overlaps the cache writes.  Against the
+                # bot the player already has the reply
+                notified = notifications.queue_turn_notifications([
+                    notifications.turn_notification_task(
+                        game.player_key(game.next_turn), game.key)])
+            for rpc in rpcs:
+                rpc.get_result()
+            if notified is not None:
+                notifications.wait_queued(notified)
+            if updated is not None:
+                leaderboard.wait_queued(updated)
+        return form
+
+    @staticmethod
+    @ndb.transactional(xg=True, retries=MOVE_RETRIES)
+    def _apply_move(game_key, player, move):
+        """Reads, validates and applies one move in a single transaction.
+        A concurrent move on the same game makes the transaction retry, so
+        the checks below always run against the latest state.
+        Returns (game, message, moved)"""
+        # a finished game may already have been archived
+        game = game_key.get() or GameArchive.key_for(game_key).get()
+        if not game:
+            return None, None, False
+
         # Checks if game is complete
         if game.game_over:
-            return game.to_form('Game already over!')
+            return game, 'Game already over!', False
 
         # Checks if it is the right player's turn
-        if game.next_turn != request.player:
-            return game.to_form('It is {} turn to play'.format(game.next_turn))
+        if game.next_turn != player:
+            return game, 'It is {} turn to play'.format(game.next_turn), False
+
+        board = game.get_board()
 
         # Checks if the move entered is valid
-        if (request.move < 0 or request.move > 8):
-            return game.to_form('Move should be from 0 to 8 only')
+        if not board.is_valid_cell(move):
+            return game, 'Move should be from 0 to {} only'.format(
+                board.cells - 1), False
 
         # Checks if the move entered is already taken
-        if (game.board[request.move] != ' '):
-            return game.to_form('Position already taken.')
+        if not board.is_free(move):
+            return game, 'Position already taken.', False
+
+        # games created before player names were stored get them now
+        game.fill_names()
 
-        msg = ''
         # Game logic.  update the board and check if player wins.
-        if request.player == game.player1.get().name:
-            game.board[request.move] = 'O'
-            next_turn = game.player2
-            if self.isWinner(game.board, 'O'):
-                game.end_game(game.player1, game.player2, 'win')
-                msg = '{} win!'.format(game.player1.get().name)
-        else:
-            game.board[request.move] = 'X'
-            next_turn = game.player1
-            if self.isWinner(game.board, 'X'):
-                game.end_game(game.player2, game.player1, 'win')
-                msg = '{} win!'.format(game.player2.get().name)
-
-        # if no winner found check if there's a tie or who has the next turn
-        if msg.find('win') == -1:  # no winner found yet
-            if self.isTie(game.board):
-                game.end_game(game.player1, game.player2, 'tie')
-                msg = 'Tie!'
-            else:
-                game.next_turn = next_turn.get().name
-                msg = '{} turn'.format(game.next_turn)
-                # Turn notification system.  Add a task to the task queue to
-                # notify the User's opponent turn
-                taskqueue.add(params={'user_id': next_turn.urlsafe(),
-                                      'game_id': game.key.urlsafe()},
-                              url='/tasks/send_reminder')
-
-        # Game history tracking.
-        intCtr = len(game.history) + 1
-        history = {'seq': intCtr, 'player': request.player,
-                   'move': request.move, 'result': msg}
-        game.history.append(history)
+        msg = game.play(board, player, move)
+        if game.is_bot_turn():
+            # the bot replies in the same transaction, so the player gets
+            # the board back with both moves on it
+            bot_move, bot_msg = game.play_bot(board)
+            msg = '{} played {}. {}'.format(game.player2_name, bot_move,
+                                            bot_msg)
         game.put()
+        if game.game_over:
+            archive.queue_archive(game.key)
+        return game, msg, True
 
-        return game.to_form(msg)
-
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
     def get_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query()])
+        """Return a page of scores"""
+        scores, next_cursor, users = self._fetch_named_page(
+            Score.query(), request,
+            [Score.user_name, Score.date, Score.result])
+        return ScoreForms(items=[score.to_form(users) for score in scores],
+                          next_cursor=next_cursor)
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @staticmethod
+    def _fetch_named_page(query, request, projection):
+        """Returns (entities, next_cursor, users) for a page of Scores or
+        Rankings. A projection on user_name skips the rows the names
+        backfill has not reached, so until it has finished whole entities
+        are read and the missing names resolved through users"""
+        if Backfill.is_finished('names-' + query.kind):
+            entities, next_cursor = fetch_page(
+                query, request.limit, request.cursor, projection=projection)
+            return entities, next_cursor, None
+        entities, next_cursor = fetch_page(query, request.limit,
+                                           request.cursor)
+        users = UserCache()
+        users.prefetch(entity.user for entity in entities
+                       if not entity.user_name)
+        return entities, next_cursor, users
+
+    @endpoints.method(request_message=USER_SCORES_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
     def get_user_scores(self, request):
-        """Returns all of an individual User's scores"""
-        user = User.query(User.name == request.user_name).get()
+        """Returns a page of an individual User's scores. In summary mode
+        returns a page of their wins, losses and ties per day instead,
+        optionally between start_date and end_date (YYYY-MM-DD)"""
+        user = UserName.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        if request.summary:
+            query = ScoreRollup.query(ancestor=user.user)
+            if request.start_date:
+                query = query.filter(
+                    ScoreRollup.date >= self._parse_date(request.start_date))
+            if request.end_date:
+                query = query.filter(
+                    ScoreRollup.date <= self._parse_date(request.end_date))
+            rollups, next_cursor = fetch_page(
+                query.order(ScoreRollup.date), request.limit, request.cursor)
+            return ScoreForms(days=[rollup.to_form() for rollup in rollups],
+                              next_cursor=next_cursor)
+        if request.start_date or request.end_date:
+            raise endpoints.BadRequestException(
+                'Date ranges are only supported in summary mode')
+        scores, next_cursor, users = self._fetch_named_page(
+            Score.query(ancestor=user.user), request,
+            [Score.user_name, Score.date, Score.result])
+        return ScoreForms(items=[score.to_form(users) for score in scores],
+                          next_cursor=next_cursor)
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @staticmethod
+    def _parse_date(value):
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                'Dates must be given as YYYY-MM-DD')
+
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=GameForms,
                       path='games/user/{user_name}',
                       name='get_user_games',
                       http_method='GET')
     def get_user_games(self, request):
-        """Returns all of an individual User's active games"""
-        user = User.query(User.name == request.user_name).get()
+        """Returns a page of an individual User's active games"""
+        user = UserName.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
-        games = Game.query(ndb.AND(ndb.OR(Game.player1 == user.key,
-                                          Game.player2 == user.key),
-                                   Game.game_over == False))
-        return GameForms(items=[game.to_form('') for game in games])
-
-    @endpoints.method(response_message=RankForms,
+        index = ActiveGames.key_for(user.user).get()
+        game_keys, next_cursor = page_list(index.games if index else [],
+                                           request.limit, request.cursor)
+        games = [game for game in ndb.get_multi(game_keys) if game]
+        # only games created before player names were stored need lookups
+        users = UserCache()
+        users.prefetch(key for game in games if not game.player2_name
+                       for key in (game.player1, game.player2))
+        return GameForms(items=[game.to_form('', users) for game in games],
+                         next_cursor=next_cursor)
+
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=RankForms,
                       path='ranking',
                       name='get_user_rankings',
                       http_method='GET')
     def get_user_rankings(self, request):
-        """Return all ranking sort by winning percent"""
-        return RankForms(items=[rank.to_form() for rank in Ranking
-                                .query().order(-Ranking.winning_percent)])
+        """Return a page of rankings sorted by winning percent"""
+        rankings, next_cursor, users = self._fetch_named_page(
+            Ranking.query().order(-Ranking.winning_percent), request,
+            [Ranking.user_name, Ranking.winning_percent])
+        return RankForms(items=[rank.to_form(users) for rank in rankings],
+                         next_cursor=next_cursor)
+
+    @endpoints.method(request_message=LIMIT_REQUEST,
+                      response_message=RankForms,
+                      path='leaderboard',
+                      name='get_leaderboard',
+                      http_method='GET')
+    def get_leaderboard(self, request):
+        """Return the top players from the leaderboard snapshot"""
+        rows = leaderboard.get_top(request.limit or leaderboard.TOP_N)
+        return RankForms(items=[RankForm(user=name, winning_percent=percent,
+                                         games_played=games)
+                                for name, percent, games in rows])
+
+    @endpoints.method(request_message=USER_REQUEST,
+                      response_message=UserRankForm,
+                      path='leaderboard/user/{user_name}',
+                      name='get_user_rank',
+                      http_method='GET')
+    def get_user_rank(self, request):
+        """Return a user's position on the leaderboard"""
+        user = UserName.get_by_name(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                'A User with that name does not exist!')
+        ranking, rank, exact = leaderboard.get_rank(user.user)
+        form = UserRankForm(user=user.name, rank=rank, exact=exact,
+                            games_played=0, message='')
+        if ranking:
+            form.winning_percent = ranking.winning_percent
+            form.games_played = ranking.games_played
+        if rank is None:
+            form.message = 'Not ranked yet, {} games are needed'.format(
+                LEADERBOARD_MIN_GAMES)
+        elif exact:
+            form.message = 'Rank {}'.format(rank)
+        else:
+            form.message = 'Around rank {}'.format(rank)
+        return form
+
+    @endpoints.method(response_message=GameStatsForm,
+                      path='stats',
+                      name='get_game_stats',
+                      http_method='GET')
+    def get_game_stats(self, request):
+        """Return the latest offline game statistics: outcomes, openings,
+        per-cell win rates and game length per board variant, and the
+        monthly results of the most active players"""
+        stats = GameStats.latest()
+        if not stats:
+            raise endpoints.NotFoundException(
+                'No game statistics have been loaded')
+        return stats.to_form()
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=HistoryForms,
@@ -233,79 +539,17 @@ class TicTacToeApi(remote.Service):
                       http_method='GET')
     def get_game_history(self, request):
         """Return game history."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = GameArchive.get_game(
+            get_key_by_urlsafe(request.urlsafe_game_key, Game))
 
         if game:
-            # logging.info(game.history)
-            items = []
-            for history in game.history:
-                items.append(HistoryForm(sequence=history['seq'],
-                                         player=history[
-                                             'player'], move=history['move'],
-                                         result=history['result']))
-            # logging.info(items)
+            # the packed moves are only expanded here
+            items = [HistoryForm(sequence=seq, player=player, move=move,
+                                 result=result)
+                     for seq, player, move, result in game.get_history()]
             return HistoryForms(items=items)
         else:
             raise endpoints.NotFoundException('Game not found!')
 
-    @staticmethod
-    def _get_winning_percentage(player_name):
-        """Populates ranking entity based on players winning %"""
-
-        user = User.query(User.name == player_name).get()
-        if user:
-            total_win = float(
-                len(Score.query(Score.user == user.key, Score.result == 'win')
-                    .fetch()))
-            total_lose = float(
-                len(Score.query(Score.user == user.key, Score.result == 'lose')
-                    .fetch()))
-            total_tie = float(
-                len(Score.query(Score.user == user.key, Score.result == 'tie')
-                    .fetch()))
-            # tie counts for 1/2 win and 1/2 lose
-            winning_per = ((total_win + (total_tie / 2)) /
-                           (total_win + total_lose + total_tie))
-
-            # logging.info(total_win)
-            # logging.info(total_lose)
-            # logging.info(total_tie)
-            # logging.info(winning_per)
-
-            ranking = Ranking.query(Ranking.user == user.key).get()
-            if ranking:
-                ranking.winning_percent = winning_per
-                ranking.put()
-            else:
-                ranking = Ranking(user=user.key,
-                                  winning_percent=winning_per)
-                ranking.put()
-
-    def isWinner(self, bo, le):
-        # Given a board and a player’s letter, this function returns True if
-        # that player has won.
-        return (  # across the top
-            (bo[6] == le and bo[7] == le and bo[8] == le) or
-            # across the middle
-            (bo[3] == le and bo[4] == le and bo[5] == le) or
-            # across the bottom
-            (bo[0] == le and bo[1] == le and bo[2] == le) or
-            # down the left side
-            (bo[6] == le and bo[3] == le and bo[0] == le) or
-            # down the middle
-            (bo[7] == le and bo[4] == le and bo[1] == le) or
-            # down the right side
-            (bo[8] == le and bo[5] == le and bo[2] == le) or
-            # diagonal
-            (bo[6] == le and bo[4] == le and bo[2] == le) or
-            # diagonal
-            (bo[8] == le and bo[4] == le and bo[0] == le))
-
-    def isTie(self, bo):
-        # if all grid are not empty then it is a tie.
-        return (bo[0] != ' ' and bo[1] != ' ' and bo[2] != ' ' and
-                bo[3] != ' ' and bo[4] != ' ' and bo[5] != ' ' and
-                bo[6] != ' ' and bo[7] != ' ' and bo[8] != ' ')
-
-
-api = endpoints.api_server([TicTacToeApi])
+
+api = instrumentation.wrap(endpoints.api_server([TicTacToeApi]))
@@ -0,0 +1,49 @@
+"""archive.py - Moves finished games from the Game kind into GameArchive.
+A game is archived by a task queued in the transaction that ends it, so the
+Game kind, and the indexes behind the active game queries, only hold games in
+progress. Archived games keep their id, so get_game and get_game_history find
+them with the key the players already have."""
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Game, GameArchive
+
+# finished games moved by each backfill task
+BACKFILL_PAGE_SIZE = 100
+
+
+def queue_archive(game_key):
+    """Queues the archiving of a finished game. Must be called inside the
+    transaction that ends the game"""
+    taskqueue.add(params={'game': game_key.urlsafe()},
+                  url='/tasks/archive_game', transactional=True)
+
+
+@ndb.transactional_tasklet(xg=True)
+def archive_async(game_key):
+    """Moves a finished game into the archive. Games still in progress are
+    left alone; a game whose archive copy already exists is only deleted, so
+    a retried task or backfill page never rewrites the archive"""
+    archive_key = GameArchive.key_for(game_key)
+    game, archived = yield game_key.get_async(), archive_key.get_async()
+    if not (game and game.game_over):
+        return
+    if archived:
+        yield game_key.delete_async()
+    else:
+        yield (GameArchive.from_game(game).put_async(),
+               game_key.delete_async())
+
+
+def backfill_page(cursor=None):
+    """Archives one page of games that finished before archiving existed.
+    The keys-only query is paged with a cursor rather than re-run from the
+    start, as the index may still list games archived by earlier pages.
+    Returns the cursor of the next page, or None when done"""
+    game_keys, next_cursor, more = Game.query(
+        Game.game_over == True).fetch_page(
+        BACKFILL_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+    for future in [archive_async(game_key) for game_key in game_keys]:
+        future.check_success()
+    return next_cursor if more else None
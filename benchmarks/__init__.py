@@ -0,0 +1 @@
+"""benchmarks - Micro-benchmarks and load tests for the Game API."""
@@ -0,0 +1,71 @@
+"""ai_bench.py - Measures how fast the bot chooses its moves.
+Run from the project root with: python -m benchmarks.ai_bench"""
+
+from __future__ import print_function
+
+import random
+import time
+
+import ai
+import engine
+
+
+def positions(count, size, win_length, seed=1):
+    """Returns count (board, player to move) pairs taken from random games
+    that are still in progress"""
+    rand = random.Random(seed)
+    found = []
+    while len(found) < count:
+        board = engine.Board(size, win_length)
+        player = engine.PLAYER1
+        for _ in range(rand.randint(0, board.cells - 2)):
+            cell = rand.choice(board.free_cells())
+            board.place(cell, player)
+            if board.is_winning_move(cell, player):
+                break
+            player = engine.PLAYER2 if player == engine.PLAYER1 \
+                else engine.PLAYER1
+        else:
+            found.append((board, player))
+    return found
+
+
+def _time_moves(sample, rand):
+    start = time.time()
+    for board, player in sample:
+        ai.choose_move(board, player, ai.HARD, rand)
+    return time.time() - start
+
+
+def _report(name, seconds, count):
+    print('{:<14} {:>8.3f} s  {:>12.0f} moves/s'
+          .format(name, seconds, count / seconds))
+
+
+def run(count=20000, search_count=200):
+    results = {}
+    rand = random.Random(2)
+
+    start = time.time()
+    table = ai.solved_table()
+    results['solve 3x3'] = time.time() - start
+    print('solve 3x3      {:>8.3f} s  {:>12} canonical positions'
+          .format(results['solve 3x3'], len(table)))
+
+    sample = positions(count, 3, 3)
+    results['reply 3x3'] = _time_moves(sample, rand)
+    _report('reply 3x3', results['reply 3x3'], len(sample))
+
+    # depth-limited search, first with a cold transposition table and then
+    # replaying the same positions against the warm one
+    for size, win_length in ((4, 3), (5, 4)):
+        sample = positions(search_count, size, win_length)
+        for phase in ('cold', 'warm'):
+            name = '{} {}x{}/{}'.format(phase, size, size, win_length)
+            results[name] = _time_moves(sample, rand)
+            _report(name, results[name], len(sample))
+    return results
+
+
+if __name__ == '__main__':
+    run()
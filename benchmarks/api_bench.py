@@ -0,0 +1,221 @@
+"""api_bench.py - Load generator for the API and the task handlers.
+Plays a configurable workload (users creating games, interleaved moves,
+polling, leaderboard and history reads, cron runs) against the testbed stubs
+and writes per endpoint p50/p95/p99 latency, datastore RPCs per call and
+tasks enqueued as JSON. Queued tasks are run between rounds and reported
+under their URL.
+Run from the project root with: python -m benchmarks.api_bench --help"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import random
+
+from benchmarks.harness import Harness
+
+DATASTORE = 'datastore_v3.'
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class Stats(object):
+
+    """Latency, RPC and task counts collected per endpoint or task URL"""
+
+    def __init__(self):
+        self.calls = {}
+
+    def add(self, name, error, seconds, rpcs, tasks):
+        calls = self.calls.setdefault(name, {
+            'latencies': [], 'errors': 0, 'rpcs': {}, 'tasks': 0})
+        calls['latencies'].append(seconds)
+        calls['errors'] += 1 if error else 0
+        calls['tasks'] += tasks
+        for rpc, count in rpcs.items():
+            calls['rpcs'][rpc] = calls['rpcs'].get(rpc, 0) + count
+
+    def report(self):
+        report = {}
+        for name, calls in sorted(self.calls.items()):
+            count = len(calls['latencies'])
+            datastore = sum(value for rpc, value in calls['rpcs'].items()
+                            if rpc.startswith(DATASTORE))
+            report[name] = {
+                'count': count,
+                'errors': calls['errors'],
+                'p50_ms': percentile(calls['latencies'], 0.50) * 1000,
+                'p95_ms': percentile(calls['latencies'], 0.95) * 1000,
+                'p99_ms': percentile(calls['latencies'], 0.99) * 1000,
+                'datastore_rpcs_per_call': float(datastore) / count,
+                'rpcs_per_call': dict(
+                    (rpc, float(value) / count)
+                    for rpc, value in sorted(calls['rpcs'].items())),
+                'tasks_enqueued': calls['tasks'],
+            }
+        return report
+
+
+class Workload(object):
+
+    """Drives the API through the harness and records every call"""
+
+    def __init__(self, harness, config):
+        # the API modules build datastore keys on import, which needs the
+        # testbed environment
+        import api
+        import main
+        self.app = main.app
+        self.service = api.TicTacToeApi()
+        self.harness = harness
+        self.config = config
+        self.rand = random.Random(config.seed)
+        self.stats = Stats()
+        self.requests = {
+            'create_user': api.USER_REQUEST,
+            'new_game': api.NEW_GAME_REQUEST,
+            'get_game': api.GET_GAME_REQUEST,
+            'make_move': api.MAKE_MOVE_REQUEST,
+            'get_game_history': api.GET_GAME_REQUEST,
+            'get_user_games': api.USER_PAGE_REQUEST,
+            'get_user_scores': api.USER_SCORES_REQUEST,
+            'get_user_rankings': api.PAGE_REQUEST,
+            'get_leaderboard': api.LIMIT_REQUEST,
+            'get_user_rank': api.USER_REQUEST,
+        }
+
+    def endpoint(self, name, **fields):
+        """Calls one endpoint method. Returns its response or None"""
+        request = self.requests[name].combined_message_class(**fields)
+        result, error, seconds, rpcs, tasks = self.harness.call(
+            getattr(self.service, name), request)
+        self.stats.add(name, error, seconds, rpcs, tasks)
+        return result
+
+    def handler(self, name, url, method='GET', body='', headers=None):
+        """Runs one request through the main.app handlers"""
+        _, error, seconds, rpcs, tasks = self.harness.call(
+            self.app.get_response, url, method=method, body=body,
+            headers=headers or {})
+        self.stats.add(name, error, seconds, rpcs, tasks)
+
+    def run_tasks(self):
+        """Runs queued tasks, and the tasks they queue, until none are
+        left"""
+        for _ in range(self.config.max_task_waves):
+            tasks = self.harness.pop_tasks()
+            if not tasks:
+                return
+            for url, method, body, headers in tasks:
+                self.handler('task ' + url, url, method, body, headers)
+
+    def play_move(self, user_name, form):
+        """Makes a random legal move for the player whose turn it is"""
+        free = [cell for cell, mark in enumerate(form.board) if mark == ' ']
+        return self.endpoint('make_move', urlsafe_game_key=form.urlsafe_key,
+                             player=user_name, move=self.rand.choice(free))
+
+    def run(self):
+        config = self.config
+        names = ['user{}'.format(index) for index in range(config.users)]
+        for name in names:
+            self.endpoint('create_user', user_name=name,
+                          email='{}@example.com'.format(name))
+
+        games = []
+        for index in range(config.games + config.bot_games):
+            player1, player2 = self.rand.sample(names, 2)
+            if index < config.games:
+                form = self.endpoint('new_game', player1=player1,
+                                     player2=player2, size=config.size)
+            else:
+                form = self.endpoint('new_game', player1=player1,
+                                     difficulty=config.difficulty,
+                                     size=config.size)
+            if form:
+                games.append(form)
+        self.run_tasks()
+
+        round_number = 0
+        # a game whose moves keep failing would otherwise never finish
+        while games and round_number < config.max_rounds:
+            round_number += 1
+            self.rand.shuffle(games)
+            still_playing = []
+            for form in games:
+                for _ in range(config.polls):
+                    form = self.endpoint(
+                        'get_game', urlsafe_game_key=form.urlsafe_key) or form
+                form = self.play_move(form.next_turn, form) or form
+                if not form.game_over:
+                    still_playing.append(form)
+                elif self.rand.random() < config.history_ratio:
+                    self.endpoint('get_game_history',
+                                  urlsafe_game_key=form.urlsafe_key)
+            games = still_playing
+
+            for _ in range(config.reads):
+                name = self.rand.choice(names)
+                self.endpoint('get_user_games', user_name=name)
+                self.endpoint('get_user_scores', user_name=name)
+                self.endpoint('get_user_rank', user_name=name)
+                self.endpoint('get_leaderboard', limit=10)
+                self.endpoint('get_user_rankings')
+            self.run_tasks()
+            if config.cron_every and round_number % config.cron_every == 0:
+                self.handler('cron /crons/send_reminder',
+                             '/crons/send_reminder',
+                             headers={'X-AppEngine-Cron': 'true'})
+                self.handler('cron /crons/leaderboard_rebuild',
+                             '/crons/leaderboard_rebuild',
+                             headers={'X-AppEngine-Cron': 'true'})
+                self.run_tasks()
+        return self.stats.report()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--games', type=int, default=40,
+                        help='two player games')
+    parser.add_argument('--bot-games', type=int, default=10,
+                        help='single player games against the bot')
+    parser.add_argument('--difficulty', default='hard')
+    parser.add_argument('--size', type=int, default=3)
+    parser.add_argument('--polls', type=int, default=1,
+                        help='get_game calls before each move')
+    parser.add_argument('--reads', type=int, default=2,
+                        help='rounds of listing and leaderboard reads per '
+                        'move round')
+    parser.add_argument('--history-ratio', type=float, default=0.5,
+                        help='share of finished games whose history is read')
+    parser.add_argument('--cron-every', type=int, default=3,
+                        help='move rounds between cron runs, 0 for none')
+    parser.add_argument('--max-rounds', type=int, default=30)
+    parser.add_argument('--max-task-waves', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here '
+                        'instead of stdout')
+    return parser.parse_args(argv)
+
+
+def run(config):
+    """Runs the workload on fresh stubs and returns the report"""
+    with Harness() as harness:
+        endpoints = Workload(harness, config).run()
+    return {'config': vars(config), 'endpoints': endpoints}
+
+
+if __name__ == '__main__':
+    config = parse_args()
+    report = json.dumps(run(config), indent=2, sort_keys=True)
+    if config.output:
+        with open(config.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
@@ -0,0 +1,135 @@
+"""engine_bench.py - Compares the bitboard engine against the original
+list-of-strings isWinner/isTie checks.
+Run from the project root with: python -m benchmarks.engine_bench"""
+
+from __future__ import print_function
+
+import random
+import timeit
+
+import engine
+
+
+def legacy_is_winner(bo, le):
+    """The original TicTacToeApi.isWinner, kept here as the baseline."""
+    return ((bo[6] == le and bo[7] == le and bo[8] == le) or
+            (bo[3] == le and bo[4] == le and bo[5] == le) or
+            (bo[0] == le and bo[1] == le and bo[2] == le) or
+            (bo[6] == le and bo[3] == le and bo[0] == le) or
+            (bo[7] == le and bo[4] == le and bo[1] == le) or
+            (bo[8] == le and bo[5] == le and bo[2] == le) or
+            (bo[6] == le and bo[4] == le and bo[2] == le) or
+            (bo[8] == le and bo[4] == le and bo[0] == le))
+
+
+def legacy_is_tie(bo):
+    """The original TicTacToeApi.isTie, kept here as the baseline."""
+    return (bo[0] != ' ' and bo[1] != ' ' and bo[2] != ' ' and
+            bo[3] != ' ' and bo[4] != ' ' and bo[5] != ' ' and
+            bo[6] != ' ' and bo[7] != ' ' and bo[8] != ' ')
+
+
+def random_games(count, size=3, seed=1):
+    """Returns count random move orders for a size x size board."""
+    rand = random.Random(seed)
+    games = []
+    for _ in range(count):
+        moves = list(range(size * size))
+        rand.shuffle(moves)
+        games.append(moves)
+    return games
+
+
+def play_legacy(games):
+    """Plays each game on a list board as the original make_move did."""
+    for moves in games:
+        board = [' '] * 9
+        for seq, cell in enumerate(moves):
+            mark = 'O' if seq % 2 == 0 else 'X'
+            board[cell] = mark
+            if legacy_is_winner(board, mark) or legacy_is_tie(board):
+                break
+
+
+def play_engine(games, size=3, win_length=3):
+    """Plays each game on a single engine.Board."""
+    for moves in games:
+        board = engine.Board(size, win_length)
+        for seq, cell in enumerate(moves):
+            player = engine.PLAYER1 if seq % 2 == 0 else engine.PLAYER2
+            board.place(cell, player)
+            if board.is_winning_move(cell, player) or board.is_full():
+                break
+
+
+def play_engine_stored(games, size=3, win_length=3):
+    """Plays each game on an engine.Board, round-tripping the stored
+    integer on every move as make_move does."""
+    for moves in games:
+        value = 0
+        for seq, cell in enumerate(moves):
+            board = engine.Board.decode(value, size, win_length)
+            player = engine.PLAYER1 if seq % 2 == 0 else engine.PLAYER2
+            board.place(cell, player)
+            value = board.encode()
+            if board.is_winning_move(cell, player) or board.is_full():
+                break
+
+
+def _report(name, seconds, count, unit):
+    print('{:<14} {:>8.3f} s  {:>12.0f} {}/s'
+          .format(name, seconds, count / seconds, unit))
+
+
+def run(count=20000, repeat=3):
+    results = {}
+
+    # win and tie checks alone, over every position of the sample games
+    positions = []
+    for moves in random_games(count // 10):
+        for length in range(1, 10):
+            board = [' '] * 9
+            for seq, cell in enumerate(moves[:length]):
+                board[cell] = 'O' if seq % 2 == 0 else 'X'
+            positions.append((board, engine.Board.from_list(board),
+                              moves[length - 1]))
+
+    def check_legacy():
+        for board, _, _ in positions:
+            legacy_is_winner(board, 'O') or legacy_is_tie(board)
+
+    def check_engine():
+        for _, board, cell in positions:
+            board.is_winning_move(cell, engine.PLAYER1) or board.is_full()
+
+    for name, func in (('check legacy', check_legacy),
+                       ('check engine', check_engine)):
+        results[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+        _report(name, results[name], len(positions), 'checks')
+
+    # whole games, with and without the per-move storage round-trip
+    games = random_games(count)
+    for name, func in (('play legacy', play_legacy),
+                       ('play engine', play_engine),
+                       ('play stored', play_engine_stored)):
+        results[name] = min(timeit.repeat(lambda: func(games), number=1,
+                                          repeat=repeat))
+        _report(name, results[name], count, 'games')
+
+    for size, win_length in ((4, 3), (5, 4)):
+        games = random_games(count // 4, size)
+        name = 'play {}x{}/{}'.format(size, size, win_length)
+        results[name] = min(timeit.repeat(
+            lambda: play_engine(games, size, win_length), number=1,
+            repeat=repeat))
+        _report(name, results[name], len(games), 'games')
+
+    # stored board payload: nine one-character strings versus one integer
+    full = engine.Board.from_list(['O', 'X'] * 4 + ['O'])
+    print('stored board   {} list items vs one {}-bit integer'
+          .format(full.cells, full.encode().bit_length()))
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,113 @@
+"""harness.py - Runs the API and the task handlers on the App Engine testbed
+stubs for benchmarks. Needs the App Engine SDK; if it is not importable, set
+APPENGINE_SDK to the SDK directory."""
+
+import base64
+import os
+import sys
+import time
+
+
+def _fix_sys_path():
+    sdk = os.environ.get('APPENGINE_SDK')
+    if sdk and sdk not in sys.path:
+        sys.path.insert(0, sdk)
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+
+
+_fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map  # noqa: E402
+from google.appengine.datastore import datastore_stub_util  # noqa: E402
+from google.appengine.ext import ndb, testbed  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOOK_NAME = 'benchmark_rpc_counter'
+
+
+class RpcCounter(object):
+
+    """Counts API calls made through the apiproxy as 'service.Call'"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def __call__(self, service, call, request, response):
+        name = '{}.{}'.format(service, call)
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def take(self):
+        """Returns the counts since the last take and resets them"""
+        counts, self.counts = self.counts, {}
+        return counts
+
+
+class Harness(object):
+
+    """Activates the testbed stubs and times calls against them"""
+
+    def __init__(self):
+        self.testbed = testbed.Testbed()
+        self.rpcs = RpcCounter()
+        self.taskqueue = None
+
+    def _count_rpc(self, service, call, request, response):
+        # the apiproxy only takes plain functions as hooks
+        self.rpcs(service, call, request, response)
+
+    def __enter__(self):
+        # endpoints reads the app revision from the version id on import
+        self.testbed.setup_env(current_version_id='v1.1')
+        self.testbed.activate()
+        # every write is visible to queries straight away, so runs repeat
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            HOOK_NAME, self._count_rpc)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.testbed.deactivate()
+
+    def queued_tasks(self):
+        """Returns (queue name, task dict) for every queued task"""
+        return [(queue['name'], task)
+                for queue in self.taskqueue.GetQueues()
+                for task in self.taskqueue.GetTasks(queue['name'])]
+
+    def call(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) as a fresh request. Returns (result or
+        None, error or None, seconds, rpc counts, tasks enqueued)"""
+        # a new request starts with an empty ndb context cache
+        ndb.get_context().clear_cache()
+        queued = len(self.queued_tasks())
+        self.rpcs.take()
+        result, error = None, None
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            error = e
+        seconds = time.time() - start
+        rpcs = self.rpcs.take()
+        return (result, error, seconds, rpcs,
+                len(self.queued_tasks()) - queued)
+
+    def pop_tasks(self):
+        """Removes and returns every queued task as (url, method, body,
+        headers)"""
+        tasks = []
+        for queue_name, task in self.queued_tasks():
+            self.taskqueue.DeleteTask(queue_name, task['name'])
+            tasks.append((task['url'], task['method'],
+                          base64.b64decode(task.get('body') or ''),
+                          dict(task.get('headers') or [])))
+        return tasks
@@ -0,0 +1,92 @@
+"""startup_bench.py - Measures the import cost of each script in app.yaml.
+Every script (api.api, main.app) is imported in a fresh interpreter, so
+nothing is cached from earlier runs, on the testbed stubs. Reports the
+import time, the number of modules loaded and whether the endpoints stack was
+among them, as JSON. The SDK modules the testbed itself needs are loaded
+before the clock starts, so the times are a lower bound.
+Run from the project root with: python -m benchmarks.startup_bench --help"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+from benchmarks.api_bench import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = re.compile(r'^\s*script:\s*(\S+)\s*$')
+
+# run in the child interpreter; the testbed is activated before the clock
+# starts as the modules build datastore keys on import
+_CHILD = '''
+import json, sys, time
+from benchmarks.harness import Harness
+module_name, attribute = sys.argv[1].rsplit('.', 1)
+with Harness():
+    before = set(sys.modules)
+    started = time.time()
+    module = __import__(module_name)
+    getattr(module, attribute)
+    seconds = time.time() - started
+    loaded = [name for name in set(sys.modules) - before
+              if sys.modules[name] is not None]
+print(json.dumps({'seconds': seconds, 'modules': len(loaded),
+                  'endpoints': 'endpoints' in loaded}))
+'''
+
+
+def scripts(path=os.path.join(ROOT, 'app.yaml')):
+    """Returns the distinct scripts of app.yaml in order"""
+    found = []
+    with open(path) as app_yaml:
+        for line in app_yaml:
+            match = SCRIPT.match(line)
+            if match and match.group(1) not in found:
+                found.append(match.group(1))
+    return found
+
+
+def measure(script):
+    """Imports script in a new interpreter. Returns its measurements"""
+    output = subprocess.check_output([sys.executable, '-c', _CHILD, script],
+                                     cwd=ROOT)
+    return json.loads(output.splitlines()[-1])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='fresh imports of each script')
+    parser.add_argument('--output', help='write the JSON report here '
+                        'instead of stdout')
+    return parser.parse_args(argv)
+
+
+def run(config):
+    """Measures every script and returns the report"""
+    report = {}
+    for script in scripts():
+        runs = [measure(script) for _ in range(config.runs)]
+        seconds = [result['seconds'] for result in runs]
+        report[script] = {
+            'runs': len(runs),
+            'p50_ms': percentile(seconds, 0.50) * 1000,
+            'max_ms': max(seconds) * 1000,
+            'modules_loaded': runs[-1]['modules'],
+            'loads_endpoints': runs[-1]['endpoints'],
+        }
+    return {'config': vars(config), 'scripts': report}
+
+
+if __name__ == '__main__':
+    config = parse_args()
+    report = json.dumps(run(config), indent=2, sort_keys=True)
+    if config.output:
+        with open(config.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
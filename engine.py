@@ -0,0 +1,184 @@
+"""engine.py - Bitboard engine for the Tic Tac Toe game logic.
+Each player's marks are kept as an integer bit mask (bit i set means the
+player owns cell i) and wins are checked against a precomputed table of line
+masks. The engine supports N x N boards with K-in-a-row wins and has no App
+Engine dependencies so it can be used and benchmarked on its own."""
+
+EMPTY = ' '
+PLAYER1 = 1
+PLAYER2 = 2
+# player1 marks the board with 'O' and player2 with 'X'
+MARKS = {PLAYER1: 'O', PLAYER2: 'X'}
+
+DEFAULT_SIZE = 3
+MIN_SIZE = 3
+# both players' bit masks are packed into one datastore integer (63 bits)
+MAX_SIZE = 5
+# boards with at most this many cells get a direct lookup table indexed by a
+# player's bit mask (2 ** 16 bytes for 4 x 4)
+MAX_LOOKUP_CELLS = 16
+
+_TABLES = {}
+
+
+def validate(size, win_length):
+    """Raises ValueError if the board variant is not supported."""
+    if size < MIN_SIZE or size > MAX_SIZE:
+        raise ValueError('Board size should be from {} to {}'
+                         .format(MIN_SIZE, MAX_SIZE))
+    if win_length < MIN_SIZE or win_length > size:
+        raise ValueError('Win length should be from {} to {}'
+                         .format(MIN_SIZE, size))
+
+
+def _build_tables(size, win_length):
+    """Returns all winning line masks and the masks through each cell."""
+    lines = []
+    directions = ((0, 1), (1, 0), (1, 1), (1, -1))
+    for row in range(size):
+        for col in range(size):
+            for d_row, d_col in directions:
+                end_row = row + d_row * (win_length - 1)
+                end_col = col + d_col * (win_length - 1)
+                if not (0 <= end_row < size and 0 <= end_col < size):
+                    continue
+                mask = 0
+                for step in range(win_length):
+                    mask |= 1 << ((row + d_row * step) * size +
+                                  col + d_col * step)
+                lines.append(mask)
+    cells = size * size
+    by_cell = tuple(tuple(mask for mask in lines if mask & (1 << cell))
+                    for cell in range(cells))
+    wins = None
+    if cells <= MAX_LOOKUP_CELLS:
+        # flag every superset of every line as a winning mask
+        full = (1 << cells) - 1
+        wins = bytearray(1 << cells)
+        for mask in lines:
+            rest = full & ~mask
+            subset = rest
+            while True:
+                wins[mask | subset] = 1
+                if not subset:
+                    break
+                subset = (subset - 1) & rest
+    return tuple(lines), by_cell, wins
+
+
+def tables(size=DEFAULT_SIZE, win_length=DEFAULT_SIZE):
+    """Returns the (lines, lines_by_cell, wins) tables for a board variant.
+    wins is a lookup of winning bit masks, or None for boards too large to
+    tabulate. Tables are built once per variant and cached for the
+    process."""
+    key = (size, win_length)
+    if key not in _TABLES:
+        _TABLES[key] = _build_tables(size, win_length)
+    return _TABLES[key]
+
+
+class Board(object):
+
+    """N x N board holding one bit mask per player"""
+    __slots__ = ('size', 'win_length', 'cells', 'bits1', 'bits2', '_full',
+                 '_lines', '_by_cell', '_wins')
+
+    def __init__(self, size=DEFAULT_SIZE, win_length=DEFAULT_SIZE,
+                 bits1=0, bits2=0):
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.bits1 = bits1
+        self.bits2 = bits2
+        self._full = (1 << self.cells) - 1
+        self._lines, self._by_cell, self._wins = tables(size, win_length)
+
+    @property
+    def full_mask(self):
+        return self._full
+
+    @property
+    def occupied(self):
+        return self.bits1 | self.bits2
+
+    def player_bits(self, player):
+        return self.bits1 if player == PLAYER1 else self.bits2
+
+    def is_valid_cell(self, cell):
+        return 0 <= cell < self.cells
+
+    def is_free(self, cell):
+        return not (self.bits1 | self.bits2) & (1 << cell)
+
+    def free_cells(self):
+        """Returns the list of empty cell indexes."""
+        occupied = self.bits1 | self.bits2
+        return [cell for cell in range(self.cells)
+                if not occupied & (1 << cell)]
+
+    def place(self, cell, player):
+        """Marks a cell for the player. The cell must be free."""
+        if player == PLAYER1:
+            self.bits1 |= 1 << cell
+        else:
+            self.bits2 |= 1 << cell
+
+    def is_winner(self, player):
+        """Returns True if the player owns any complete line."""
+        bits = self.bits1 if player == PLAYER1 else self.bits2
+        if self._wins is not None:
+            return bool(self._wins[bits])
+        for mask in self._lines:
+            if bits & mask == mask:
+                return True
+        return False
+
+    def is_winning_move(self, cell, player):
+        """Returns True if the player's mark on cell completes a line.
+        Only the lines running through the cell are checked."""
+        bits = self.bits1 if player == PLAYER1 else self.bits2
+        if self._wins is not None:
+            return bool(self._wins[bits])
+        for mask in self._by_cell[cell]:
+            if bits & mask == mask:
+                return True
+        return False
+
+    def is_full(self):
+        return self.bits1 | self.bits2 == self._full
+
+    def encode(self):
+        """Packs both players' masks into a single integer."""
+        return self.bits1 | (self.bits2 << self.cells)
+
+    @classmethod
+    def decode(cls, value, size=DEFAULT_SIZE, win_length=DEFAULT_SIZE):
+        """Returns the Board packed into value by encode()."""
+        cells = size * size
+        mask = (1 << cells) - 1
+        return cls(size, win_length, value & mask, (value >> cells) & mask)
+
+    def to_list(self):
+        """Returns the board as a list of marks, one per cell."""
+        bits1, bits2 = self.bits1, self.bits2
+        board = []
+        for cell in range(self.cells):
+            if bits1 & (1 << cell):
+                board.append(MARKS[PLAYER1])
+            elif bits2 & (1 << cell):
+                board.append(MARKS[PLAYER2])
+            else:
+                board.append(EMPTY)
+        return board
+
+    @classmethod
+    def from_list(cls, board, win_length=None):
+        """Returns a Board from a list of marks (the legacy Game.board)."""
+        size = int(round(len(board) ** 0.5))
+        board_obj = cls(size, win_length or size)
+        for cell, mark in enumerate(board):
+            if mark == MARKS[PLAYER1]:
+                board_obj.place(cell, PLAYER1)
+            elif mark == MARKS[PLAYER2]:
+                board_obj.place(cell, PLAYER2)
+        return board_obj
@@ -0,0 +1,122 @@
+"""game_cache.py - Memcache cache of serialised game state.
+get_game reads through this cache and make_move writes the new state through
+it, so a player polling for the opponent's move is normally served without a
+datastore read. Entries hold the protojson encoded GameForm. A get_game miss
+only adds its entry, so a form read before a concurrent move or cancel never
+replaces the newer state.
+Each game also has a version, the number of moves on its board, which
+new_game and make_move publish once their state is committed. wait_for_move
+watches the version alone, so a waiting player costs a small memcache get
+per poll."""
+
+import time
+
+from google.appengine.api import memcache
+from protorpc import protojson
+
+import engine
+from models import GameForm
+
+NAMESPACE = 'game_state'
+STATS_NAMESPACE = 'game_state_stats'
+VERSION_NAMESPACE = 'game_version'
+# entries also expire so games that are never touched again leave memcache
+CACHE_SECONDS = 60 * 60
+# after a game is cancelled, get_game misses cannot cache it again for this
+# many seconds
+LOCK_SECONDS = 10
+# how often a waiting request checks the version of its game
+POLL_SECONDS = 0.5
+
+
+def get_form(urlsafe_game_key, message):
+    """Returns the cached GameForm of a game with message set, or None on a
+    cache miss"""
+    data = memcache.get(urlsafe_game_key, namespace=NAMESPACE)
+    counted = _count('hits' if data is not None else 'misses')
+    form = None
+    if data is not None:
+        form = protojson.decode_message(GameForm, data)
+        form.message = message
+    counted.get_result()
+    return form
+
+
+def set_form(form):
+    """Starts caching a GameForm under its urlsafe game key. Returns the
+    RPC, which the caller waits on before its request ends"""
+    return memcache.Client().set_multi_async(
+        {form.urlsafe_key: protojson.encode_message(form)},
+        time=CACHE_SECONDS, namespace=NAMESPACE)
+
+
+def add_form(form):
+    """Caches a GameForm read on a cache miss, unless the game is cached
+    already or was just invalidated"""
+    memcache.Client().add_multi_async(
+        {form.urlsafe_key: protojson.encode_message(form)},
+        time=CACHE_SECONDS, namespace=NAMESPACE).get_result()
+
+
+def invalidate(urlsafe_game_key):
+    """Drops a game and its version from the cache. Adds of either are
+    refused for LOCK_SECONDS, so a request that read the game before it
+    was removed cannot cache it again"""
+    memcache.delete(urlsafe_game_key, seconds=LOCK_SECONDS,
+                    namespace=NAMESPACE)
+    memcache.delete(urlsafe_game_key, seconds=LOCK_SECONDS,
+                    namespace=VERSION_NAMESPACE)
+
+
+def moves_played(form):
+    """Returns the number of moves on the board of a GameForm"""
+    return sum(1 for mark in form.board if mark != engine.EMPTY)
+
+
+def get_version(urlsafe_game_key):
+    """Returns the published version of a game, or None if it is not
+    cached"""
+    return memcache.get(urlsafe_game_key, namespace=VERSION_NAMESPACE)
+
+
+def set_version(form):
+    """Starts publishing the version of a GameForm to waiting requests.
+    Returns the RPC, which the caller waits on before its request ends"""
+    return memcache.Client().set_multi_async(
+        {form.urlsafe_key: moves_played(form)}, time=CACHE_SECONDS,
+        namespace=VERSION_NAMESPACE)
+
+
+def seed_version(form):
+    """Caches the version of a GameForm only if the game has none, so a
+    form read before a concurrent move cannot hide the newer version"""
+    memcache.Client().add_multi_async(
+        {form.urlsafe_key: moves_played(form)}, time=CACHE_SECONDS,
+        namespace=VERSION_NAMESPACE).get_result()
+
+
+def wait_for_version(urlsafe_game_key, known, timeout):
+    """Polls the version of a game until it is past known or timeout
+    seconds have passed. Returns the last version seen, None if the game
+    has no version cached"""
+    deadline = time.time() + timeout
+    while True:
+        version = get_version(urlsafe_game_key)
+        if version is None or version > known or \
+                time.time() + POLL_SECONDS > deadline:
+            return version
+        time.sleep(POLL_SECONDS)
+
+
+def stats():
+    """Returns the (hits, misses) counters since memcache last evicted
+    them"""
+    counters = memcache.get_multi(['hits', 'misses'],
+                                  namespace=STATS_NAMESPACE)
+    return counters.get('hits', 0), counters.get('misses', 0)
+
+
+def _count(counter):
+    # the poll decodes the form while the counter is updated
+    return memcache.Client().incr_async(counter, namespace=STATS_NAMESPACE,
+                                        initial_value=0)
@@ -0,0 +1,230 @@
+"""instrumentation.py - Per-request RPC counts and latency.
+Every API call a request makes (the datastore gets, puts, queries and
+transactions issued by ndb, memcache, task queue adds and mail) goes through
+the apiproxy hooks installed here and is counted and timed by category.
+The wrap() middleware logs one JSON summary line per request, can return the
+timings in a Server-Timing header and adds each request to rolling
+per-endpoint aggregates in memcache, read by /admin/request_stats."""
+
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map, memcache
+
+NAMESPACE = 'request_stats'
+# aggregates are kept in buckets of BUCKET_SECONDS, the last BUCKETS of
+# them are reported
+BUCKET_SECONDS = 5 * 60
+BUCKETS = 12
+# add a Server-Timing header with the per category RPC times to responses
+TIMING_HEADERS = False
+
+CATEGORIES = ('datastore_get', 'datastore_put', 'datastore_delete',
+              'datastore_query', 'datastore_txn', 'datastore_other',
+              'memcache', 'taskqueue', 'mail', 'other')
+_DATASTORE_CALLS = {'Get': 'datastore_get', 'Put': 'datastore_put',
+                    'Delete': 'datastore_delete',
+                    'RunQuery': 'datastore_query', 'Next': 'datastore_query',
+                    'BeginTransaction': 'datastore_txn',
+                    'Commit': 'datastore_txn', 'Rollback': 'datastore_txn'}
+_SERVICES = {'memcache': 'memcache', 'taskqueue': 'taskqueue',
+             'mail': 'mail'}
+_FIELDS = ['count', 'errors', 'ms'] + \
+    ['n.' + category for category in CATEGORIES] + \
+    ['ms.' + category for category in CATEGORIES]
+HOOK_NAME = 'request_stats'
+REGISTRY_KEY = 'endpoints'
+_SPI_PREFIX = '/_ah/spi/'
+
+_local = threading.local()
+# endpoint -> when this instance last made sure it is in the registry
+_registered = {}
+
+
+def category(service, call):
+    """Returns the category an API call is counted under"""
+    if service == 'datastore_v3':
+        return _DATASTORE_CALLS.get(call, 'datastore_other')
+    return _SERVICES.get(service, 'other')
+
+
+class RequestStats(object):
+
+    """RPC counts and times of one request"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.time()
+        self.counts = dict.fromkeys(CATEGORIES, 0)
+        self.ms = dict.fromkeys(CATEGORIES, 0.0)
+        self._pending = {}
+
+    def start(self, rpc):
+        self._pending[id(rpc)] = time.time()
+
+    def finish(self, service, call, rpc):
+        name = category(service, call)
+        started = self._pending.pop(id(rpc), None)
+        self.counts[name] += 1
+        if started is not None:
+            self.ms[name] += (time.time() - started) * 1000
+
+    def server_timing(self):
+        return ', '.join('{};dur={:.1f};desc="{} calls"'.format(
+            name, self.ms[name], self.counts[name])
+            for name in CATEGORIES if self.counts[name])
+
+    def summary(self, status):
+        return {'endpoint': self.endpoint, 'status': status,
+                'ms': round((time.time() - self.started) * 1000, 1),
+                'rpcs': dict((name, self.counts[name]) for name in CATEGORIES
+                             if self.counts[name]),
+                'rpc_ms': dict((name, round(self.ms[name], 1))
+                               for name in CATEGORIES if self.counts[name])}
+
+
+def current():
+    """Returns the RequestStats of the running request, or None"""
+    return getattr(_local, 'stats', None)
+
+
+def _pre_call(service, call, request, response, rpc):
+    stats = current()
+    if stats:
+        stats.start(rpc)
+
+
+def _post_call(service, call, request, response, rpc):
+    stats = current()
+    if stats:
+        stats.finish(service, call, rpc)
+
+
+def install():
+    """Installs the apiproxy hooks. Safe to call on every request"""
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append(HOOK_NAME, _pre_call)
+    apiproxy.GetPostCallHooks().Append(HOOK_NAME, _post_call)
+
+
+def endpoint_name(environ):
+    path = environ.get('PATH_INFO', '')
+    if path.startswith(_SPI_PREFIX):
+        # TicTacToeApi.make_move
+        return path[len(_SPI_PREFIX):]
+    return path
+
+
+class Middleware(object):
+
+    """WSGI middleware that collects RequestStats for every request. Other
+    attributes are those of the wrapped application"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __getattr__(self, name):
+        return getattr(self.app, name)
+
+    def __call__(self, environ, start_response):
+        install()
+        stats = _local.stats = RequestStats(endpoint_name(environ))
+        statuses = []
+
+        def _start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            if TIMING_HEADERS:
+                headers = list(headers) + [
+                    ('Server-Timing', stats.server_timing())]
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.app(environ, _start_response)
+        finally:
+            # the bookkeeping below is not counted against the request
+            _local.stats = None
+            status = int(statuses[0].split()[0]) if statuses else 500
+            record(stats, status)
+
+
+def wrap(app):
+    """Returns app wrapped in the instrumentation middleware"""
+    return Middleware(app)
+
+
+def record(stats, status):
+    """Logs the summary of a finished request and adds it to the rolling
+    aggregates"""
+    logging.info('request_stats %s',
+                 json.dumps(stats.summary(status), sort_keys=True))
+    # unknown paths are pooled so they cannot grow the registry
+    endpoint = 'not_found' if status == 404 else stats.endpoint
+    deltas = {'count': 1, 'errors': 1 if status >= 500 else 0,
+              'ms': int((time.time() - stats.started) * 1000)}
+    for name in CATEGORIES:
+        if stats.counts[name]:
+            deltas['n.' + name] = stats.counts[name]
+            deltas['ms.' + name] = int(stats.ms[name])
+    # the registry check overlaps the counter update
+    rpc = memcache.Client().offset_multi_async(
+        deltas, key_prefix=_prefix(endpoint, stats.started),
+        namespace=NAMESPACE, initial_value=0)
+    _register(endpoint)
+    rpc.get_result()
+
+
+def _prefix(endpoint, when):
+    return '{}:{}:'.format(int(when // BUCKET_SECONDS), endpoint)
+
+
+def _register(endpoint):
+    """Adds endpoint to the list of endpoints with aggregates. Each instance
+    checks at most once per bucket, as memcache may have evicted the list"""
+    now = time.time()
+    if now - _registered.get(endpoint, 0) < BUCKET_SECONDS:
+        return
+    client = memcache.Client()
+    for _ in range(3):
+        names = client.gets(REGISTRY_KEY, namespace=NAMESPACE)
+        if names is None:
+            if client.add(REGISTRY_KEY, [endpoint], namespace=NAMESPACE):
+                break
+        elif endpoint in names or client.cas(
+                REGISTRY_KEY, names + [endpoint], namespace=NAMESPACE):
+            break
+    _registered[endpoint] = now
+
+
+def aggregates(now=None):
+    """Returns {endpoint: totals} over the last BUCKETS buckets. Totals hold
+    the request count, errors, average latency and, per RPC category, the
+    average calls and milliseconds per request"""
+    now = now or time.time()
+    names = memcache.get(REGISTRY_KEY, namespace=NAMESPACE) or []
+    buckets = [now - offset * BUCKET_SECONDS for offset in range(BUCKETS)]
+    keys = [_prefix(name, when) + field for name in names
+            for when in buckets for field in _FIELDS]
+    values = memcache.get_multi(keys, namespace=NAMESPACE)
+
+    result = {}
+    for name in names:
+        totals = dict.fromkeys(_FIELDS, 0)
+        for when in buckets:
+            prefix = _prefix(name, when)
+            for field in _FIELDS:
+                totals[field] += values.get(prefix + field, 0)
+        count = totals['count']
+        if not count:
+            continue
+        result[name] = {
+            'count': count,
+            'errors': totals['errors'],
+            'avg_ms': float(totals['ms']) / count,
+            'rpcs': dict((category_name, {
+                'per_request': float(totals['n.' + category_name]) / count,
+                'avg_ms': float(totals['ms.' + category_name]) / count})
+                for category_name in CATEGORIES
+                if totals['n.' + category_name])}
+    return result
@@ -0,0 +1,222 @@
+"""leaderboard.py - Precomputed leaderboard snapshot.
+The top N players are kept in a few LeaderboardShard entities and the number
+of ranked players in each winning percent bucket in LeaderboardState, so the
+top N or a player's rank is one small batched read instead of a query over
+every Ranking. The snapshot is updated incrementally from the Rankings that
+changed since the last update, at most once per FRESHNESS_SECONDS."""
+
+import datetime
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Ranking, LeaderboardState, LeaderboardShard,\
+    LeaderboardEntry
+
+TOP_N = 100
+SHARD_SIZE = 25
+SHARDS = (TOP_N + SHARD_SIZE - 1) // SHARD_SIZE
+# winning percent buckets used to estimate the rank of players below the
+# top N
+BUCKETS = 100
+# the snapshot trails Ranking changes by at most this many seconds
+FRESHNESS_SECONDS = 5 * 60
+# rankings changed in the last few seconds may still be committing, they
+# are left for the next update
+SETTLE_SECONDS = 30
+# rankings applied by each update task
+UPDATE_BATCH_SIZE = 500
+# rankings recounted by each full rebuild task
+REBUILD_PAGE_SIZE = 500
+# the leaderboard queue runs one task at a time (see queue.yaml), so
+# updates and rebuild pages never overlap
+QUEUE = 'leaderboard'
+
+STATE_KEY = ndb.Key(LeaderboardState, 'state')
+SHARD_KEYS = [ndb.Key(LeaderboardShard, 'top-{}'.format(shard))
+              for shard in range(SHARDS)]
+
+
+def bucket_for(ranking):
+    """Returns the ranking's winning percent bucket, or None if the player
+    does not have enough games to be ranked"""
+    if ranking.ranked_percent is None:
+        return None
+    return min(int(ranking.ranked_percent * BUCKETS), BUCKETS - 1)
+
+
+def _entry_key(ranking):
+    return ndb.Key(LeaderboardEntry, 'entry', parent=ranking.user)
+
+
+def _row(ranking):
+    return [ranking.user_name, ranking.ranked_percent, ranking.games_played]
+
+
+def _sort_rows(rows):
+    return sorted(rows, key=lambda row: (-row[1], -row[2], row[0]))
+
+
+def _query_top():
+    """Returns the current top N rows straight from the Ranking index"""
+    rankings = Ranking.query().order(-Ranking.ranked_percent).fetch(TOP_N)
+    return _sort_rows(_row(ranking) for ranking in rankings
+                      if ranking.ranked_percent is not None)
+
+
+def _snapshot(state, rows):
+    """Returns the shard entities holding rows and sets the state cutoff"""
+    state.cutoff = rows[-1][1] if len(rows) >= TOP_N else 0.0
+    return [LeaderboardShard(key=key, entries=rows[index * SHARD_SIZE:
+                                                   (index + 1) * SHARD_SIZE])
+            for index, key in enumerate(SHARD_KEYS)]
+
+
+def get_top(limit=TOP_N):
+    """Returns up to limit [name, winning percent, games played] rows"""
+    limit = max(1, min(limit, TOP_N))
+    rows = []
+    for shard in ndb.get_multi(SHARD_KEYS[:(limit - 1) // SHARD_SIZE + 1]):
+        if shard:
+            rows.extend(shard.entries)
+    return rows[:limit]
+
+
+def get_rank(user_key):
+    """Returns (ranking, rank, exact) for a user. rank is None if the user
+    is not ranked. Players in the top N get their exact position; below it
+    the rank counts the players in higher buckets, so exact is False"""
+    ranking, state = ndb.get_multi([Ranking.key_for(user_key), STATE_KEY])
+    if not ranking or not state or not state.counts:
+        return ranking, None, False
+    bucket = bucket_for(ranking)
+    if bucket is None:
+        return ranking, None, False
+    if ranking.ranked_percent >= state.cutoff:
+        for position, row in enumerate(get_top()):
+            if row[0] == ranking.user_name:
+                return ranking, position + 1, True
+    return ranking, 1 + sum(state.counts[bucket + 1:]), False
+
+
+def update_task(now=None):
+    """Returns the named task that applies Ranking changes to the snapshot.
+    There is one task per freshness window, so a burst of finished games
+    leads to a single update"""
+    now = now or time.time()
+    window = int(now // FRESHNESS_SECONDS)
+    return taskqueue.Task(
+        name='leaderboard-{}'.format(window),
+        url='/tasks/leaderboard_update',
+        countdown=(window + 1) * FRESHNESS_SECONDS - now + SETTLE_SECONDS)
+
+
+def queue_update():
+    """Starts asking for an update of the snapshot. Returns the RPC, which
+    the caller waits on before its request ends. The request is dropped if
+    this window's update is already queued"""
+    return taskqueue.Queue(QUEUE).add_async([update_task()])
+
+
+def wait_queued(rpc):
+    """Waits for the task of queue_update to be added. An update already
+    queued for the window is not an error"""
+    try:
+        rpc.get_result()
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.DuplicateTaskNameError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def apply_changes():
+    """Applies the Rankings changed since the last update to the snapshot.
+    Returns True if more changes are waiting to be applied"""
+    state = STATE_KEY.get()
+    if state and state.rebuilding:
+        return False
+    if not state or state.counts is None:
+        start_rebuild()
+        return False
+
+    until = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=SETTLE_SECONDS)
+    changed = Ranking.query(Ranking.updated >= state.as_of,
+                            Ranking.updated < until).order(
+        Ranking.updated).fetch(UPDATE_BATCH_SIZE)
+    more = len(changed) == UPDATE_BATCH_SIZE
+
+    # move each changed player between buckets. LeaderboardEntry remembers
+    # where a player was counted, so applying a change twice is harmless
+    entries = ndb.get_multi([_entry_key(ranking) for ranking in changed])
+    to_put = []
+    for ranking, entry in zip(changed, entries):
+        old = entry.bucket if entry else None
+        new = bucket_for(ranking)
+        if entry and old == new:
+            continue
+        if old is not None:
+            state.counts[old] -= 1
+        if new is not None:
+            state.counts[new] += 1
+        to_put.append(LeaderboardEntry(key=_entry_key(ranking), bucket=new))
+
+    rows = dict((row[0], row) for row in get_top())
+    dropped = False
+    for ranking in changed:
+        listed = rows.pop(ranking.user_name, None)
+        if ranking.ranked_percent is None:
+            continue
+        if listed and ranking.ranked_percent < (state.cutoff or 0.0):
+            # players outside the snapshot may now rank above them
+            dropped = True
+        else:
+            rows[ranking.user_name] = _row(ranking)
+    top = _sort_rows(rows.values())[:TOP_N]
+    if dropped or len(top) < min(TOP_N, sum(state.counts)):
+        # players dropped out of the top N, refill it from the index
+        top = _query_top()
+
+    state.as_of = changed[-1].updated if more else until
+    to_put.extend(_snapshot(state, top))
+    to_put.append(state)
+    ndb.put_multi(to_put)
+    return more
+
+
+def start_rebuild():
+    """Starts a full rebuild of the snapshot from every Ranking"""
+    state = STATE_KEY.get() or LeaderboardState(key=STATE_KEY)
+    state.rebuilding = True
+    state.put()
+    taskqueue.add(params={'started': time.time()},
+                  url='/tasks/leaderboard_rebuild', queue_name=QUEUE)
+
+
+def rebuild_page(cursor, counts, started):
+    """Recounts one page of Rankings into counts for a full rebuild.
+    Returns the cursor of the next page, or None once the rebuild has been
+    written"""
+    rankings, next_cursor, more = Ranking.query().fetch_page(
+        REBUILD_PAGE_SIZE, start_cursor=cursor)
+    entries = ndb.get_multi([_entry_key(ranking) for ranking in rankings])
+    to_put = []
+    for ranking, entry in zip(rankings, entries):
+        bucket = bucket_for(ranking)
+        if bucket is not None:
+            counts[bucket] += 1
+        if not entry or entry.bucket != bucket:
+            to_put.append(LeaderboardEntry(key=_entry_key(ranking),
+                                           bucket=bucket))
+    ndb.put_multi(to_put)
+    if more and next_cursor:
+        return next_cursor
+
+    # changes made while the rebuild ran are picked up by the next update
+    state = LeaderboardState(
+        key=STATE_KEY, counts=counts, rebuilding=False,
+        as_of=datetime.datetime.utcfromtimestamp(started) -
+        datetime.timedelta(seconds=SETTLE_SECONDS))
+    ndb.put_multi(_snapshot(state, _query_top()) + [state])
+    return None
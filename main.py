@@ -3,41 +3,56 @@
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
 
+import json
+
 import webapp2
-from google.appengine.api import mail, app_identity
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
-from api import TicTacToeApi
+import ai
+import archive
+import engine
+import game_cache
+import instrumentation
+import leaderboard
+import matchmaking
+import reminders
+import transfer
+from models import User, UserName, ActiveGames, Game, Score, Ranking,\
+    ScoreRollup, GameStats, UserCache, TransferJob, Backfill
 
-from models import User, Game
+# number of users recounted by each backfill task
+BACKFILL_PAGE_SIZE = 50
 
 
 class SendReminderEmail_all(webapp2.RequestHandler):
 
     def get(self):
         """Send a reminder email to each User with incomplete games.
-        Called every hour using a cron job"""
-        app_id = app_identity.get_application_id()
+        Called every hour using a cron job.  The work is done by a chain of
+        /tasks/reminder_digests tasks, one page of games each"""
+        reminders.start_digests()
 
-        games = Game.query(Game.game_over == False)
 
-        for game in games:
-            # send email to user with email address and their turn to play
-            users = User.query(User.email != None, User.name == game.next_turn)
-            for user in users:
-
-                subject = 'This is a reminder!'
-                body = (
-                    'Hello {}, it is your turn.  Please complete your '
-                    'Tic Tac Toe with gameid = {} !'.format(
-                        user.name, game.key.urlsafe()))
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               user.email,
-                               subject,
-                               body)
-                # logging.info(body)
+class ReminderDigests(webapp2.RequestHandler):
+
+    def post(self):
+        """Build the reminder digests for one page of active games.
+           Will be called from task queue"""
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor') or None)
+        carry_name = self.request.get('carry_name')
+        carry = (carry_name, self.request.get('carry_games').split(',')) \
+            if carry_name else None
+        reminders.digest_page(cursor, carry)
+        self.response.set_status(204)
+
+
+class SendDigests(webapp2.RequestHandler):
+
+    def post(self):
+        """Send one batch of reminder digests built by ReminderDigests.
+           Will be called from task queue"""
+        reminders.send_digests(json.loads(self.request.body))
 
 
 class SendReminderEmail(webapp2.RequestHandler):
@@ -45,37 +60,429 @@ class SendReminderEmail(webapp2.RequestHandler):
     def post(self):
         """Turn notification reminder email.
            Will be called called from a taskqueue"""
+        reminders.send_turn_reminder(self.request.get('user_id'),
+                                     self.request.get('game_id'))
 
-        app_id = app_identity.get_application_id()
 
-        user_key = ndb.Key(urlsafe=self.request.get('user_id'))
+class UpdateRanking(webapp2.RequestHandler):
+
+    def post(self):
+        """Recount a player's ranking from their scores.
+           Rankings are now updated when a game ends; this only serves tasks
+           queued before that change"""
+        user = UserName.get_by_name(self.request.get('player'))
+        if user:
+            Ranking.rebuild(user.user)
+        self.response.set_status(204)
 
-        subject = 'This is a reminder!'
-        body = (
-            'Hello {}, it is your turn.  Please complete your '
-            'Tic Tac Toe with gameid = {} !'.format(
-                user_key.get().name, self.request.get('game_id')))
 
-        # This will send test emails, the arguments to send_mail are:
-        # from, to, subject, body
-        mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                       user_key.get().email,
-                       subject,
-                       body)
-        # logging.info(body)
+class BackfillRankings(webapp2.RequestHandler):
 
+    def get(self):
+        """Start the one-off ranking backfill. Admin only"""
+        taskqueue.add(url='/tasks/backfill_rankings')
+        self.response.write('Ranking backfill started')
 
-class UpdateRanking(webapp2.RequestHandler):
+    def post(self):
+        """Recount the rankings of one page of users and chain the next page.
+           Will be called from task queue"""
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor') or None)
+        user_keys, next_cursor, more = User.query().fetch_page(
+            BACKFILL_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+
+        # recount every user on the page concurrently, each in its own
+        # transaction, while looking up their old root level rankings
+        rebuilds = [Ranking.rebuild_async(user_key) for user_key in user_keys]
+        queries = [Ranking.query(Ranking.user == user_key).fetch_async(
+            keys_only=True) for user_key in user_keys]
+        for rebuild in rebuilds:
+            rebuild.check_success()
+        legacy = [key for query in queries for key in query.get_result()
+                  if key.parent() is None]
+        ndb.delete_multi(legacy)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_rankings')
+        else:
+            # every ranking may have moved, recount the leaderboard as well
+            leaderboard.start_rebuild()
+        self.response.set_status(204)
+
+
+class BackfillScoreRollups(webapp2.RequestHandler):
+
+    def get(self):
+        """Start the daily score rollup backfill. Admin only"""
+        taskqueue.add(url='/tasks/backfill_score_rollups')
+        self.response.write('Score rollup backfill started')
 
     def post(self):
-        """Update player rankings.
+        """Recount the daily rollups of one page of users from their scores
+           and chain the next page. Will be called from task queue"""
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor') or None)
+        user_keys, next_cursor, more = User.query().fetch_page(
+            BACKFILL_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+        rebuilds = [ScoreRollup.rebuild_async(user_key)
+                    for user_key in user_keys]
+        for rebuild in rebuilds:
+            rebuild.check_success()
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_score_rollups')
+        self.response.set_status(204)
+
+
+class BackfillUserNames(webapp2.RequestHandler):
+
+    def get(self):
+        """Start the one-off UserName index backfill. Admin only"""
+        taskqueue.add(url='/tasks/backfill_user_names')
+        self.response.write('User name index backfill started')
+
+    def post(self):
+        """Index one page of users by name and chain the next page.
            Will be called from task queue"""
-        TicTacToeApi._get_winning_percentage(self.request.get('player'))
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor') or None)
+        users, next_cursor, more = User.query().fetch_page(
+            BACKFILL_PAGE_SIZE, start_cursor=cursor)
+
+        indexes = UserName.get_by_names([user.name for user in users])
+        for user, index in zip(users, indexes):
+            if not index:
+                # if duplicate names slipped in before the index existed the
+                # first user claimed keeps the name
+                UserName.claim(user)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_user_names')
+        self.response.set_status(204)
+
+
+@ndb.transactional_tasklet
+def _set_names_async(key, names):
+    """Sets user name properties on an entity that may be written
+    concurrently (a Game or Ranking)"""
+    entity = yield key.get_async()
+    if entity:
+        entity.populate(**names)
+        yield entity.put_async()
+
+
+class BackfillNames(webapp2.RequestHandler):
+
+    def get(self):
+        """Start the one-off player name backfill. Admin only"""
+        for kind in ('Game', 'Score', 'Ranking'):
+            taskqueue.add(params={'kind': kind},
+                          url='/tasks/backfill_names')
+        self.response.write('Player name backfill started')
+
+    def post(self):
+        """Copy user names onto one page of Game, Score or Ranking entities
+           and chain the next page. Will be called from task queue"""
+        kind = self.request.get('kind')
+        model = {'Game': Game, 'Score': Score, 'Ranking': Ranking}.get(kind)
+        if not model:
+            self.response.set_status(400)
+            return
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor') or None)
+        entities, next_cursor, more = model.query().fetch_page(
+            BACKFILL_PAGE_SIZE, start_cursor=cursor)
+
+        users = UserCache()
+        updates = []
+        if model is Game:
+            games = [game for game in entities if not game.player2_name]
+            users.prefetch(key for game in games
+                           for key in (game.player1, game.player2))
+            updates = [_set_names_async(
+                game.key, {'player1_name': users.name(game.player1),
+                           'player2_name': users.name(game.player2)})
+                for game in games]
+        else:
+            changed = [entity for entity in entities if not entity.user_name]
+            users.prefetch(entity.user for entity in changed)
+            for entity in changed:
+                entity.user_name = users.name(entity.user)
+            if model is Score:
+                # scores are never modified after they are written
+                ndb.put_multi(changed)
+            else:
+                updates = [_set_names_async(
+                    entity.key, {'user_name': entity.user_name})
+                    for entity in changed]
+        # the updates run concurrently, each in its own transaction
+        for update in updates:
+            update.check_success()
+
+        if more and next_cursor:
+            taskqueue.add(params={'kind': kind,
+                                  'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_names')
+        else:
+            # listings of this kind can now project the names
+            Backfill(id='names-' + kind).put()
+        self.response.set_status(204)
+
+
+class LeaderboardUpdate(webapp2.RequestHandler):
+
+    def post(self):
+        """Apply recent Ranking changes to the leaderboard snapshot.
+           Will be called from task queue"""
+        if leaderboard.apply_changes():
+            taskqueue.add(url='/tasks/leaderboard_update',
+                          queue_name=leaderboard.QUEUE)
+        self.response.set_status(204)
+
+
+class LeaderboardRebuild(webapp2.RequestHandler):
+
+    def get(self):
+        """Start a full leaderboard rebuild.
+        Called every day using a cron job as a safety net for the
+        incremental updates"""
+        leaderboard.start_rebuild()
+
+    def post(self):
+        """Recount one page of rankings and chain the next page.
+           Will be called from task queue"""
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor') or None)
+        counts = json.loads(self.request.get('counts') or 'null') or \
+            [0] * leaderboard.BUCKETS
+        started = float(self.request.get('started'))
+        next_cursor = leaderboard.rebuild_page(cursor, counts, started)
+        if next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe(),
+                                  'counts': json.dumps(counts),
+                                  'started': started},
+                          url='/tasks/leaderboard_rebuild',
+                          queue_name=leaderboard.QUEUE)
+        self.response.set_status(204)
+
+
+@ndb.transactional_tasklet
+def _add_active_games_async(user_key, game_keys):
+    yield ActiveGames.update_async([user_key], add=game_keys)
+
+
+class BackfillActiveGames(webapp2.RequestHandler):
+
+    def get(self):
+        """Start the one-off ActiveGames backfill. Admin only"""
+        taskqueue.add(url='/tasks/backfill_active_games')
+        self.response.write('Active games backfill started')
+
+    def post(self):
+        """Add one page of games in progress to their players'
+           ActiveGames and chain the next page. Will be called from task
+           queue"""
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor') or None)
+        games, next_cursor, more = Game.query(
+            Game.game_over == False).fetch_page(
+            BACKFILL_PAGE_SIZE, start_cursor=cursor)
+
+        # one transaction per player, all running concurrently
+        by_user = {}
+        for game in games:
+            for user_key in game.indexed_players():
+                by_user.setdefault(user_key, []).append(game.key)
+        updates = [_add_active_games_async(user_key, game_keys)
+                   for user_key, game_keys in by_user.items()]
+        for update in updates:
+            update.check_success()
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_active_games')
+        self.response.set_status(204)
+
+
+class ArchiveGame(webapp2.RequestHandler):
+
+    def post(self):
+        """Move a finished game into the archive.
+           Will be called from task queue"""
+        archive.archive_async(
+            ndb.Key(urlsafe=self.request.get('game'))).check_success()
+        self.response.set_status(204)
+
+
+class BackfillArchive(webapp2.RequestHandler):
+
+    def get(self):
+        """Start the one-off archiving of finished games. Admin only"""
+        taskqueue.add(url='/tasks/backfill_archive')
+        self.response.write('Game archive backfill started')
+
+    def post(self):
+        """Archive one page of finished games and chain the next page.
+           Will be called from task queue"""
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor') or None)
+        next_cursor = archive.backfill_page(cursor)
+        if next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_archive')
+        self.response.set_status(204)
+
+
+class TransferHandler(webapp2.RequestHandler):
+
+    operation = None
+
+    def get(self):
+        """Start a bulk transfer, or show the progress of ?job=<id>.
+        Admin only"""
+        job_id = self.request.get('job')
+        if job_id:
+            job = TransferJob.get_by_id(int(job_id))
+            if not job or job.operation != self.operation:
+                self.response.set_status(404)
+                return
+        else:
+            try:
+                job = transfer.start(self.operation,
+                                     int(self.request.get('source') or 0))
+            except ValueError as e:
+                self.response.set_status(400)
+                self.response.write(str(e))
+                return
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'job': job.key.id(), 'operation': job.operation,
+            'source': job.source, 'page': job.page, 'done': job.done,
+            'counts': job.counts}))
+
+    def post(self):
+        """Process one page of a transfer and chain the next page.
+           Will be called from task queue"""
+        job_id = int(self.request.get('job'))
+        page = int(self.request.get('page'))
+        if self.operation == transfer.EXPORT:
+            transfer.export_page(job_id, page)
+        else:
+            transfer.import_page(job_id, page)
+        self.response.set_status(204)
+
+
+class Export(TransferHandler):
+
+    """Writes every User, game, Score and Ranking to TransferChunks"""
+    operation = transfer.EXPORT
+
+
+class Import(TransferHandler):
+
+    """Reads the export job ?source=<id> back into the datastore"""
+    operation = transfer.IMPORT
+
+
+class MatchPairs(webapp2.RequestHandler):
+
+    def post(self):
+        """Pair the players waiting in one rating band.
+           Will be called from task queue"""
+        matchmaking.pair_band(int(self.request.get('band')),
+                              int(self.request.get('window')))
+        self.response.set_status(204)
+
+
+class MatchBatch(webapp2.RequestHandler):
+
+    def post(self):
+        """Create the games of one batch of pairs.
+           Will be called from task queue"""
+        matchmaking.create_games(self.request.get('batch'))
+        self.response.set_status(204)
+
+
+class GameCacheStats(webapp2.RequestHandler):
+
+    def get(self):
+        """Show the game state cache hit and miss counters as JSON.
+        Admin only"""
+        hits, misses = game_cache.stats()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'hits': hits, 'misses': misses}))
+
+
+class RequestStats(webapp2.RequestHandler):
+
+    def get(self):
+        """Show the rolling per-endpoint RPC and latency aggregates as
+        JSON. Admin only"""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(instrumentation.aggregates(),
+                                       indent=2, sort_keys=True))
+
+
+class GameStatsHandler(webapp2.RequestHandler):
+
+    def get(self):
+        """Show the served offline game statistics as JSON. Admin only"""
+        stats = GameStats.latest()
+        if not stats:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(stats.summary, indent=2,
+                                       sort_keys=True))
+
+    def post(self):
+        """Load the JSON summary written by analytics.py, which replaces the
+        served statistics. Admin only"""
+        try:
+            summary = json.loads(self.request.body)
+        except ValueError:
+            self.abort(400, 'The body must be a JSON summary')
+        if not isinstance(summary, dict) or 'variants' not in summary:
+            self.abort(400, 'The body must be a JSON summary')
+        GameStats.store(summary)
+        self.response.set_status(204)
+
+
+class Warmup(webapp2.RequestHandler):
+
+    def get(self):
+        """Load what the first requests of a new instance would otherwise
+        pay for: the board tables, the solved standard board of the bot
+        and the endpoints server with its request message classes.
+        Called by App Engine before the instance serves traffic"""
+        engine.tables()
+        ai.warm_up()
+        # the task handlers never need the endpoints stack, so it is only
+        # imported here
+        import api
+        import endpoints
+        for container in vars(api).values():
+            if isinstance(container, endpoints.ResourceContainer):
+                container.combined_message_class
         self.response.set_status(204)
 
 
-app = webapp2.WSGIApplication([
+app = instrumentation.wrap(webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail_all),
+    ('/tasks/reminder_digests', ReminderDigests),
+    ('/tasks/send_digests', SendDigests),
     ('/tasks/update_ranking', UpdateRanking),
+    ('/tasks/leaderboard_update', LeaderboardUpdate),
+    ('/tasks/leaderboard_rebuild', LeaderboardRebuild),
+    ('/crons/leaderboard_rebuild', LeaderboardRebuild),
+    ('/tasks/backfill_rankings', BackfillRankings),
+    ('/tasks/backfill_score_rollups', BackfillScoreRollups),
+    ('/tasks/backfill_names', BackfillNames),
+    ('/tasks/backfill_user_names', BackfillUserNames),
     ('/tasks/send_reminder', SendReminderEmail),
-], debug=True)
+    ('/tasks/backfill_active_games', BackfillActiveGames),
+    ('/tasks/archive_game', ArchiveGame),
+    ('/tasks/backfill_archive', BackfillArchive),
+    ('/tasks/export', Export),
+    ('/tasks/import', Import),
+    ('/tasks/match_pairs', MatchPairs),
+    ('/tasks/match_batch', MatchBatch),
+    ('/admin/cache_stats', GameCacheStats),
+    ('/admin/request_stats', RequestStats),
+    ('/admin/game_stats', GameStatsHandler),
+    ('/_ah/warmup', Warmup),
+], debug=True))
@@ -0,0 +1,229 @@
+"""matchmaking.py - Quick-pair games between waiting players.
+Players join the waiting pool of their rating band, which is split over
+SHARDS MatchPool entities so concurrent joins rarely touch the same entity
+group; a join is one small transaction. Joins queue a named pairing task per
+band and time window, so a burst of joins is paired by a single run. The
+run empties each shard of the band into a MatchBatch in its own small
+transaction and pairs the players in join order; the pairs are turned into
+games, put in one batch, by a follow-up task. Each
+player's MatchTicket records where they are, so polling is one key read."""
+
+import random
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import engine
+import notifications
+from models import ActiveGames, Game, MatchBatch, MatchPool, MatchTicket,\
+    Ranking
+
+# winning percent bands players are paired within. Players without a
+# finished game join the middle band
+BANDS = 5
+SHARDS = 8
+# joins within the same window of a band are paired together
+PAIR_WINDOW_SECONDS = 5
+# players not paired within this many seconds leave the queue
+WAIT_SECONDS = 10 * 60
+
+
+def band_for(ranking):
+    """Returns the rating band of a player's Ranking (or None)"""
+    if not ranking or ranking.winning_percent is None:
+        return BANDS // 2
+    return min(int(ranking.winning_percent * BANDS), BANDS - 1)
+
+
+def _pool_key(band, shard):
+    return ndb.Key(MatchPool, '{}-{}'.format(band, shard))
+
+
+def status(ticket, now=None):
+    """Returns 'none', 'waiting', 'matched' or 'expired' for a ticket"""
+    now = now or time.time()
+    if not ticket:
+        return 'none'
+    if ticket.game:
+        return 'matched'
+    if now - ticket.joined > WAIT_SECONDS:
+        return 'expired'
+    return 'waiting'
+
+
+def join(user):
+    """Adds a user (a UserName index entity) to the waiting pool of their
+    band. Returns their MatchTicket; users already waiting or just paired
+    get their current one"""
+    ranking = Ranking.key_for(user.user).get()
+    band = band_for(ranking)
+    ticket, joined = _join(user, band, random.randrange(SHARDS))
+    if joined:
+        queue_pairing(band)
+    return ticket
+
+
+@ndb.transactional(xg=True)
+def _join(user, band, shard):
+    now = time.time()
+    key = MatchTicket.key_for(user.user)
+    ticket, pool = ndb.get_multi([key, _pool_key(band, shard)])
+    if status(ticket, now) == 'waiting':
+        return ticket, False
+    ticket = MatchTicket(key=key, joined=now, band=band)
+    pool = pool or MatchPool(key=_pool_key(band, shard))
+    pool.waiting = (pool.waiting or []) + [
+        [user.user.urlsafe(), user.name, now]]
+    ndb.put_multi([ticket, pool])
+    return ticket, True
+
+
+def queue_pairing(band, now=None):
+    """Queues the pairing run of band for the window of now (the current
+    one by default), which runs when the window ends. Joins in the same
+    window share the run"""
+    window = int((now or time.time()) // PAIR_WINDOW_SECONDS)
+    try:
+        taskqueue.add(name='match-{}-{}'.format(band, window),
+                      params={'band': band, 'window': window},
+                      url='/tasks/match_pairs',
+                      countdown=max((window + 1) * PAIR_WINDOW_SECONDS -
+                                    time.time(), 0))
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def pair_band(band, window):
+    """Runs the pairing of band for a window. The shards are read outside
+    any transaction and each one with players waiting is emptied into the
+    run's MatchBatch in its own small transaction, so joins only ever
+    contend with the shard they write to. The players are then paired in
+    join order. A player left over by an odd count goes back to the pool
+    and gets another run in the next window, shared with any joins made by
+    then. A retried run carries on where it stopped. Returns the number of
+    pairs"""
+    batch_key = ndb.Key(MatchBatch, '{}-{}'.format(band, window))
+    keys = [_pool_key(band, shard) for shard in range(SHARDS)]
+    for key, pool in zip(keys, ndb.get_multi(keys)):
+        if pool and pool.waiting:
+            _take_shard(batch_key, key)
+    pairs, left = _pair_batch(batch_key)
+    if left:
+        queue_pairing(band, time.time() + PAIR_WINDOW_SECONDS)
+    return pairs
+
+
+@ndb.transactional(xg=True)
+def _take_shard(batch_key, pool_key):
+    """Moves the players waiting in one pool shard into the batch of a
+    pairing run. Players who waited longer than WAIT_SECONDS are dropped"""
+    now = time.time()
+    batch, pool = ndb.get_multi([batch_key, pool_key])
+    batch = batch or MatchBatch(key=batch_key, waiting=[])
+    if batch.pairs is not None or not pool or not pool.waiting:
+        # the run has already paired its players, or a concurrent run
+        # emptied the shard
+        return
+    # each row remembers its shard in case it is the one left over
+    batch.waiting.extend(row + [pool_key.id()] for row in pool.waiting
+                         if now - row[2] <= WAIT_SECONDS)
+    pool.waiting = []
+    ndb.put_multi([batch, pool])
+
+
+@ndb.transactional(xg=True)
+def _pair_batch(batch_key):
+    """Pairs the players taken into a run's batch in join order and queues
+    the creation of their games. The odd player out goes back to their
+    shard. Returns the number of pairs and whether a player was left"""
+    batch = batch_key.get()
+    if not batch:
+        return 0, False
+    if batch.pairs is not None:
+        return len(batch.pairs), batch.left
+    rows = sorted(batch.waiting, key=lambda row: row[2])
+    left = rows.pop() if len(rows) % 2 else None
+    to_put = []
+    if left:
+        pool_key = ndb.Key(MatchPool, left[3])
+        pool = pool_key.get() or MatchPool(key=pool_key)
+        pool.waiting = (pool.waiting or []) + [left[:3]]
+        to_put.append(pool)
+    batch.pairs = [[rows[index][:3], rows[index + 1][:3]]
+                   for index in range(0, len(rows), 2)]
+    if batch.pairs:
+        batch.waiting = []
+        batch.left = left is not None
+        to_put.append(batch)
+        taskqueue.add(params={'batch': batch_key.id()},
+                      url='/tasks/match_batch', transactional=True)
+    else:
+        batch_key.delete()
+    ndb.put_multi(to_put)
+    return len(batch.pairs), left is not None
+
+
+@ndb.transactional_tasklet
+def _assign_async(user_key, game_key, opponent):
+    """Lists the new game in the user's ActiveGames and on their ticket"""
+    ticket = yield MatchTicket.key_for(user_key).get_async()
+    yield ActiveGames.update_async([user_key], add=[game_key])
+    if ticket and not ticket.game:
+        ticket.game = game_key
+        ticket.opponent = opponent
+        yield ticket.put_async()
+
+
+@ndb.transactional
+def _delete_batch(batch):
+    # a retried pairing run may have reused the id of a batch whose games
+    # were just created; its new pairs are kept
+    current = batch.key.get()
+    if current and current.pairs == batch.pairs:
+        batch.key.delete()
+
+
+def create_games(batch_id):
+    """Creates the games of a MatchBatch. Game ids are derived from the
+    first player and the time they joined, so running the task again
+    creates nothing twice"""
+    batch = MatchBatch.get_by_id(batch_id)
+    if not batch:
+        return
+    game_keys = [ndb.Key(Game, 'match-{}-{!r}'.format(player1[0],
+                                                      player1[2]))
+                 for player1, _ in batch.pairs]
+    existing = ndb.get_multi(game_keys)
+    games = []
+    for (player1, player2), key, game in zip(batch.pairs, game_keys,
+                                              existing):
+        if game:
+            continue
+        game = Game(key=key,
+                    player1=ndb.Key(urlsafe=player1[0]),
+                    player2=ndb.Key(urlsafe=player2[0]),
+                    player1_name=player1[1],
+                    player2_name=player2[1],
+                    next_turn=random.choice([player1[1], player2[1]]),
+                    game_over=False)
+        game.set_board(engine.Board())
+        games.append(game)
+    ndb.put_multi(games)
+
+    # each player's index and ticket in its own transaction, concurrently
+    updates = []
+    for (player1, player2), key in zip(batch.pairs, game_keys):
+        updates.append(_assign_async(ndb.Key(urlsafe=player1[0]), key,
+                                     player2[1]))
+        updates.append(_assign_async(ndb.Key(urlsafe=player2[0]), key,
+                                     player1[1]))
+    for update in updates:
+        update.check_success()
+    if games:
+        notifications.wait_queued(notifications.queue_turn_notifications([
+            notifications.turn_notification_task(
+                created.player_key(created.next_turn), created.key)
+            for created in games]))
+    _delete_batch(batch)
@@ -5,7 +5,15 @@ classes they can include methods (such as 'to_form' and 'new_game')."""
 from datetime import date
 from protorpc import messages
 from google.appengine.ext import ndb
-from google.appengine.api import taskqueue
+
+import ai
+import engine
+
+# user name of the built-in opponent of single player games
+BOT_NAME = 'TicTacToeBot'
+# players need this many finished games to appear on the leaderboard.
+# Rankings are re-indexed on their next update if this changes
+LEADERBOARD_MIN_GAMES = 5
 
 
 class User(ndb.Model):
@@ -14,100 +22,717 @@ class User(ndb.Model):
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
 
+    @classmethod
+    def create(cls, name, email=None):
+        """Creates a User and claims its name in the UserName index.
+        Returns None if the name is already taken"""
+        first, _ = cls.allocate_ids(1)
+        user = cls(id=first, name=name, email=email)
+        return user if UserName.claim(user) else None
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the User with the given name or None"""
+        index = UserName.get_by_name(name)
+        return index.user.get() if index else None
+
+
+class UserName(ndb.Model):
+
+    """Unique user name index. Keyed by the user name, so looking up a user
+    by name is a strongly consistent key read instead of a query"""
+    user = ndb.KeyProperty(required=True, kind='User', indexed=False)
+
+    @property
+    def name(self):
+        return self.key.id()
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def claim(user):
+        """Writes the user and its name index together. Returns False
+        without writing anything if the name is already taken"""
+        if UserName.get_by_id(user.name):
+            return False
+        ndb.put_multi([UserName(id=user.name, user=user.key), user])
+        return True
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the UserName index entity for name or None"""
+        return cls.get_by_names([name])[0]
+
+    @classmethod
+    def get_bot(cls):
+        """Returns the bot's UserName index entity. The bot user is created
+        when the first single player game is started"""
+        index = cls.get_by_name(BOT_NAME)
+        if not index:
+            # a concurrent request may claim the name first, either way
+            # the bot exists afterwards
+            User.create(BOT_NAME)
+            index = cls.get_by_name(BOT_NAME)
+        return index
+
+    @classmethod
+    def get_by_names(cls, names):
+        """Returns the UserName index entities for names in one batch,
+        with None for names that are empty or do not exist"""
+        return cls.get_by_names_async(names).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def get_by_names_async(cls, names):
+        """Tasklet version of get_by_names"""
+        keys = [ndb.Key(cls, name) for name in names if name]
+        indexes = yield ndb.get_multi_async(keys)
+        found = dict(zip(keys, indexes))
+        raise ndb.Return([found[ndb.Key(cls, name)] if name else None
+                          for name in names])
+
+
+class UserCache(object):
+
+    """Request-scoped cache of User entities. Keys are resolved in batches
+    with ndb.get_multi, so serialising a list of entities costs one datastore
+    round-trip instead of one per referenced user"""
+
+    def __init__(self):
+        self._users = {}
+
+    def prefetch(self, keys):
+        """Loads every key that is not cached yet in a single batch"""
+        missing = list(set(key for key in keys if key not in self._users))
+        if missing:
+            self._users.update(zip(missing, ndb.get_multi(missing)))
+
+    def add(self, user):
+        """Caches a User entity that has already been read"""
+        self._users[user.key] = user
+
+    def get(self, key):
+        if key not in self._users:
+            self.prefetch([key])
+        return self._users[key]
+
+    def name(self, key):
+        return self.get(key).name
+
+
+class Backfill(ndb.Model):
+
+    """Written once a one-off backfill has finished, keyed by its name, so
+    readers know when they can rely on the properties it fills in"""
+    finished = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+    # a finished backfill stays finished, so it is remembered per instance
+    _known = set()
+
+    @classmethod
+    def is_finished(cls, name):
+        if name not in cls._known and cls.get_by_id(name):
+            cls._known.add(name)
+        return name in cls._known
+
+
+class ActiveGames(ndb.Model):
+
+    """Keys of a user's games in progress, oldest first. Kept under the
+    user so listing them is one strongly consistent key read; updated in
+    the transactions that create, end and cancel games"""
+    games = ndb.KeyProperty(kind='Game', repeated=True, indexed=False)
+
+    @classmethod
+    def key_for(cls, user_key):
+        return ndb.Key(cls, 'active', parent=user_key)
+
+    @classmethod
+    def update(cls, user_keys, add=(), remove=()):
+        """Adds and removes game keys on the users' indexes. Must run in a
+        transaction that includes the users' entity groups"""
+        cls.update_async(user_keys, add, remove).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def update_async(cls, user_keys, add=(), remove=()):
+        """Tasklet version of update"""
+        keys = [cls.key_for(user_key) for user_key in user_keys]
+        indexes = yield ndb.get_multi_async(keys)
+        indexes = [index or cls(key=key) for key, index in zip(keys, indexes)]
+        for index in indexes:
+            index.games = [game for game in index.games if game not in remove]
+            index.games.extend(game for game in add
+                               if game not in index.games)
+        yield ndb.put_multi_async(indexes)
+
 
 class Game(ndb.Model):
 
     """Game object"""
     player1 = ndb.KeyProperty(required=True, kind='User')
     player2 = ndb.KeyProperty(required=True, kind='User')
+    # copies of User.name (unique and never changed) so reading a game
+    # needs no User lookups
+    player1_name = ndb.StringProperty(indexed=False)
+    player2_name = ndb.StringProperty(indexed=False)
     next_turn = ndb.StringProperty(required=True)
+    # legacy list-of-marks board, only read for games created before
+    # board_bits was introduced
     board = ndb.StringProperty(repeated=True)
+    board_bits = ndb.IntegerProperty(indexed=False, default=0)
+    size = ndb.IntegerProperty(indexed=False, default=engine.DEFAULT_SIZE)
+    win_length = ndb.IntegerProperty(indexed=False,
+                                     default=engine.DEFAULT_SIZE)
     game_over = ndb.BooleanProperty(required=True, default=False)
+    # move history packed as one byte (the cell index) per move. Players
+    # alternate, so each move's player follows from first_player and its
+    # position, and the results from the final state of the game
+    moves = ndb.BlobProperty(default='')
+    first_player = ndb.IntegerProperty(indexed=False)
+    # legacy history of {seq, player, move, result} dicts, packed into
+    # moves when the game is next written
     history = ndb.JsonProperty(repeated=True)
+    # set for single player games, player2 is then the bot
+    difficulty = ndb.StringProperty(indexed=False)
 
     @classmethod
-    def new_game(cls, player1, player2, next_turn, board):
-        """Creates and returns a new game"""
-
-        game = Game(player1=player1,
-                    player2=player2,
+    @ndb.transactional(xg=True)
+    def new_game(cls, player1, player2, next_turn, board, difficulty=None):
+        """Creates and returns a new game and adds it to the players'
+        ActiveGames. player1 and player2 are the players' UserName index
+        entities. If the bot has the first turn of a single player game its
+        move is made before the game is saved"""
+
+        game = Game(player1=player1.user,
+                    player2=player2.user,
+                    player1_name=player1.name,
+                    player2_name=player2.name,
                     next_turn=next_turn,
-                    board=board,
-                    history=[],
-                    game_over=False)
+                    game_over=False,
+                    difficulty=difficulty)
+        game.set_board(board)
+        if game.is_bot_turn():
+            game.play_bot(board)
         game.put()
+        ActiveGames.update(game.indexed_players(), add=[game.key])
         return game
 
-    def to_form(self, message):
+    def get_board(self):
+        """Returns the game board as an engine.Board"""
+        if self.board:
+            return engine.Board.from_list(self.board, self.win_length)
+        return engine.Board.decode(self.board_bits, self.size,
+                                   self.win_length)
+
+    def set_board(self, board):
+        """Stores an engine.Board, dropping any legacy list board"""
+        self.board = []
+        self.board_bits = board.encode()
+        self.size = board.size
+        self.win_length = board.win_length
+
+    def fill_names(self, users=None):
+        """Copies the player names onto a game created before they were
+        stored on it. Returns True if the game was changed"""
+        if self.player1_name and self.player2_name:
+            return False
+        users = users or UserCache()
+        users.prefetch([self.player1, self.player2])
+        self.player1_name = users.name(self.player1)
+        self.player2_name = users.name(self.player2)
+        return True
+
+    def player_name(self, player):
+        """Returns the name of the player with the given User key"""
+        if player == self.player1:
+            return self.player1_name
+        return self.player2_name
+
+    def player_key(self, name):
+        """Returns the User key of the player with the given name"""
+        if name == self.player1_name:
+            return self.player1
+        return self.player2
+
+    def _pre_put_hook(self):
+        self.pack_history()
+
+    def pack_history(self):
+        """Moves a legacy history into the packed moves. Needs the player
+        names, so games without them are left alone until they are filled
+        in"""
+        if not self.history or not self.player1_name:
+            return
+        entries = sorted(self.history, key=lambda entry: entry['seq'])
+        self.first_player = (engine.PLAYER1
+                             if entries[0]['player'] == self.player1_name
+                             else engine.PLAYER2)
+        self.moves = ''.join(chr(entry['move']) for entry in entries)
+        self.history = []
+
+    def get_moves(self):
+        """Returns the cell index of every move in order"""
+        if self.history:
+            return [entry['move'] for entry in
+                    sorted(self.history, key=lambda entry: entry['seq'])]
+        return list(bytearray(self.moves or ''))
+
+    def get_history(self):
+        """Returns the game history as (sequence, player name, move,
+        result) tuples. Results are worked out from whose turn each move
+        was and, for the last move of a finished game, the final board"""
+        if self.history:
+            return [(entry['seq'], entry['player'], entry['move'],
+                     entry['result']) for entry in
+                    sorted(self.history, key=lambda entry: entry['seq'])]
+        self.fill_names()
+        names = {engine.PLAYER1: self.player1_name,
+                 engine.PLAYER2: self.player2_name}
+        moves = self.get_moves()
+        items = []
+        player = self.first_player
+        for seq, move in enumerate(moves, 1):
+            opponent = (engine.PLAYER2 if player == engine.PLAYER1
+                        else engine.PLAYER1)
+            if seq < len(moves) or not self.game_over:
+                result = '{} turn'.format(names[opponent])
+            elif self.get_board().is_winner(player):
+                result = '{} win!'.format(names[player])
+            else:
+                result = 'Tie!'
+            items.append((seq, names[player], move, result))
+            player = opponent
+        return items
+
+    def indexed_players(self):
+        """Returns the keys of the players whose ActiveGames list the game.
+        The bot plays every single player game and keeps no list"""
+        if self.difficulty:
+            return [self.player1]
+        return [self.player1, self.player2]
+
+    def is_bot_turn(self):
+        """Returns True if the bot has the next turn"""
+        return (bool(self.difficulty) and not self.game_over and
+                self.next_turn == self.player2_name)
+
+    def play(self, board, player, move):
+        """Places the mark of player (a name) on a free cell of board,
+        ends the game on a win or a tie and records the move in the history.
+        Returns the result message"""
+        if player == self.player1_name:
+            mark, current, opponent = engine.PLAYER1, self.player1, \
+                self.player2
+        else:
+            mark, current, opponent = engine.PLAYER2, self.player2, \
+                self.player1
+        board.place(move, mark)
+        self.set_board(board)
+        if board.is_winning_move(move, mark):
+            self.end_game(current, opponent, 'win')
+            msg = '{} win!'.format(player)
+        elif board.is_full():
+            self.end_game(self.player1, self.player2, 'tie')
+            msg = 'Tie!'
+        else:
+            self.next_turn = self.player_name(opponent)
+            msg = '{} turn'.format(self.next_turn)
+
+        # Game history tracking.
+        self.pack_history()
+        if not self.moves:
+            self.first_player = mark
+        self.moves = (self.moves or '') + chr(move)
+        return msg
+
+    def play_bot(self, board):
+        """Plays the bot's move on board. Returns (move, result message)"""
+        move = ai.choose_move(board, engine.PLAYER2, self.difficulty)
+        return move, self.play(board, self.player2_name, move)
+
+    def to_form(self, message, users=None):
         """Returns a GameForm representation of the Game"""
+        self.fill_names(users)
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
         form.next_turn = self.next_turn
-        form.board = self.board
+        form.board = self.get_board().to_list()
+        form.size = self.size
+        form.win_length = self.win_length
         form.game_over = self.game_over
         form.message = message
-        form.player1 = self.player1.get().name
-        form.player2 = self.player2.get().name
+        form.player1 = self.player1_name
+        form.player2 = self.player2_name
+        form.difficulty = self.difficulty
         return form
 
     def end_game(self, winner, loser, result):
         """Ends the game -
         if result = win then winner wins and loser loses
-        if result = tie then both winner and loser tie """
+        if result = tie then both winner and loser tie
+        Runs inside the make_move transaction, which puts the game """
         self.game_over = True
-        self.put()
-
-        # logging.info(winner)  # winner is the key
+        # the players' entity groups are already part of the transaction
+        # through their scores
+        ActiveGames.update(self.indexed_players(), remove=[self.key])
 
         # Add the game to the score 'board'
         # Score record will create an ancestor to the user to ensure
         # strong consistency.
+        self.fill_names()
+        winner_name = self.player_name(winner)
+        loser_name = self.player_name(loser)
         if result == 'win':
-            score = Score(
-                user=winner, date=date.today(), result='win', parent=winner)
-            score.put()
-            score = Score(
-                user=loser, date=date.today(), result='lose', parent=loser)
-            score.put()
-
+            results = [(winner, winner_name, 'win'),
+                       (loser, loser_name, 'lose')]
         else:
-            score = Score(
-                user=winner, date=date.today(), result='tie', parent=winner)
-            score.put()
-            score = Score(
-                user=loser, date=date.today(), result='tie', parent=loser)
-            score.put()
+            results = [(winner, winner_name, 'tie'),
+                       (loser, loser_name, 'tie')]
+        if self.difficulty:
+            # the bot plays every single player game, keeping no Score or
+            # Ranking for it avoids contention on its entity group
+            results = [entry for entry in results if entry[0] != self.player2]
+        record_results(results)
+
+
+class GameArchive(Game):
+
+    """A finished Game, moved out of the Game kind so the active game
+    queries only cover games in progress. Shares the id of the Game it
+    replaces"""
+
+    @classmethod
+    def from_game(cls, game):
+        return cls(id=game.key.id(), **game.to_dict())
+
+    @classmethod
+    def key_for(cls, game_key):
+        return ndb.Key(cls, game_key.id())
+
+    @classmethod
+    def get_game(cls, game_key):
+        """Returns the Game with game_key, or its archived copy, or None.
+        Both are read in one batch"""
+        game, archived = ndb.get_multi([game_key, cls.key_for(game_key)])
+        return game or archived
+
+    def to_form(self, message, users=None):
+        form = super(GameArchive, self).to_form(message, users)
+        # players keep using the key of the game they played
+        form.urlsafe_key = ndb.Key(Game, self.key.id()).urlsafe()
+        return form
 
-        # create task queue to recalculate players ranking
-        taskqueue.add(params={'player': winner.get().name},
-                      url='/tasks/update_ranking')
-        taskqueue.add(params={'player': loser.get().name},
-                      url='/tasks/update_ranking')
+
+@ndb.transactional(xg=True)
+def record_results(results):
+    """Writes a Score for each (user key, user name, result) and updates the
+    user's Ranking counters in the same transaction"""
+    _record_results_async(results).get_result()
+
+
+@ndb.tasklet
+def _record_results_async(results):
+    # the players' rankings and today's rollups are read concurrently
+    today = date.today()
+    found = yield ([Ranking.get_or_init_async(user_key, user_name)
+                    for user_key, user_name, _ in results] +
+                   [ScoreRollup.key_for(user_key, today).get_async()
+                    for user_key, _, _ in results])
+    rankings, rollups = found[:len(results)], found[len(results):]
+    entities = []
+    for (user_key, user_name, result), ranking, rollup in zip(
+            results, rankings, rollups):
+        entities.append(Score(user=user_key, user_name=user_name,
+                              date=today, result=result,
+                              parent=user_key))
+        ranking.add_result(result)
+        rollup = rollup or ScoreRollup(
+            key=ScoreRollup.key_for(user_key, today), date=today)
+        rollup.add_result(result)
+        entities.extend([ranking, rollup])
+    yield ndb.put_multi_async(entities)
 
 
 class Score(ndb.Model):
 
     """Score object"""
     user = ndb.KeyProperty(required=True, kind='User')
+    user_name = ndb.StringProperty()
     date = ndb.DateProperty(required=True)
     result = ndb.StringProperty(required=True)
 
-    def to_form(self):
-        return ScoreForm(user=self.user.get().name,
+    def to_form(self, users=None):
+        return ScoreForm(user=self.user_name or
+                         (users or UserCache()).name(self.user),
                          result=self.result, date=str(self.date))
 
 
+class ScoreRollup(ndb.Model):
+
+    """A user's wins, losses and ties on one day, keyed by the ISO date
+    under the user. Updated in the transaction that writes the day's
+    Scores, so a user's record over a date range is a few small reads"""
+    date = ndb.DateProperty(required=True)
+    wins = ndb.IntegerProperty(indexed=False, default=0)
+    losses = ndb.IntegerProperty(indexed=False, default=0)
+    ties = ndb.IntegerProperty(indexed=False, default=0)
+
+    @classmethod
+    def key_for(cls, user_key, day):
+        return ndb.Key(cls, day.isoformat(), parent=user_key)
+
+    @classmethod
+    @ndb.transactional_tasklet
+    def rebuild_async(cls, user_key):
+        """Recounts every rollup of the user from their Score records"""
+        scores = yield Score.query(ancestor=user_key).fetch_async()
+        rollups = {}
+        for score in scores:
+            if score.date not in rollups:
+                rollups[score.date] = cls(
+                    key=cls.key_for(user_key, score.date), date=score.date)
+            rollups[score.date].add_result(score.result)
+        yield ndb.put_multi_async(rollups.values())
+
+    def add_result(self, result):
+        if result == 'win':
+            self.wins += 1
+        elif result == 'lose':
+            self.losses += 1
+        else:
+            self.ties += 1
+
+    def to_form(self):
+        return ScoreDayForm(date=str(self.date), wins=self.wins,
+                            losses=self.losses, ties=self.ties)
+
+
 class Ranking(ndb.Model):
 
-    """Ranking"""
+    """Ranking - one per user, keyed under the user so its counters can be
+    updated in the same transaction as the user's Score records"""
     user = ndb.KeyProperty(required=True, kind='User')
+    user_name = ndb.StringProperty()
     winning_percent = ndb.FloatProperty()
+    wins = ndb.IntegerProperty(indexed=False, default=0)
+    losses = ndb.IntegerProperty(indexed=False, default=0)
+    ties = ndb.IntegerProperty(indexed=False, default=0)
+    # lets the leaderboard pick up only the rankings changed since its last
+    # update
+    updated = ndb.DateTimeProperty(auto_now=True)
+    # winning percent of players with enough games to be on the leaderboard,
+    # None otherwise, so the top N is one indexed query
+    ranked_percent = ndb.ComputedProperty(
+        lambda self: self.winning_percent
+        if self.games_played >= LEADERBOARD_MIN_GAMES else None)
 
-    def to_form(self):
-        return RankForm(user=self.user.get().name,
+    @classmethod
+    def key_for(cls, user_key):
+        return ndb.Key(cls, 'ranking', parent=user_key)
+
+    @property
+    def games_played(self):
+        return self.wins + self.losses + self.ties
+
+    @classmethod
+    @ndb.tasklet
+    def get_or_init_async(cls, user_key, user_name):
+        """Returns the user's Ranking. A user without one (including users
+        ranked before the counters existed) gets a Ranking counted from
+        their Score records, which is a one-off cost per user."""
+        ranking = yield cls.key_for(user_key).get_async()
+        if not ranking:
+            ranking = cls(key=cls.key_for(user_key), user=user_key)
+            scores = yield Score.query(ancestor=user_key).fetch_async()
+            for score in scores:
+                ranking.add_result(score.result)
+        ranking.user_name = user_name
+        raise ndb.Return(ranking)
+
+    @classmethod
+    def rebuild(cls, user_key):
+        """Recounts the user's Ranking from their Score records. Users
+        without games, and keys of users that no longer exist, have no
+        Ranking; returns None for them"""
+        return cls.rebuild_async(user_key).get_result()
+
+    @classmethod
+    @ndb.transactional_tasklet
+    def rebuild_async(cls, user_key):
+        """Tasklet version of rebuild, the user and the scores are read
+        concurrently"""
+        user, scores = yield (user_key.get_async(),
+                              Score.query(ancestor=user_key).fetch_async())
+        if not user or not scores:
+            # a Ranking without games has no winning percentage to list
+            yield cls.key_for(user_key).delete_async()
+            raise ndb.Return(None)
+        ranking = cls(key=cls.key_for(user_key), user=user_key,
+                      user_name=user.name)
+        for score in scores:
+            ranking.add_result(score.result)
+        yield ranking.put_async()
+        raise ndb.Return(ranking)
+
+    def add_result(self, result):
+        """Counts one game result and recomputes the winning percentage"""
+        if result == 'win':
+            self.wins += 1
+        elif result == 'lose':
+            self.losses += 1
+        else:
+            self.ties += 1
+        # tie counts for 1/2 win and 1/2 lose
+        self.winning_percent = ((self.wins + self.ties / 2.0) /
+                                (self.wins + self.losses + self.ties))
+
+    def to_form(self, users=None):
+        return RankForm(user=self.user_name or
+                        (users or UserCache()).name(self.user),
                         winning_percent=self.winning_percent)
 
 
+class LeaderboardState(ndb.Model):
+
+    """Leaderboard bookkeeping - the number of ranked players in each
+    winning percent bucket and how far Ranking changes have been applied"""
+    as_of = ndb.DateTimeProperty(indexed=False)
+    counts = ndb.JsonProperty()
+    # lowest winning percent in the top N snapshot
+    cutoff = ndb.FloatProperty(indexed=False)
+    # set while a full rebuild is running, incremental updates wait for it
+    rebuilding = ndb.BooleanProperty(indexed=False, default=False)
+
+
+class LeaderboardShard(ndb.Model):
+
+    """One slice of the top N leaderboard snapshot, as
+    [user name, winning percent, games played] rows in rank order"""
+    entries = ndb.JsonProperty()
+
+
+class LeaderboardEntry(ndb.Model):
+
+    """The winning percent bucket a user was last counted in, or None if
+    the user was not ranked. Kept under the user and only written by the
+    leaderboard update task"""
+    bucket = ndb.IntegerProperty(indexed=False)
+
+
+class MatchTicket(ndb.Model):
+
+    """A user's place in the matchmaking queue, kept under the user. game
+    and opponent are set once the user has been paired"""
+    joined = ndb.FloatProperty(indexed=False)
+    band = ndb.IntegerProperty(indexed=False)
+    game = ndb.KeyProperty(kind='Game', indexed=False)
+    opponent = ndb.StringProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, user_key):
+        return ndb.Key(cls, 'ticket', parent=user_key)
+
+
+class MatchPool(ndb.Model):
+
+    """One shard of a rating band's waiting pool, as
+    [urlsafe user key, user name, joined] rows"""
+    waiting = ndb.JsonProperty()
+
+
+class MatchBatch(ndb.Model):
+
+    """The players taken out of a band's pool by one pairing run, keyed by
+    band and window. waiting holds the pool rows (with their shard) until
+    they are paired; pairs then holds [row, row] pairs, which a task turns
+    into games"""
+    waiting = ndb.JsonProperty()
+    pairs = ndb.JsonProperty()
+    # whether a player was left over and went back to the pool
+    left = ndb.BooleanProperty(indexed=False)
+
+
+class TransferJob(ndb.Model):
+
+    """Progress of a bulk export or import, advanced one page per task"""
+    operation = ndb.StringProperty(required=True)
+    # id of the export job an import reads from
+    source = ndb.IntegerProperty(indexed=False)
+    # position in transfer.KINDS and query cursor of the next export page
+    stage = ndb.IntegerProperty(indexed=False, default=0)
+    cursor = ndb.StringProperty(indexed=False)
+    # the next page to write or read
+    page = ndb.IntegerProperty(indexed=False, default=0)
+    # records written or read per kind, and invalid records skipped
+    counts = ndb.JsonProperty()
+    done = ndb.BooleanProperty(indexed=False, default=False)
+    started = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class TransferChunk(ndb.Model):
+
+    """One page of an export as newline-delimited JSON records, keyed by
+    page number (from 1) under its TransferJob. Read in key order the
+    chunks form the export file"""
+    data = ndb.BlobProperty(compressed=True)
+
+
+class GameStats(ndb.Model):
+
+    """The latest summary of the offline analytics (see analytics.py), a
+    single entity loaded through /admin/game_stats and served by
+    get_game_stats"""
+    summary = ndb.JsonProperty(compressed=True)
+    loaded = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    @classmethod
+    def latest(cls):
+        return cls.get_by_id('latest')
+
+    @classmethod
+    def store(cls, summary):
+        """Replaces the served summary"""
+        stats = cls(id='latest', summary=summary)
+        stats.put()
+        return stats
+
+    def to_form(self):
+        """Returns a GameStatsForm representation of the summary"""
+        variants = []
+        for name, variant in sorted(self.summary.get('variants', {}).items()):
+            openings = dict((opening['cell'], opening)
+                            for opening in variant['openings'])
+            cells = []
+            for cell, win_rate in enumerate(variant['cell_win_rates']):
+                opening = openings.get(cell, {})
+                cells.append(CellStatsForm(
+                    cell=cell, openings=opening.get('games', 0),
+                    opening_win_rate=opening.get('first_mover_win_rate'),
+                    win_rate=win_rate))
+            variants.append(VariantStatsForm(
+                variant=name,
+                size=variant['size'],
+                win_length=variant['win_length'],
+                games=variant['games'],
+                finished=variant['finished'],
+                player1_wins=variant['outcomes']['player1'],
+                player2_wins=variant['outcomes']['player2'],
+                ties=variant['outcomes']['tie'],
+                average_length=variant['average_length'],
+                first_mover_win_rate=variant['first_mover_win_rate'],
+                cells=cells))
+        players = [PlayerStatsForm(
+            user_name=player['user_name'], games=player['games'],
+            wins=player['wins'], losses=player['losses'],
+            ties=player['ties'],
+            months=[ScoreMonthForm(**month) for month in player['months']])
+            for player in self.summary.get('players', [])]
+        return GameStatsForm(loaded=str(self.loaded),
+                             games=self.summary.get('games', 0),
+                             variants=variants, players=players)
+
+
 class GameForm(messages.Message):
 
     """GameForm for outbound game state information"""
@@ -118,19 +743,28 @@ class GameForm(messages.Message):
     player1 = messages.StringField(5, required=True)
     player2 = messages.StringField(6, required=True)
     board = messages.StringField(7, repeated=True)
+    size = messages.IntegerField(8)
+    win_length = messages.IntegerField(9)
+    difficulty = messages.StringField(10)
 
 
 class GameForms(messages.Message):
 
     """Return multiple GameForms"""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class NewGameForm(messages.Message):
 
     """Used to create a new game"""
     player1 = messages.StringField(1, required=True)
-    player2 = messages.StringField(2, required=True)
+    # not needed for a single player game against the bot
+    player2 = messages.StringField(2)
+    size = messages.IntegerField(3, default=engine.DEFAULT_SIZE)
+    win_length = messages.IntegerField(4)
+    # easy, medium or hard, starts a single player game
+    difficulty = messages.StringField(5)
 
 
 class MakeMoveForm(messages.Message):
@@ -148,10 +782,21 @@ class ScoreForm(messages.Message):
     result = messages.StringField(3, required=True)
 
 
+class ScoreDayForm(messages.Message):
+
+    """ScoreDayForm for one user's results on one day"""
+    date = messages.StringField(1, required=True)
+    wins = messages.IntegerField(2, required=True)
+    losses = messages.IntegerField(3, required=True)
+    ties = messages.IntegerField(4, required=True)
+
+
 class ScoreForms(messages.Message):
 
-    """Return multiple ScoreForms"""
+    """Return multiple ScoreForms, or ScoreDayForms in summary mode"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+    days = messages.MessageField(ScoreDayForm, 3, repeated=True)
 
 
 class RankForm(messages.Message):
@@ -159,12 +804,25 @@ class RankForm(messages.Message):
     """RankForm for outbound Rank information"""
     user = messages.StringField(1, required=True)
     winning_percent = messages.FloatField(2, required=True)
+    games_played = messages.IntegerField(3)
+
+
+class UserRankForm(messages.Message):
+
+    """UserRankForm for outbound leaderboard position of one user"""
+    user = messages.StringField(1, required=True)
+    rank = messages.IntegerField(2)
+    exact = messages.BooleanField(3, required=True)
+    winning_percent = messages.FloatField(4)
+    games_played = messages.IntegerField(5, required=True)
+    message = messages.StringField(6, required=True)
 
 
 class RankForms(messages.Message):
 
     """Return multiple RankForm"""
     items = messages.MessageField(RankForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class HistoryForm(messages.Message):
@@ -182,6 +840,71 @@ class HistoryForms(messages.Message):
     items = messages.MessageField(HistoryForm, 1, repeated=True)
 
 
+class CellStatsForm(messages.Message):
+
+    """CellStatsForm for the statistics of one board cell: games opened on
+    it, how often the first mover won those, and how often the player
+    holding it won"""
+    cell = messages.IntegerField(1, required=True)
+    openings = messages.IntegerField(2, required=True)
+    opening_win_rate = messages.FloatField(3)
+    win_rate = messages.FloatField(4)
+
+
+class VariantStatsForm(messages.Message):
+
+    """VariantStatsForm for the statistics of one board variant"""
+    variant = messages.StringField(1, required=True)
+    size = messages.IntegerField(2, required=True)
+    win_length = messages.IntegerField(3, required=True)
+    games = messages.IntegerField(4, required=True)
+    finished = messages.IntegerField(5, required=True)
+    player1_wins = messages.IntegerField(6, required=True)
+    player2_wins = messages.IntegerField(7, required=True)
+    ties = messages.IntegerField(8, required=True)
+    average_length = messages.FloatField(9)
+    first_mover_win_rate = messages.FloatField(10)
+    cells = messages.MessageField(CellStatsForm, 11, repeated=True)
+
+
+class ScoreMonthForm(messages.Message):
+
+    """ScoreMonthForm for one player's results in one month"""
+    month = messages.StringField(1, required=True)
+    wins = messages.IntegerField(2, required=True)
+    losses = messages.IntegerField(3, required=True)
+    ties = messages.IntegerField(4, required=True)
+
+
+class PlayerStatsForm(messages.Message):
+
+    """PlayerStatsForm for one player's results and monthly trend"""
+    user_name = messages.StringField(1, required=True)
+    games = messages.IntegerField(2, required=True)
+    wins = messages.IntegerField(3, required=True)
+    losses = messages.IntegerField(4, required=True)
+    ties = messages.IntegerField(5, required=True)
+    months = messages.MessageField(ScoreMonthForm, 6, repeated=True)
+
+
+class GameStatsForm(messages.Message):
+
+    """GameStatsForm for outbound offline game statistics"""
+    loaded = messages.StringField(1, required=True)
+    games = messages.IntegerField(2, required=True)
+    variants = messages.MessageField(VariantStatsForm, 3, repeated=True)
+    players = messages.MessageField(PlayerStatsForm, 4, repeated=True)
+
+
+class MatchForm(messages.Message):
+
+    """MatchForm for outbound matchmaking state of one user"""
+    status = messages.StringField(1, required=True)
+    urlsafe_game_key = messages.StringField(2)
+    opponent = messages.StringField(3)
+    message = messages.StringField(4, required=True)
+
+
 class StringMessage(messages.Message):
 
     """StringMessage-- outbound (single) string message"""
@@ -0,0 +1,49 @@
+"""notifications.py - Turn notifications sent to a player when the opponent
+has moved. Notifications are named tasks, one per (user, game) and time
+window, so a fast game produces at most one email per window instead of one
+per move."""
+
+import time
+
+from google.appengine.api import taskqueue
+
+# turn notifications for the same user and game are coalesced within this
+# many seconds; the email is sent when the window closes
+NOTIFY_WINDOW_SECONDS = 60
+
+
+def turn_notification_task(user_key, game_key, now=None):
+    """Returns the named task that notifies user_key of its turn in
+    game_key. Tasks for the same user, game and window share a name"""
+    now = now or time.time()
+    window = int(now // NOTIFY_WINDOW_SECONDS)
+    countdown = (window + 1) * NOTIFY_WINDOW_SECONDS - now
+    return taskqueue.Task(
+        name='turn-{}-{}-{}'.format(game_key.urlsafe(), user_key.urlsafe(),
+                                    window),
+        params={'user_id': user_key.urlsafe(),
+                'game_id': game_key.urlsafe()},
+        url='/tasks/send_reminder',
+        countdown=countdown)
+
+
+# the errors of a task add whose name is taken, which means the notification
+# was coalesced with an earlier one
+COALESCED_ERRORS = (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.DuplicateTaskNameError,
+                    taskqueue.TombstonedTaskError)
+
+
+def queue_turn_notifications(tasks):
+    """Starts adding turn notification tasks. Returns the RPC, which the
+    caller passes to wait_queued before its request ends"""
+    return taskqueue.Queue().add_async(tasks)
+
+
+def wait_queued(rpc):
+    """Waits for the tasks of queue_turn_notifications to be added. Tasks
+    that were coalesced are not an error"""
+    try:
+        rpc.get_result()
+    except COALESCED_ERRORS:
+        pass
@@ -0,0 +1,103 @@
+"""reminders.py - Reminder emails for players whose turn it is.
+The daily reminder walks the active games a page per task and sends each
+player one digest listing their games; turn notifications (see
+notifications.py) end in a single reminder for one game. Only the datastore,
+task queue and mail APIs are used, so the task handlers load quickly."""
+
+import json
+
+from google.appengine.api import mail, app_identity, taskqueue
+from google.appengine.ext import ndb
+
+from models import UserName, Game
+
+# number of active games read by each reminder digest task
+REMINDER_PAGE_SIZE = 200
+# games listed in one reminder digest
+MAX_DIGEST_GAMES = 20
+SUBJECT = 'This is a reminder!'
+
+
+def start_digests():
+    """Queues the first page of the daily reminder digests"""
+    taskqueue.add(url='/tasks/reminder_digests')
+
+
+def group_games(games, carry=None):
+    """Groups a page of games, in next_turn order, into (player name, game
+    ids) digests. carry is the last digest of the previous page"""
+    groups = [carry] if carry else []
+    for game in games:
+        if groups and groups[-1][0] == game.next_turn:
+            if len(groups[-1][1]) < MAX_DIGEST_GAMES:
+                groups[-1][1].append(game.key.urlsafe())
+        else:
+            groups.append((game.next_turn, [game.key.urlsafe()]))
+    return groups
+
+
+def digest_page(cursor=None, carry=None):
+    """Builds the reminder digests for one page of active games.
+    Games are walked in next_turn order so all of a user's games are next
+    to each other; a user whose games run past the end of the page is
+    carried over to the next task. The mails and the next page are
+    enqueued together"""
+    games, next_cursor, more = Game.query(
+        Game.game_over == False).order(Game.next_turn).fetch_page(
+        REMINDER_PAGE_SIZE, start_cursor=cursor,
+        projection=[Game.next_turn])
+    groups = group_games(games, carry)
+
+    tasks = []
+    if more and next_cursor:
+        carry = groups.pop() if groups else None
+        params = {'cursor': next_cursor.urlsafe()}
+        if carry:
+            params.update(carry_name=carry[0],
+                          carry_games=','.join(carry[1]))
+        tasks.append(taskqueue.Task(params=params,
+                                    url='/tasks/reminder_digests'))
+
+    # resolve every user on the page in two batched reads
+    indexes = UserName.get_by_names([name for name, _ in groups])
+    users = ndb.get_multi([index.user for index in indexes if index])
+    emails = dict((user.name, user.email) for user in users
+                  if user and user.email)
+    digests = [{'name': name, 'email': emails[name], 'games': game_ids}
+               for name, game_ids in groups if name in emails]
+    if digests:
+        tasks.append(taskqueue.Task(
+            payload=json.dumps(digests), url='/tasks/send_digests'))
+
+    if tasks:
+        taskqueue.Queue().add(tasks)
+
+
+def _send(email, body):
+    # This will send test emails, the arguments to send_mail are:
+    # from, to, subject, body
+    mail.send_mail('noreply@{}.appspotmail.com'.format(
+        app_identity.get_application_id()), email, SUBJECT, body)
+
+
+def send_digests(digests):
+    """Sends one batch of reminder digests built by digest_page"""
+    for digest in digests:
+        _send(digest['email'], (
+            'Hello {}, it is your turn.  Please complete your '
+            'Tic Tac Toe games with gameid = {} !'.format(
+                digest['name'], ', '.join(digest['games']))))
+
+
+def send_turn_reminder(user_id, game_id):
+    """Sends the turn reminder of one game, given the urlsafe user and game
+    keys. Nothing is sent if the turn has already been played or the game
+    is over"""
+    user, game = ndb.get_multi([ndb.Key(urlsafe=user_id),
+                                ndb.Key(urlsafe=game_id)])
+    if not (user and user.email and game) or game.game_over or \
+            game.next_turn != user.name:
+        return
+    _send(user.email, (
+        'Hello {}, it is your turn.  Please complete your '
+        'Tic Tac Toe with gameid = {} !'.format(user.name, game_id)))
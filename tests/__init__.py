@@ -0,0 +1,17 @@
+"""Tests run on the App Engine testbed stubs. Needs the App Engine SDK; if
+it is not importable, set APPENGINE_SDK to the SDK directory.
+Run from the project root with: python -m unittest discover -s tests -t ."""
+
+import os
+import sys
+
+
+def _fix_sys_path():
+    sdk = os.environ.get('APPENGINE_SDK')
+    if sdk and sdk not in sys.path:
+        sys.path.insert(0, sdk)
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+
+
+_fix_sys_path()
@@ -0,0 +1,91 @@
+"""test_active_games.py - Listing a user's games in progress from their
+ActiveGames index, on the datastore stub."""
+
+import os
+import unittest
+
+import endpoints
+from google.appengine.ext import ndb, testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ActiveGamesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        # endpoints reads the app revision from the version id on import
+        self.testbed.setup_env(current_version_id='v1.1')
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        ndb.get_context().set_cache_policy(False)
+        import api
+        self.api = api
+        for name in ('a', 'b'):
+            self.call('create_user', api.USER_REQUEST, user_name=name,
+                      email='{}@example.com'.format(name))
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def call(self, name, container, **fields):
+        return getattr(self.api.TicTacToeApi(), name)(
+            container.combined_message_class(**fields))
+
+    def new_game(self, **fields):
+        return self.call('new_game', self.api.NEW_GAME_REQUEST, player1='a',
+                         **fields).urlsafe_key
+
+    def listed(self, user_name, limit=None):
+        """Returns the game keys of every page, and the number of pages"""
+        keys, cursor, pages = [], None, 0
+        while True:
+            page = self.call('get_user_games', self.api.USER_PAGE_REQUEST,
+                             user_name=user_name, limit=limit, cursor=cursor)
+            keys.extend(game.urlsafe_key for game in page.items)
+            pages += 1
+            cursor = page.next_cursor
+            if not cursor:
+                return keys, pages
+
+    def test_pages_in_creation_order(self):
+        created = [self.new_game(player2='b') for _ in range(5)]
+        self.assertEqual(self.listed('a', limit=2), (created, 3))
+        self.assertEqual(self.listed('b'), (created, 1))
+
+    def test_ended_and_cancelled_games_leave_the_list(self):
+        created = [self.new_game(player2='b') for _ in range(3)]
+        self.call('cancel_game', self.api.GET_GAME_REQUEST,
+                  urlsafe_game_key=created[0])
+        game = self.call('get_game', self.api.GET_GAME_REQUEST,
+                         urlsafe_game_key=created[1])
+        for move in (0, 3, 1, 4, 2):
+            game = self.call('make_move', self.api.MAKE_MOVE_REQUEST,
+                             urlsafe_game_key=created[1],
+                             player=game.next_turn, move=move)
+        self.assertTrue(game.game_over)
+        self.assertEqual(self.listed('a'), ([created[2]], 1))
+        self.assertEqual(self.listed('b'), ([created[2]], 1))
+
+    def test_bot_keeps_no_list(self):
+        from models import ActiveGames, UserName
+        created = self.new_game(difficulty='easy')
+        self.assertEqual(self.listed('a'), ([created], 1))
+        bot = UserName.get_bot()
+        self.assertIsNone(ActiveGames.key_for(bot.user).get())
+
+    def test_invalid_cursor(self):
+        for cursor in ('x', '-1'):
+            with self.assertRaises(endpoints.BadRequestException):
+                self.call('get_user_games', self.api.USER_PAGE_REQUEST,
+                          user_name='a', cursor=cursor)
+
+    def test_unknown_user(self):
+        with self.assertRaises(endpoints.NotFoundException):
+            self.listed('nobody')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""test_ai.py - The computer opponent: the hard bot never loses the solved
+3 x 3 game and takes or blocks wins on the searched boards."""
+
+import random
+import unittest
+
+import ai
+import engine
+
+
+def other(player):
+    return engine.PLAYER2 if player == engine.PLAYER1 else engine.PLAYER1
+
+
+def copy(board):
+    return engine.Board(board.size, board.win_length, board.bits1,
+                        board.bits2)
+
+
+class HardBotTestCase(unittest.TestCase):
+
+    def losses(self, board, to_move, bot):
+        """Plays every opponent move against every best reply of the bot.
+        Returns the number of lines the bot loses"""
+        if to_move == bot:
+            replies = ai.best_moves(board, bot)
+        else:
+            replies = board.free_cells()
+        lost = 0
+        for cell in replies:
+            after = copy(board)
+            after.place(cell, to_move)
+            if after.is_winning_move(cell, to_move):
+                lost += to_move != bot
+            elif not after.is_full():
+                lost += self.losses(after, other(to_move), bot)
+        return lost
+
+    def test_never_loses_3x3(self):
+        for bot in (engine.PLAYER1, engine.PLAYER2):
+            self.assertEqual(self.losses(engine.Board(), engine.PLAYER1,
+                                         bot), 0)
+
+    def test_first_move_is_a_best_move(self):
+        board = engine.Board()
+        moves = ai.best_moves(board, engine.PLAYER1)
+        # every opening of 3 x 3 draws with best play
+        self.assertEqual(sorted(moves), list(range(9)))
+
+    def test_takes_a_win_and_blocks_one(self):
+        for size in (4, 5):
+            board = engine.Board(size, size)
+            for cell in range(size - 1):
+                board.place(cell, engine.PLAYER1)
+            # player 1 takes the last cell of the top row
+            self.assertEqual(ai.best_moves(board, engine.PLAYER1),
+                             [size - 1])
+            # player 2 blocks it
+            self.assertEqual(ai.best_moves(board, engine.PLAYER2),
+                             [size - 1])
+
+    def test_canonical_is_shared_by_symmetries(self):
+        board = engine.Board(4, 4)
+        board.place(1, engine.PLAYER1)
+        board.place(6, engine.PLAYER2)
+        key = ai.canonical(board.bits1, board.bits2, 4)[0]
+        for perm in ai._permutations(4):
+            mirrored = engine.Board(4, 4)
+            mirrored.place(perm[1], engine.PLAYER1)
+            mirrored.place(perm[6], engine.PLAYER2)
+            self.assertEqual(
+                ai.canonical(mirrored.bits1, mirrored.bits2, 4)[0], key)
+
+    def test_easy_bot_plays_free_cells(self):
+        rand = random.Random(3)
+        board = engine.Board()
+        for cell in (0, 4, 8):
+            board.place(cell, engine.PLAYER1)
+        for _ in range(20):
+            self.assertIn(ai.choose_move(board, engine.PLAYER2, ai.EASY,
+                                         rand), board.free_cells())
+
+
+if __name__ == '__main__':
+    unittest.main()
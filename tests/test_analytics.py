@@ -0,0 +1,124 @@
+"""test_analytics.py - The NumPy statistics of analytics.py, checked
+against plain counts of random games and against chunking."""
+
+import random
+import unittest
+
+import engine
+
+try:
+    import analytics
+except ImportError:
+    # the application never needs NumPy, so neither do its tests
+    analytics = None
+
+
+def play(size, win_length, rng, finish=True):
+    """Returns (moves, winner or None, game over) of a random game"""
+    board = engine.Board(size, win_length)
+    cells = list(range(size * size))
+    rng.shuffle(cells)
+    if not finish:
+        cells = cells[:rng.randint(1, len(cells) - 1)]
+    moves, player = [], engine.PLAYER1
+    for cell in cells:
+        board.place(cell, player)
+        moves.append(cell)
+        if board.is_winning_move(cell, player):
+            return moves, player, True
+        player = 3 - player
+    return moves, None, len(moves) == size * size
+
+
+def game_record(size, win_length, moves, first, game_over):
+    return {'kind': 'Game', 'size': size, 'win_length': win_length,
+            'moves': moves, 'first_player': first, 'game_over': game_over,
+            'player1_name': 'a', 'player2_name': 'b'}
+
+
+@unittest.skipIf(analytics is None, 'needs NumPy')
+class AnalyticsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(7)
+
+    def test_outcomes_and_openings_match_plain_counts(self):
+        for size, win_length in ((3, 3), (4, 3), (5, 4)):
+            records = []
+            outcomes = {'player1': 0, 'player2': 0, 'tie': 0,
+                        'unfinished': 0}
+            openings, first_wins = {}, {}
+            for number in range(300):
+                moves, winner, game_over = play(
+                    size, win_length, self.rng, finish=number % 5 != 0)
+                # player2 moves first in half the games, so every
+                # player number is swapped
+                first = engine.PLAYER1 if number % 2 else engine.PLAYER2
+                if winner and first == engine.PLAYER2:
+                    winner = 3 - winner
+                records.append(game_record(size, win_length, moves, first,
+                                           game_over))
+                outcome = ('player{}'.format(winner) if winner else
+                           'tie' if game_over else 'unfinished')
+                outcomes[outcome] += 1
+                openings[moves[0]] = openings.get(moves[0], 0) + 1
+                if winner == first:
+                    first_wins[moves[0]] = first_wins.get(moves[0], 0) + 1
+
+            stats = analytics.analyze(records, chunk_size=64)['variants'][
+                '{0}x{0}/{1}'.format(size, win_length)]
+            self.assertEqual(stats['games'], 300)
+            self.assertEqual(stats['outcomes'], outcomes)
+            self.assertEqual(
+                dict((row['cell'], row['games'])
+                     for row in stats['openings']), openings)
+            self.assertEqual(
+                dict((row['cell'], row['first_mover_wins'])
+                     for row in stats['openings']
+                     if row['first_mover_wins']), first_wins)
+
+    def test_chunk_size_does_not_change_the_summary(self):
+        records = []
+        for number in range(200):
+            size = 3 + number % 3
+            moves, _, game_over = play(size, 3, self.rng,
+                                       finish=number % 4 != 0)
+            records.append(game_record(size, 3, moves, engine.PLAYER1,
+                                       game_over))
+            records.append({'kind': 'Score', 'user_name': 'p{}'.format(
+                number % 7), 'date': '2016-0{}-15'.format(number % 3 + 1),
+                'result': analytics.RESULTS[number % 3]})
+        self.assertEqual(analytics.analyze(records, chunk_size=9),
+                         analytics.analyze(records))
+
+    def test_legacy_history_and_empty_games(self):
+        history = [{'seq': seq, 'move': move,
+                    'player': 'b' if seq % 2 else 'a'}
+                   for seq, move in enumerate([4, 0, 2, 6, 3, 5, 1, 7, 8])]
+        records = [
+            dict(game_record(3, 3, None, None, True), history=history[::-1]),
+            game_record(3, 3, [], None, False)]
+        summary = analytics.analyze(records)
+        stats = summary['variants']['3x3/3']
+        self.assertEqual(stats['games'], 2)
+        self.assertEqual(stats['no_history'], 1)
+        self.assertEqual(stats['outcomes']['tie'], 1)
+        self.assertEqual(stats['openings'][0]['cell'], 4)
+
+    def test_player_months(self):
+        records = [{'kind': 'Score', 'user_name': name, 'date': date,
+                    'result': result}
+                   for name, date, result in (
+                       ('a', '2016-01-31', 'win'), ('a', '2016-02-01', 'win'),
+                       ('a', '2016-02-09', 'tie'), ('b', '2016-02-01', 'lose'))]
+        players = analytics.analyze(records, chunk_size=2)['players']
+        self.assertEqual([player['user_name'] for player in players],
+                         ['a', 'b'])
+        self.assertEqual(players[0]['win_rate'], 2.0 / 3)
+        self.assertEqual(players[0]['months'], [
+            {'month': '2016-01', 'wins': 1, 'losses': 0, 'ties': 0},
+            {'month': '2016-02', 'wins': 1, 'losses': 0, 'ties': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""test_archive.py - Archiving finished games and the backfill paging on
+the datastore stub."""
+
+import unittest
+
+from google.appengine.ext import ndb, testbed
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def game(self, game_over=True):
+        from models import Game
+        return Game(player1=ndb.Key('User', 1), player2=ndb.Key('User', 2),
+                    next_turn='a', board=[' '] * 9, game_over=game_over)
+
+    def test_backfill_pages_with_cursor(self):
+        import archive
+        from models import Game, GameArchive
+        ndb.put_multi([self.game() for _ in range(5)] + [self.game(False)])
+        archive.BACKFILL_PAGE_SIZE = 2
+        try:
+            cursor, pages = None, 0
+            while True:
+                cursor = archive.backfill_page(cursor)
+                pages += 1
+                if not cursor:
+                    break
+        finally:
+            archive.BACKFILL_PAGE_SIZE = 100
+        self.assertEqual(pages, 3)
+        self.assertEqual(GameArchive.query().count(), 5)
+        self.assertEqual([game.game_over for game in Game.query()], [False])
+
+    def test_archive_is_idempotent(self):
+        import archive
+        from models import GameArchive
+        game_key = self.game().put()
+        archived = GameArchive.from_game(game_key.get())
+        archived.next_turn = 'kept'
+        archived.put()
+        # a retry after the archive copy was written but not the delete
+        archive.archive_async(game_key).check_success()
+        self.assertIsNone(game_key.get())
+        self.assertEqual(GameArchive.key_for(game_key).get().next_turn,
+                         'kept')
+
+    def test_games_in_progress_are_left_alone(self):
+        import archive
+        from models import GameArchive
+        game_key = self.game(False).put()
+        archive.archive_async(game_key).check_success()
+        self.assertIsNotNone(game_key.get())
+        self.assertIsNone(GameArchive.key_for(game_key).get())
+
+
+if __name__ == '__main__':
+    unittest.main()
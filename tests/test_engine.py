@@ -0,0 +1,99 @@
+"""test_engine.py - Win detection and encoding of the bitboard engine,
+checked against a plain scan of the board on every supported variant."""
+
+import random
+import unittest
+
+import engine
+
+VARIANTS = [(size, win_length)
+            for size in range(engine.MIN_SIZE, engine.MAX_SIZE + 1)
+            for win_length in range(engine.MIN_SIZE, size + 1)]
+
+
+def scan_winner(marks, size, win_length, mark):
+    """Returns True if mark has win_length in a row, by walking the grid"""
+    for row in range(size):
+        for col in range(size):
+            for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                cells = [(row + d_row * step, col + d_col * step)
+                         for step in range(win_length)]
+                if all(0 <= r < size and 0 <= c < size and
+                       marks[r * size + c] == mark for r, c in cells):
+                    return True
+    return False
+
+
+def random_game(size, win_length, rng):
+    """Plays random moves until a win or a full board. Yields the board,
+    the cell and the player after every move"""
+    board = engine.Board(size, win_length)
+    cells = list(range(size * size))
+    rng.shuffle(cells)
+    player = engine.PLAYER1
+    for cell in cells:
+        board.place(cell, player)
+        yield board, cell, player
+        if board.is_winning_move(cell, player):
+            return
+        player = engine.PLAYER2 if player == engine.PLAYER1 \
+            else engine.PLAYER1
+
+
+class BoardTestCase(unittest.TestCase):
+
+    def test_rows_columns_and_diagonals_win(self):
+        for size, win_length in VARIANTS:
+            lines, _, _ = engine.tables(size, win_length)
+            for mask in lines:
+                board = engine.Board(size, win_length, bits1=mask)
+                self.assertTrue(board.is_winner(engine.PLAYER1))
+                self.assertFalse(board.is_winner(engine.PLAYER2))
+                cell = mask.bit_length() - 1
+                self.assertTrue(board.is_winning_move(cell, engine.PLAYER1))
+
+    def test_line_counts(self):
+        # rows, columns and both diagonal directions
+        expected = {(3, 3): 8, (4, 3): 24, (4, 4): 10, (5, 3): 48,
+                    (5, 4): 28, (5, 5): 12}
+        for variant, count in expected.items():
+            self.assertEqual(len(engine.tables(*variant)[0]), count)
+
+    def test_random_games_match_a_scan(self):
+        rng = random.Random(1)
+        for size, win_length in VARIANTS:
+            for _ in range(50):
+                for board, cell, player in random_game(size, win_length,
+                                                       rng):
+                    marks = board.to_list()
+                    mark = engine.MARKS[player]
+                    won = scan_winner(marks, size, win_length, mark)
+                    self.assertEqual(board.is_winning_move(cell, player), won)
+                    self.assertEqual(board.is_winner(player), won)
+
+    def test_full_board_without_a_line(self):
+        board = engine.Board.from_list(['O', 'X', 'O',
+                                        'O', 'X', 'X',
+                                        'X', 'O', 'O'])
+        self.assertTrue(board.is_full())
+        self.assertFalse(board.is_winner(engine.PLAYER1))
+        self.assertFalse(board.is_winner(engine.PLAYER2))
+
+    def test_encode_round_trip(self):
+        rng = random.Random(2)
+        for size, win_length in VARIANTS:
+            for board, _, _ in random_game(size, win_length, rng):
+                copy = engine.Board.decode(board.encode(), size, win_length)
+                self.assertEqual(copy.to_list(), board.to_list())
+            self.assertLess(board.encode(), 1 << 63)
+
+    def test_validate(self):
+        for size, win_length in VARIANTS:
+            engine.validate(size, win_length)
+        for size, win_length in ((2, 2), (6, 3), (4, 5), (4, 2)):
+            with self.assertRaises(ValueError):
+                engine.validate(size, win_length)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""test_game_cache.py - The game state cache on the memcache stub, directly
+and through get_game, make_move and cancel_game."""
+
+import json
+import unittest
+
+import endpoints
+import webapp2
+from google.appengine.api import memcache
+from google.appengine.ext import ndb, testbed
+
+
+class GameCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        # endpoints reads the app revision from the version id on import
+        self.testbed.setup_env(current_version_id='v1.1')
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().set_cache_policy(False)
+        import game_cache
+        self.game_cache = game_cache
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def form(self, moves=0, key='game'):
+        from models import GameForm
+        board = ['O'] * moves + [' '] * (9 - moves)
+        return GameForm(urlsafe_key=key, next_turn='a', game_over=False,
+                        message='', player1='a', player2='b', board=board)
+
+    def test_miss_then_hit(self):
+        cache = self.game_cache
+        self.assertIsNone(cache.get_form('game', 'hello'))
+        cache.set_form(self.form(2)).get_result()
+        form = cache.get_form('game', 'hello')
+        self.assertEqual(form.message, 'hello')
+        self.assertEqual(cache.moves_played(form), 2)
+        self.assertEqual(cache.stats(), (1, 1))
+
+    def test_add_keeps_newer_state(self):
+        cache = self.game_cache
+        cache.set_form(self.form(3)).get_result()
+        # a miss that read the game before the move committed
+        cache.add_form(self.form(2))
+        self.assertEqual(cache.moves_played(cache.get_form('game', '')), 3)
+
+    def test_add_after_invalidate_is_refused(self):
+        cache = self.game_cache
+        cache.set_form(self.form(1)).get_result()
+        cache.invalidate('game')
+        cache.add_form(self.form(1))
+        self.assertIsNone(cache.get_form('game', ''))
+
+    def test_seed_keeps_newer_version(self):
+        cache = self.game_cache
+        cache.set_version(self.form(4)).get_result()
+        cache.seed_version(self.form(3))
+        self.assertEqual(cache.get_version('game'), 4)
+        memcache.flush_all()
+        cache.seed_version(self.form(3))
+        self.assertEqual(cache.get_version('game'), 3)
+
+    def test_wait_for_version(self):
+        cache = self.game_cache
+        self.assertIsNone(cache.wait_for_version('game', 0, 0))
+        cache.set_version(self.form(1)).get_result()
+        self.assertEqual(cache.wait_for_version('game', 0, 5), 1)
+        self.assertEqual(cache.wait_for_version('game', 1, 0), 1)
+
+    def test_api_reads_through_and_writes_through(self):
+        import api
+        service = api.TicTacToeApi()
+
+        def call(name, container, **fields):
+            return getattr(service, name)(
+                container.combined_message_class(**fields))
+
+        for name in ('a', 'b'):
+            call('create_user', api.USER_REQUEST, user_name=name,
+                 email='{}@example.com'.format(name))
+        game = call('new_game', api.NEW_GAME_REQUEST, player1='a',
+                    player2='b')
+        key = game.urlsafe_key
+        polled = call('get_game', api.GET_GAME_REQUEST, urlsafe_game_key=key)
+        self.assertEqual(polled.board, game.board)
+        self.assertEqual(self.game_cache.stats(), (1, 0))
+
+        moved = call('make_move', api.MAKE_MOVE_REQUEST,
+                     urlsafe_game_key=key, player=game.next_turn, move=4)
+        polled = call('get_game', api.GET_GAME_REQUEST, urlsafe_game_key=key)
+        self.assertEqual(polled.board, moved.board)
+        self.assertEqual(self.game_cache.stats(), (2, 0))
+
+        call('cancel_game', api.GET_GAME_REQUEST, urlsafe_game_key=key)
+        with self.assertRaises(endpoints.NotFoundException):
+            call('get_game', api.GET_GAME_REQUEST, urlsafe_game_key=key)
+
+    def test_stats_are_served_to_admins(self):
+        import main
+        self.game_cache.get_form('game', '')
+        response = webapp2.Request.blank('/admin/cache_stats').get_response(
+            main.app)
+        self.assertEqual(json.loads(response.body),
+                         {'hits': 0, 'misses': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""test_history.py - Packed move history and the migration of the legacy
+per-move history records, on the datastore stub."""
+
+import unittest
+
+from google.appengine.ext import ndb, testbed
+
+import engine
+
+
+class HistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+        from models import User
+        self.a, self.b = User.create('a'), User.create('b')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def legacy_game(self, names=True):
+        """A game won by a on the top row, written before history was
+        packed"""
+        from models import Game
+        game = Game(player1=self.a.key, player2=self.b.key, next_turn='a',
+                    game_over=True)
+        if names:
+            game.populate(player1_name='a', player2_name='b')
+        board = engine.Board()
+        history = []
+        for seq, (name, move) in enumerate(
+                [('a', 0), ('b', 3), ('a', 1), ('b', 4), ('a', 2)], 1):
+            board.place(move, engine.PLAYER1 if name == 'a'
+                        else engine.PLAYER2)
+            result = 'a win!' if seq == 5 else '{} turn'.format(
+                'b' if name == 'a' else 'a')
+            history.append({'seq': seq, 'player': name, 'move': move,
+                            'result': result})
+        game.set_board(board)
+        # stored out of order, as JsonProperty lists were appended to
+        game.history = list(reversed(history))
+        return game
+
+    def test_put_packs_legacy_history(self):
+        game = self.legacy_game()
+        expected = game.get_history()
+        key = game.put()
+        stored = key.get()
+        self.assertEqual(stored.history, [])
+        self.assertEqual(stored.get_moves(), [0, 3, 1, 4, 2])
+        self.assertEqual(stored.first_player, engine.PLAYER1)
+        self.assertEqual(stored.get_history(), expected)
+        self.assertEqual(expected[-1], (5, 'a', 2, 'a win!'))
+
+    def test_games_without_names_are_packed_later(self):
+        game = self.legacy_game(names=False)
+        key = game.put()
+        stored = key.get()
+        self.assertEqual(len(stored.history), 5)
+        self.assertEqual(stored.get_moves(), [0, 3, 1, 4, 2])
+        stored.fill_names()
+        stored.put()
+        self.assertEqual(key.get().history, [])
+        self.assertEqual(key.get().get_history()[0], (1, 'a', 0, 'b turn'))
+
+    def test_play_appends_one_byte_per_move(self):
+        from models import Game
+        game = Game(player1=self.a.key, player2=self.b.key,
+                    player1_name='a', player2_name='b', next_turn='b')
+        board = engine.Board()
+        game.set_board(board)
+        for move in (4, 0, 8, 2, 6, 1):
+            game.play(board, game.next_turn, move)
+        self.assertEqual(game.moves, '\x04\x00\x08\x02\x06\x01')
+        self.assertEqual(game.first_player, engine.PLAYER2)
+        self.assertTrue(game.game_over)
+        self.assertEqual(game.get_history()[-1], (6, 'a', 1, 'a win!'))
+        self.assertEqual(game.get_history()[0], (1, 'b', 4, 'a turn'))
+
+    def test_tie_result(self):
+        from models import Game
+        game = Game(player1=self.a.key, player2=self.b.key,
+                    player1_name='a', player2_name='b', next_turn='a')
+        board = engine.Board()
+        game.set_board(board)
+        for move in (0, 1, 2, 4, 3, 5, 7, 6, 8):
+            game.play(board, game.next_turn, move)
+        self.assertEqual(game.get_history()[-1], (9, 'a', 8, 'Tie!'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""test_instrumentation.py - Request RPC counts and the per-endpoint
+aggregates on the memcache stub."""
+
+import unittest
+
+import webapp2
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+
+class Counted(webapp2.RequestHandler):
+
+    def get(self):
+        memcache.get('key')
+        self.response.write('ok')
+
+
+class AggregatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_requests_are_aggregated(self):
+        import instrumentation
+        app = instrumentation.wrap(webapp2.WSGIApplication([
+            ('/counted', Counted)]))
+        for _ in range(2):
+            # through the middleware, app.get_response would bypass it
+            response = webapp2.Request.blank('/counted').get_response(app)
+            self.assertEqual(response.status_int, 200)
+        totals = instrumentation.aggregates()['/counted']
+        self.assertEqual(totals['count'], 2)
+        self.assertEqual(totals['errors'], 0)
+        self.assertEqual(totals['rpcs']['memcache']['per_request'], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""test_leaderboard.py - Leaderboard update requests on the task queue
+stub and incremental updates of the top N snapshot."""
+
+import os
+import time
+import unittest
+
+from google.appengine.ext import ndb, testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class QueueUpdateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_one_update_per_window(self):
+        import leaderboard
+        for _ in range(2):
+            leaderboard.wait_queued(leaderboard.queue_update())
+        self.assertEqual(len(self.taskqueue.get_filtered_tasks(
+            url='/tasks/leaderboard_update')), 1)
+
+
+class ApplyChangesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        ndb.get_context().set_cache_policy(False)
+        import leaderboard
+        self.leaderboard = leaderboard
+        self.saved = leaderboard.TOP_N, leaderboard.SETTLE_SECONDS
+        leaderboard.TOP_N, leaderboard.SETTLE_SECONDS = 3, 0
+
+    def tearDown(self):
+        self.leaderboard.TOP_N, self.leaderboard.SETTLE_SECONDS = self.saved
+        self.testbed.deactivate()
+
+    def rank(self, name, wins, losses):
+        from models import Ranking
+        user_key = ndb.Key('User', name)
+        ranking = Ranking(key=Ranking.key_for(user_key), user=user_key,
+                          user_name=name, wins=wins, losses=losses)
+        ranking.winning_percent = float(wins) / (wins + losses)
+        ranking.put()
+
+    def names(self):
+        return [row[0] for row in self.leaderboard.get_top()]
+
+    def test_member_falling_below_the_cutoff_is_replaced(self):
+        board = self.leaderboard
+        for name, wins in (('a', 9), ('b', 8), ('c', 7), ('y', 5)):
+            self.rank(name, wins, 10 - wins)
+        board.rebuild_page(None, [0] * board.BUCKETS, time.time())
+        self.assertEqual(self.names(), ['a', 'b', 'c'])
+
+        self.rank('a', 3, 7)
+        board.apply_changes()
+        self.assertEqual(self.names(), ['b', 'c', 'y'])
+
+    def test_new_player_above_the_cutoff_enters(self):
+        board = self.leaderboard
+        for name, wins in (('a', 9), ('b', 8), ('c', 7)):
+            self.rank(name, wins, 10 - wins)
+        board.rebuild_page(None, [0] * board.BUCKETS, time.time())
+
+        self.rank('z', 10, 0)
+        board.apply_changes()
+        self.assertEqual(self.names(), ['z', 'a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
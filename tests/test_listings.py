@@ -0,0 +1,68 @@
+"""test_listings.py - Score and Ranking listings before and after the
+player name backfill, on the datastore stub."""
+
+import datetime
+import os
+import unittest
+
+import webapp2
+from google.appengine.ext import ndb, testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class NamedListingsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        # endpoints reads the app revision from the version id on import
+        self.testbed.setup_env(current_version_id='v1.1')
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        ndb.get_context().set_cache_policy(False)
+        from models import Backfill
+        Backfill._known.clear()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def call(self, name, container, **fields):
+        import api
+        return getattr(api.TicTacToeApi(), name)(
+            container.combined_message_class(**fields))
+
+    def test_rows_without_names_are_listed(self):
+        import api
+        import main
+        from models import User, Score, Ranking
+        user = User.create('a')
+        # written before player names were stored
+        Score(parent=user.key, user=user.key, date=datetime.date.today(),
+              result='win').put()
+        Ranking(key=Ranking.key_for(user.key), user=user.key,
+                winning_percent=1.0, wins=1).put()
+
+        for _ in range(2):
+            scores = self.call('get_scores', api.PAGE_REQUEST)
+            self.assertEqual([item.user for item in scores.items], ['a'])
+            ranks = self.call('get_user_rankings', api.PAGE_REQUEST)
+            self.assertEqual([item.user for item in ranks.items], ['a'])
+            for kind in ('Score', 'Ranking'):
+                response = webapp2.Request.blank(
+                    '/tasks/backfill_names', POST={'kind': kind}
+                ).get_response(main.app)
+                self.assertEqual(response.status_int, 204)
+
+    def test_finished_backfill_is_remembered(self):
+        from models import Backfill
+        self.assertFalse(Backfill.is_finished('names-Score'))
+        Backfill(id='names-Score').put()
+        self.assertTrue(Backfill.is_finished('names-Score'))
+        Backfill.get_by_id('names-Score').key.delete()
+        self.assertTrue(Backfill.is_finished('names-Score'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""test_make_move.py - Moves applied in a transaction while another move on
+the same game commits, on the datastore stub."""
+
+import os
+import unittest
+
+import endpoints
+from google.appengine.ext import ndb, testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ApplyMoveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        # endpoints reads the app revision from the version id on import
+        self.testbed.setup_env(current_version_id='v1.1')
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        ndb.get_context().set_cache_policy(False)
+        import api
+        from models import Game
+        self.api = api
+        for name in ('a', 'b'):
+            self.call('create_user', api.USER_REQUEST, user_name=name,
+                      email='{}@example.com'.format(name))
+        form = self.call('new_game', api.NEW_GAME_REQUEST, player1='a',
+                         player2='b')
+        self.game_key = ndb.Key(urlsafe=form.urlsafe_key)
+        self.first = form.next_turn
+        self.play = Game.play
+
+    def tearDown(self):
+        from models import Game
+        Game.play = self.play
+        self.testbed.deactivate()
+
+    def call(self, name, container, **fields):
+        return getattr(self.api.TicTacToeApi(), name)(
+            container.combined_message_class(**fields))
+
+    def move(self, player, cell):
+        return self.call('make_move', self.api.MAKE_MOVE_REQUEST,
+                         urlsafe_game_key=self.game_key.urlsafe(),
+                         player=player, move=cell)
+
+    def interleave(self, times, cell=None):
+        """Makes the next times attempts of _apply_move race another request
+        that commits a move on cell, or just rewrites the game"""
+        from models import Game
+        attempts = []
+        play = self.play
+
+        @ndb.non_transactional
+        def concurrent_write():
+            game = self.game_key.get()
+            if cell is not None:
+                play(game, game.get_board(), game.next_turn, cell)
+            game.put()
+
+        def racing_play(game, board, player, move):
+            attempts.append(player)
+            if len(attempts) <= times:
+                concurrent_write()
+            return play(game, board, player, move)
+        Game.play = racing_play
+        return attempts
+
+    def test_retry_sees_the_move_that_won(self):
+        # the same player moves from two devices at once
+        attempts = self.interleave(1, cell=0)
+        form = self.move(self.first, 4)
+        self.assertEqual(len(attempts), 1)
+        self.assertEqual(form.message,
+                         'It is {} turn to play'.format(form.next_turn))
+        self.assertNotEqual(form.next_turn, self.first)
+        board = self.game_key.get().get_board()
+        self.assertFalse(board.is_free(0))
+        self.assertTrue(board.is_free(4))
+
+    def test_retry_applies_the_move_again(self):
+        attempts = self.interleave(1)
+        form = self.move(self.first, 4)
+        self.assertEqual(len(attempts), 2)
+        self.assertNotEqual(form.next_turn, self.first)
+        game = self.game_key.get()
+        self.assertFalse(game.get_board().is_free(4))
+        self.assertEqual(game.get_moves(), [4])
+
+    def test_too_much_contention_is_a_conflict(self):
+        attempts = self.interleave(self.api.MOVE_RETRIES + 1)
+        with self.assertRaises(endpoints.ConflictException):
+            self.move(self.first, 4)
+        self.assertEqual(len(attempts), self.api.MOVE_RETRIES + 1)
+        self.assertTrue(self.game_key.get().get_board().is_free(4))
+
+if __name__ == '__main__':
+    unittest.main()
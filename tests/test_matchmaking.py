@@ -0,0 +1,90 @@
+"""test_matchmaking.py - Pairing runs of the matchmaking pool on the
+datastore and task queue stubs."""
+
+import os
+import unittest
+
+from google.appengine.ext import ndb, testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PairBandTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().set_cache_policy(False)
+        import matchmaking
+        self.matchmaking = matchmaking
+        self.band = matchmaking.BANDS // 2
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def join(self, *names):
+        from models import User, UserName
+        for name in names:
+            User.create(name, '{}@example.com'.format(name))
+            self.matchmaking.join(UserName.get_by_id(name))
+
+    def tasks(self, url):
+        return self.taskqueue.get_filtered_tasks(url=url)
+
+    def waiting(self):
+        pools = ndb.get_multi([self.matchmaking._pool_key(self.band, shard)
+                               for shard in range(self.matchmaking.SHARDS)])
+        return sorted(row[1] for pool in pools if pool
+                      for row in pool.waiting or [])
+
+    def test_left_over_player_gets_another_run(self):
+        self.join('a', 'b', 'c')
+        runs = self.tasks('/tasks/match_pairs')
+        self.assertEqual(self.matchmaking.pair_band(self.band, 1), 1)
+        self.assertEqual(self.waiting(), ['c'])
+        followups = self.tasks('/tasks/match_pairs')[len(runs):]
+        self.assertEqual(len(followups), 1)
+        self.assertGreater(followups[0].eta_posix, runs[-1].eta_posix)
+
+        # the next run pairs the late joiner with the player left over
+        self.join('d')
+        self.assertEqual(self.matchmaking.pair_band(self.band, 2), 1)
+        self.assertEqual(self.waiting(), [])
+        self.assertEqual(len(self.tasks('/tasks/match_batch')), 2)
+
+    def test_even_pool_needs_no_other_run(self):
+        self.join('a', 'b')
+        runs = len(self.tasks('/tasks/match_pairs'))
+        self.assertEqual(self.matchmaking.pair_band(self.band, 1), 1)
+        self.assertEqual(len(self.tasks('/tasks/match_pairs')), runs)
+
+    def test_retried_run_pairs_nobody_twice(self):
+        self.join('a', 'b', 'c', 'd')
+        self.assertEqual(self.matchmaking.pair_band(self.band, 1), 2)
+        self.join('e', 'f')
+        self.assertEqual(self.matchmaking.pair_band(self.band, 1), 2)
+        self.assertEqual(len(self.tasks('/tasks/match_batch')), 1)
+        self.assertEqual(self.waiting(), ['e', 'f'])
+
+    def test_games_are_created_once(self):
+        from models import Game, MatchTicket, UserName
+        self.join('a', 'b', 'c', 'd')
+        self.matchmaking.pair_band(self.band, 1)
+        batch_id = self.tasks('/tasks/match_batch')[0].extract_params()[
+            'batch']
+        for _ in range(2):
+            self.matchmaking.create_games(batch_id)
+        games = Game.query().fetch()
+        self.assertEqual(len(games), 2)
+        for name in 'abcd':
+            ticket = MatchTicket.key_for(
+                UserName.get_by_id(name).user).get()
+            self.assertIn(ticket.game, [game.key for game in games])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""test_notifications.py - Turn notification tasks on the task queue
+stub."""
+
+import os
+import unittest
+
+from google.appengine.ext import ndb, testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TurnNotificationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def queued(self):
+        return self.taskqueue.get_filtered_tasks(url='/tasks/send_reminder')
+
+    def test_notifications_in_a_window_are_coalesced(self):
+        import notifications
+        user_key, game_key = ndb.Key('User', 1), ndb.Key('Game', 2)
+        other_key = ndb.Key('User', 3)
+        for now in (1000, 1010):
+            notifications.wait_queued(notifications.queue_turn_notifications(
+                [notifications.turn_notification_task(user_key, game_key,
+                                                      now)]))
+        self.assertEqual(len(self.queued()), 1)
+
+        # a batch with a coalesced task still adds the others
+        notifications.wait_queued(notifications.queue_turn_notifications([
+            notifications.turn_notification_task(user_key, game_key, 1015),
+            notifications.turn_notification_task(other_key, game_key, 1015)]))
+        self.assertEqual(len(self.queued()), 2)
+
+        notifications.wait_queued(notifications.queue_turn_notifications(
+            [notifications.turn_notification_task(user_key, game_key,
+                                                  1000 + 80)]))
+        self.assertEqual(len(self.queued()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""test_ranking.py - Recounting Rankings from Score records on the
+datastore stub."""
+
+import datetime
+import unittest
+
+from google.appengine.ext import ndb, testbed
+
+
+class RankingRebuildTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_counts_scores(self):
+        from models import User, Ranking, Score
+        user_key = User(name='a', email='a@example.com').put()
+        for result in ('win', 'tie'):
+            Score(parent=user_key, user=user_key, user_name='a',
+                  date=datetime.date.today(), result=result).put()
+        ranking = Ranking.rebuild(user_key)
+        self.assertEqual((ranking.wins, ranking.ties), (1, 1))
+        self.assertEqual(ranking.winning_percent, 0.75)
+
+    def test_user_without_games_has_no_ranking(self):
+        from models import User, Ranking
+        user_key = User(name='a', email='a@example.com').put()
+        Ranking(key=Ranking.key_for(user_key), user=user_key).put()
+        self.assertIsNone(Ranking.rebuild(user_key))
+        self.assertIsNone(Ranking.key_for(user_key).get())
+
+    def test_missing_user_has_no_ranking(self):
+        from models import Ranking
+        self.assertIsNone(Ranking.rebuild(ndb.Key('User', 42)))
+
+
+if __name__ == '__main__':
+    unittest.main()
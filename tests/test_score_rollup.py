@@ -0,0 +1,89 @@
+"""test_score_rollup.py - Daily score rollups, kept with the Scores and
+recounted from them, and the summary mode of get_user_scores."""
+
+import datetime
+import os
+import unittest
+
+import endpoints
+from google.appengine.ext import ndb, testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ScoreRollupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        # endpoints reads the app revision from the version id on import
+        self.testbed.setup_env(current_version_id='v1.1')
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        ndb.get_context().set_cache_policy(False)
+        from models import User
+        self.user = User.create('a')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def score(self, days_ago, result):
+        from models import Score
+        Score(parent=self.user.key, user=self.user.key, user_name='a',
+              date=datetime.date.today() - datetime.timedelta(days_ago),
+              result=result).put()
+
+    def rollups(self):
+        from models import ScoreRollup
+        return [(rollup.date, rollup.wins, rollup.losses, rollup.ties)
+                for rollup in ScoreRollup.query(
+                    ancestor=self.user.key).order(ScoreRollup.date)]
+
+    def test_results_update_todays_rollup(self):
+        from models import Score, record_results
+        for result in ('win', 'tie', 'win'):
+            record_results([(self.user.key, 'a', result)])
+        self.assertEqual(self.rollups(),
+                         [(datetime.date.today(), 2, 0, 1)])
+        self.assertEqual(Score.query(ancestor=self.user.key).count(), 3)
+
+    def test_rebuild_matches_the_scores(self):
+        from models import ScoreRollup
+        for days_ago, result in ((2, 'win'), (2, 'lose'), (1, 'tie'),
+                                 (0, 'win')):
+            self.score(days_ago, result)
+        ScoreRollup.rebuild_async(self.user.key).check_success()
+        today = datetime.date.today()
+        self.assertEqual(self.rollups(), [
+            (today - datetime.timedelta(2), 1, 1, 0),
+            (today - datetime.timedelta(1), 0, 0, 1),
+            (today, 1, 0, 0)])
+        # recounting again changes nothing
+        ScoreRollup.rebuild_async(self.user.key).check_success()
+        self.assertEqual(len(self.rollups()), 3)
+
+    def test_summary_mode(self):
+        import api
+        from models import ScoreRollup
+        for days_ago in (3, 2, 1):
+            self.score(days_ago, 'win')
+        ScoreRollup.rebuild_async(self.user.key).check_success()
+        service = api.TicTacToeApi()
+        request = api.USER_SCORES_REQUEST.combined_message_class
+
+        start = datetime.date.today() - datetime.timedelta(2)
+        summary = service.get_user_scores(request(
+            user_name='a', summary=True, start_date=start.isoformat()))
+        self.assertEqual([day.date for day in summary.days],
+                         [str(start), str(start + datetime.timedelta(1))])
+        self.assertEqual(summary.items, [])
+
+        for fields in ({'start_date': start.isoformat()},
+                       {'summary': True, 'end_date': '2016-13-01'}):
+            with self.assertRaises(endpoints.BadRequestException):
+                service.get_user_scores(request(user_name='a', **fields))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""test_transfer.py - Replay validation of imported games and the writing
+of imported users on the datastore stub."""
+
+import unittest
+
+from google.appengine.ext import ndb, testbed
+
+
+def game_record(moves, **fields):
+    record = {'kind': 'Game', 'key': ['Game', 7],
+              'player1': ['User', 1], 'player2': ['User', 2],
+              'player1_name': 'a', 'player2_name': 'b', 'size': 3,
+              'win_length': 3, 'first_player': 1, 'moves': moves,
+              'game_over': False, 'next_turn': 'a', 'difficulty': None}
+    record.update(fields)
+    return record
+
+
+class ReplayGameTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_replays_a_won_game(self):
+        import transfer
+        game = transfer.replay_game(game_record(
+            [0, 3, 1, 4, 2], game_over=True))
+        self.assertEqual(game.get_board().to_list()[:3], ['O', 'O', 'O'])
+        self.assertEqual(game.get_moves(), [0, 3, 1, 4, 2])
+
+    def test_rejects_records_that_break_the_rules(self):
+        import transfer
+        invalid = [
+            game_record([0, 0]),
+            game_record([0, 9]),
+            game_record([0, 3, 1, 4, 2, 5], game_over=True),
+            game_record([0, 3, 1, 4, 2]),
+            game_record([0, 3], next_turn='b'),
+            game_record([0], first_player=3),
+            game_record([0], board=0),
+            game_record([], size=6),
+        ]
+        for record in invalid:
+            with self.assertRaises(ValueError):
+                transfer.replay_game(record)
+
+    def test_invalid_records_are_counted(self):
+        import transfer
+        entities, counts = transfer.import_records([
+            game_record([0, 3, 1], next_turn='b'), game_record([0, 0]),
+            {'kind': 'Nope'}])
+        self.assertEqual(len(entities), 1)
+        self.assertEqual(counts, {'Game': 1, 'invalid': 2})
+
+
+class WriteUsersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def import_users(self, *users):
+        import transfer
+        entities, counts = transfer.import_records([
+            {'kind': 'User', 'key': ['User', user_id], 'name': name,
+             'email': None} for user_id, name in users])
+        transfer.write_records(entities, counts)
+        return counts
+
+    def test_imported_ids_are_not_allocated_again(self):
+        from models import User
+        self.import_users((1000, 'a'))
+        self.assertGreater(User.create('b').key.id(), 1000)
+        self.assertEqual(User.get_by_name('a').key.id(), 1000)
+
+    def test_taken_names_are_conflicts(self):
+        from models import User
+        existing = User.create('a')
+        counts = self.import_users((1000, 'a'), (1001, 'b'))
+        self.assertEqual(counts, {'User': 1, 'conflict': 1})
+        self.assertEqual(User.get_by_name('a').key, existing.key)
+        self.assertIsNone(ndb.Key('User', 1000).get())
+
+    def test_importing_twice_is_harmless(self):
+        self.assertEqual(self.import_users((1000, 'a')), {'User': 1})
+        self.assertEqual(self.import_users((1000, 'a')), {'User': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""test_wait_for_move.py - The wait_for_move long-poll on the datastore and
+memcache stubs."""
+
+import os
+import unittest
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.ext import ndb, testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class WaitForMoveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        # endpoints reads the app revision from the version id on import
+        self.testbed.setup_env(current_version_id='v1.1')
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        ndb.get_context().set_cache_policy(False)
+        import api
+        self.api = api
+        for name in ('a', 'b'):
+            self.call('create_user', api.USER_REQUEST, user_name=name,
+                      email='{}@example.com'.format(name))
+        self.game = self.call('new_game', api.NEW_GAME_REQUEST,
+                              player1='a', player2='b')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def call(self, name, container, **fields):
+        return getattr(self.api.TicTacToeApi(), name)(
+            container.combined_message_class(**fields))
+
+    def wait(self, known, timeout=0):
+        return self.call('wait_for_move', self.api.WAIT_REQUEST,
+                         urlsafe_game_key=self.game.urlsafe_key,
+                         known_moves=known, timeout=timeout)
+
+    def move(self):
+        return self.call('make_move', self.api.MAKE_MOVE_REQUEST,
+                         urlsafe_game_key=self.game.urlsafe_key,
+                         player=self.game.next_turn, move=4)
+
+    def test_times_out_without_a_move(self):
+        form = self.wait(0)
+        self.assertEqual(form.message, 'No new move yet')
+
+    def test_returns_the_move(self):
+        moved = self.move()
+        form = self.wait(0)
+        self.assertEqual(form.board, moved.board)
+        self.assertEqual(form.message, 'Time to make a move!')
+
+    def test_reseeds_an_evicted_version(self):
+        self.move()
+        memcache.flush_all()
+        self.assertEqual(self.wait(1).message, 'No new move yet')
+        self.assertEqual(self.api.game_cache.get_version(
+            self.game.urlsafe_key), 1)
+
+    def test_wait_is_capped(self):
+        waited = []
+        wait_for_version = self.api.game_cache.wait_for_version
+        self.api.game_cache.wait_for_version = \
+            lambda key, known, timeout: waited.append(timeout) or known
+        try:
+            self.wait(0, timeout=600)
+        finally:
+            self.api.game_cache.wait_for_version = wait_for_version
+        self.assertLessEqual(waited[0], self.api.MAX_WAIT_SECONDS)
+
+    def test_cancelled_game_is_not_found(self):
+        self.call('cancel_game', self.api.GET_GAME_REQUEST,
+                  urlsafe_game_key=self.game.urlsafe_key)
+        with self.assertRaises(endpoints.NotFoundException):
+            self.wait(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+"""transfer.py - Bulk export and import of users, games, scores and rankings.
+An export is a chain of tasks, each writing one page of one kind as
+newline-delimited JSON records into a TransferChunk under the TransferJob;
+read in page order the chunks form the export file. An import reads the
+chunks of a finished export back page by page, replays every game through the
+move rules before writing it and finally recounts every Ranking. Each task
+commits its page together with the job's progress and the next task, so a
+chain that stops at any page resumes from the last committed one when its
+task is retried."""
+
+import datetime
+import json
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import engine
+from models import User, UserName, Game, GameArchive, Score, Ranking,\
+    UserCache, TransferJob, TransferChunk
+
+EXPORT = 'export'
+IMPORT = 'import'
+URLS = {EXPORT: '/tasks/export', IMPORT: '/tasks/import'}
+# kinds in export order, users come first so they exist before their games
+KINDS = ('User', 'Game', 'GameArchive', 'Score', 'Ranking')
+MODELS = {'User': User, 'Game': Game, 'GameArchive': GameArchive,
+          'Score': Score, 'Ranking': Ranking}
+# entities exported by each task, and so records imported by each task
+PAGE_SIZE = 500
+
+
+def _flat(key):
+    # keys are exported without the application id so an export can be
+    # imported into another application
+    return list(key.flat())
+
+
+def start(operation, source=None):
+    """Creates a TransferJob and queues its first page. An import reads
+    the export job with id source, which must have finished"""
+    if operation == IMPORT:
+        export = TransferJob.get_by_id(source) if source else None
+        if not export or export.operation != EXPORT or not export.done:
+            raise ValueError('source must be a finished export job')
+    job = TransferJob(operation=operation, source=source, counts={})
+    job.put()
+    _queue_page(job)
+    return job
+
+
+def _queue_page(job, transactional=False):
+    taskqueue.add(params={'job': job.key.id(), 'page': job.page},
+                  url=URLS[job.operation], transactional=transactional)
+
+
+@ndb.transactional
+def _commit(job, page, chunk=None):
+    """Writes the progress made on page (and its chunk) and queues the next
+    page, unless another run of the same task committed page first"""
+    if job.key.get().page != page:
+        return
+    ndb.put_multi([job] + ([chunk] if chunk else []))
+    if not job.done:
+        _queue_page(job, transactional=True)
+    elif job.operation == IMPORT:
+        # imported Rankings are not trusted, every user is recounted from
+        # the imported scores, as are their daily rollups. The players'
+        # ActiveGames are derived data too and are rebuilt from the
+        # imported games
+        taskqueue.add(url='/tasks/backfill_rankings', transactional=True)
+        taskqueue.add(url='/tasks/backfill_score_rollups',
+                      transactional=True)
+        taskqueue.add(url='/tasks/backfill_active_games', transactional=True)
+
+
+def _load(job_id, page):
+    """Returns the job if page is the next page to process, else None"""
+    job = TransferJob.get_by_id(job_id)
+    if not job or job.done or job.page != page:
+        # an earlier run of this task already committed the page
+        return None
+    return job
+
+
+def export_record(entity, users):
+    """Returns the JSON-ready record of one exported entity"""
+    kind = entity.key.kind()
+    record = {'kind': kind, 'key': _flat(entity.key)}
+    if kind == 'User':
+        record.update(name=entity.name, email=entity.email)
+    elif isinstance(entity, Game):
+        entity.fill_names(users)
+        entity.pack_history()
+        record.update(player1=_flat(entity.player1),
+                      player2=_flat(entity.player2),
+                      player1_name=entity.player1_name,
+                      player2_name=entity.player2_name,
+                      next_turn=entity.next_turn,
+                      game_over=entity.game_over,
+                      size=entity.size,
+                      win_length=entity.win_length,
+                      difficulty=entity.difficulty,
+                      first_player=entity.first_player,
+                      moves=entity.get_moves(),
+                      board=entity.get_board().encode())
+    else:
+        record.update(user=_flat(entity.user),
+                      user_name=entity.user_name or users.name(entity.user))
+        if kind == 'Score':
+            record.update(date=entity.date.isoformat(), result=entity.result)
+        else:
+            record.update(wins=entity.wins, losses=entity.losses,
+                          ties=entity.ties)
+    return record
+
+
+def export_page(job_id, page):
+    """Writes one page of an export. Returns False if the page had already
+    been written"""
+    job = _load(job_id, page)
+    if not job:
+        return False
+    kind = KINDS[job.stage]
+    cursor = ndb.Cursor(urlsafe=job.cursor) if job.cursor else None
+    entities, next_cursor, more = MODELS[kind].query().fetch_page(
+        PAGE_SIZE, start_cursor=cursor)
+
+    users = UserCache()
+    if kind in ('Game', 'GameArchive'):
+        users.prefetch(key for game in entities if not game.player2_name
+                       for key in (game.player1, game.player2))
+    elif kind != 'User':
+        users.prefetch(entity.user for entity in entities
+                       if not entity.user_name)
+    data = ''.join(json.dumps(export_record(entity, users),
+                              separators=(',', ':')) + '\n'
+                   for entity in entities)
+    # pages without records still get a chunk, so chunks are numbered
+    # without gaps
+    chunk = TransferChunk(parent=job.key, id=page + 1, data=data)
+
+    job.counts[kind] = job.counts.get(kind, 0) + len(entities)
+    if more and next_cursor:
+        job.cursor = next_cursor.urlsafe()
+    else:
+        job.cursor = None
+        job.stage += 1
+        job.done = job.stage == len(KINDS)
+    job.page += 1
+    _commit(job, page, chunk)
+    return True
+
+
+def replay_game(record):
+    """Builds a Game or GameArchive from its export record by replaying
+    its moves on an empty board. Raises ValueError if the moves break the
+    rules or do not match the recorded state. Games created before move
+    history was kept have no moves and are imported with their recorded
+    board"""
+    engine.validate(record['size'], record['win_length'])
+    names = {engine.PLAYER1: record['player1_name'],
+             engine.PLAYER2: record['player2_name']}
+    moves = record['moves']
+    if not moves:
+        board = engine.Board.decode(record['board'], record['size'],
+                                    record['win_length'])
+    else:
+        board = engine.Board(record['size'], record['win_length'])
+        player = record['first_player']
+        if player not in names:
+            raise ValueError('first_player must be 1 or 2')
+        won = False
+        for move in moves:
+            if won:
+                raise ValueError('move after the game was won')
+            if not board.is_valid_cell(move) or not board.is_free(move):
+                raise ValueError('illegal move {}'.format(move))
+            board.place(move, player)
+            won = board.is_winning_move(move, player)
+            player = engine.PLAYER2 if player == engine.PLAYER1 \
+                else engine.PLAYER1
+        if record.get('board') not in (None, board.encode()):
+            raise ValueError('board does not match the moves')
+        if record['game_over'] != (won or board.is_full()):
+            raise ValueError('game_over does not match the moves')
+        if not record['game_over'] and record['next_turn'] != names[player]:
+            raise ValueError('next_turn does not match the moves')
+    if record['next_turn'] not in names.values():
+        raise ValueError('next_turn is not a player')
+
+    model = MODELS[record['kind']]
+    game = model(key=ndb.Key(flat=record['key']),
+                 player1=ndb.Key(flat=record['player1']),
+                 player2=ndb.Key(flat=record['player2']),
+                 player1_name=names[engine.PLAYER1],
+                 player2_name=names[engine.PLAYER2],
+                 next_turn=record['next_turn'],
+                 game_over=record['game_over'],
+                 difficulty=record.get('difficulty'),
+                 first_player=record['first_player'] if moves else None,
+                 moves=''.join(chr(move) for move in moves))
+    game.set_board(board)
+    return game
+
+
+def import_records(records):
+    """Returns (entities to write, counts per kind) for a list of export
+    records. Invalid records are logged and counted as 'invalid'"""
+    entities = []
+    counts = {}
+    for record in records:
+        kind = record.get('kind')
+        try:
+            if kind == 'User':
+                # the name index is claimed when the user is written
+                entities.append(User(key=ndb.Key(flat=record['key']),
+                                     name=record['name'],
+                                     email=record['email']))
+            elif kind in ('Game', 'GameArchive'):
+                entities.append(replay_game(record))
+            elif kind == 'Score':
+                if record['result'] not in ('win', 'lose', 'tie'):
+                    raise ValueError('unknown result')
+                entities.append(Score(
+                    key=ndb.Key(flat=record['key']),
+                    user=ndb.Key(flat=record['user']),
+                    user_name=record['user_name'],
+                    date=datetime.datetime.strptime(
+                        record['date'], '%Y-%m-%d').date(),
+                    result=record['result']))
+            elif kind != 'Ranking':
+                # Rankings are recounted from the scores once the import
+                # is done, so their records are only counted
+                raise ValueError('unknown kind')
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning('Skipping invalid %s record %s: %s', kind,
+                            record.get('key'), e)
+            kind = 'invalid'
+        counts[kind] = counts.get(kind, 0) + 1
+    return entities, counts
+
+
+def _reserve_ids(entities):
+    """Reserves the numeric ids of imported entities, so ids allocated
+    later (User.create uses allocate_ids) never reuse them"""
+    highest = {}
+    for entity in entities:
+        key = entity.key
+        if isinstance(key.id(), (int, long)):
+            group = (type(entity), key.parent())
+            highest[group] = max(highest.get(group, 0), key.id())
+    for future in [model.allocate_ids_async(max=top, parent=parent)
+                   for (model, parent), top in highest.items()]:
+        future.check_success()
+
+
+@ndb.transactional_tasklet(xg=True)
+def _claim_async(user):
+    """Writes an imported user together with its name index. Returns False
+    without writing anything if the name or the key already belongs to
+    another user; importing the same user again is harmless"""
+    index, current = yield (UserName.get_by_id_async(user.name),
+                            user.key.get_async())
+    if (index and index.user != user.key) or \
+            (current and current.name != user.name):
+        raise ndb.Return(False)
+    yield ndb.put_multi_async([UserName(id=user.name, user=user.key), user])
+    raise ndb.Return(True)
+
+
+def write_records(entities, counts):
+    """Writes the entities of import_records. Users are written one
+    transaction each so names stay unique; users clashing with an existing
+    user are skipped and counted as 'conflict'"""
+    _reserve_ids(entities)
+    users = [entity for entity in entities if isinstance(entity, User)]
+    claims = [_claim_async(user) for user in users]
+    ndb.put_multi([entity for entity in entities
+                   if not isinstance(entity, User)])
+    for user, claim in zip(users, claims):
+        if not claim.get_result():
+            logging.warning('Skipping user %s: the name or id is taken',
+                            user.name)
+            counts['User'] -= 1
+            counts['conflict'] = counts.get('conflict', 0) + 1
+
+
+def import_page(job_id, page):
+    """Reads one chunk of the source export and writes its records.
+    Returns False if the page had already been imported"""
+    job = _load(job_id, page)
+    if not job:
+        return False
+    chunk = TransferChunk.get_by_id(page + 1,
+                                    parent=ndb.Key(TransferJob, job.source))
+    if chunk:
+        records = [json.loads(line) for line in chunk.data.splitlines()
+                   if line]
+        entities, counts = import_records(records)
+        # writing the same records twice is harmless, so a task that fails
+        # after this point simply imports the page again
+        write_records(entities, counts)
+        for kind, count in counts.items():
+            job.counts[kind] = job.counts.get(kind, 0) + count
+    else:
+        job.done = True
+    job.page += 1
+    _commit(job, page)
+    return True
@@ -1,22 +1,24 @@
 """utils.py - File for collecting general utility functions."""
 
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
 import endpoints
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
-def get_by_urlsafe(urlsafe, model):
-    """Returns an ndb.Model entity that the urlsafe key points to. Checks
-        that the type of entity returned is of the correct kind. Raises an
-        error if the key String is malformed or the entity is of the incorrect
-        kind
+
+def get_key_by_urlsafe(urlsafe, model):
+    """Returns the ndb.Key a urlsafe key string points to. Checks that the
+        key is of the expected kind without reading the entity
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
     Returns:
-        The entity that the urlsafe Key string points to or None if no entity
-        exists.
+        The ndb.Key the urlsafe Key string points to.
     Raises:
-        ValueError:"""
+        endpoints.BadRequestException: If the key String is malformed
+        ValueError: If the key is of the incorrect kind"""
     try:
         key = ndb.Key(urlsafe=urlsafe)
     except TypeError:
@@ -27,9 +29,76 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
+    if key.kind() != model._get_kind():
+        raise ValueError('Incorrect Kind')
+    return key
+
+
+def get_by_urlsafe(urlsafe, model):
+    """Returns an ndb.Model entity that the urlsafe key points to. Checks
+        that the type of entity returned is of the correct kind. Raises an
+        error if the key String is malformed or the entity is of the incorrect
+        kind
+    Args:
+        urlsafe: A urlsafe key string
+        model: The expected entity kind
+    Returns:
+        The entity that the urlsafe Key string points to or None if no entity
+        exists.
+    Raises:
+        ValueError:"""
+    entity = get_key_by_urlsafe(urlsafe, model).get()
     if not entity:
         return None
-    if not isinstance(entity, model):
-        raise ValueError('Incorrect Kind')
     return entity
+
+
+def fetch_page(query, limit=None, cursor=None, **options):
+    """Fetches one page of query results.
+    Args:
+        query: The ndb.Query to page through
+        limit: Requested page size, clamped to 1..MAX_PAGE_SIZE
+        cursor: urlsafe cursor returned with the previous page, or None for
+            the first page
+        options: Extra query options such as projection
+    Returns:
+        A (results, next_cursor) tuple where next_cursor is the urlsafe
+        cursor of the following page or None if this is the last page.
+    Raises:
+        endpoints.BadRequestException: If the cursor is malformed"""
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    try:
+        start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+        results, next_cursor, more = query.fetch_page(
+            limit, start_cursor=start_cursor, **options)
+    except (datastore_errors.BadValueError,
+            datastore_errors.BadArgumentError,
+            datastore_errors.BadRequestError):
+        raise endpoints.BadRequestException('Invalid cursor')
+    if more and next_cursor:
+        return results, next_cursor.urlsafe()
+    return results, None
+
+
+def page_list(items, limit=None, cursor=None):
+    """Returns one page of an in-memory list, for results read from a
+    single entity rather than a query.
+    Args:
+        items: The list to page through
+        limit: Requested page size, clamped to 1..MAX_PAGE_SIZE
+        cursor: cursor returned with the previous page, or None for the
+            first page
+    Returns:
+        A (items, next_cursor) tuple where next_cursor is None if this is
+        the last page.
+    Raises:
+        endpoints.BadRequestException: If the cursor is malformed"""
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    try:
+        start = int(cursor) if cursor else 0
+    except ValueError:
+        raise endpoints.BadRequestException('Invalid cursor')
+    if start < 0:
+        raise endpoints.BadRequestException('Invalid cursor')
+    end = start + limit
+    return items[start:end], str(end) if end < len(items) else None